@@ -0,0 +1,386 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+Benchmark the collect() pipeline on the test/ samples, synthetically scaled.
+
+    python benchmark.py --repeat 20 --output before.json
+    python benchmark.py --repeat 20 --output after.json --compare before.json
+    python benchmark.py --no-legacy --pool 1,2,4
+    python benchmark.py --no-legacy -s baseline --logging
+'''
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from concurrent.futures import ThreadPoolExecutor
+
+import jmx_fixtures
+import rates
+import utils
+import workers
+from scheduler import Snapshot, SnapshotStore
+from hadoop_exporter import NameNodeMetricsCollector, ResourceManagerMetricsCollector, common_metrics_info
+
+# name, builder of (NameNode beans, ResourceManager beans), most scrapes of the legacy cases (they take seconds at scale).
+SCENARIOS = [
+    ('baseline', lambda: (jmx_fixtures.namenode_beans(), jmx_fixtures.resourcemanager_beans()), None),
+    ('rpc_methods_2000', lambda: (jmx_fixtures.namenode_beans(rpc_methods=2000),
+                                  jmx_fixtures.resourcemanager_beans(rpc_methods=2000)), None),
+    ('rpc_ports_20', lambda: (jmx_fixtures.namenode_beans(rpc_ports=20, rpc_methods=100),
+                              jmx_fixtures.resourcemanager_beans(rpc_ports=20, rpc_methods=100)), None),
+    ('nodemanagers_5000', lambda: (jmx_fixtures.namenode_beans(),
+                                   jmx_fixtures.resourcemanager_beans(node_manager_count=5000)), 1),
+]
+
+
+def _drain(collector):
+    '''
+    @return the number of samples the collector yields.
+    '''
+    return sum(len(family.samples) for family in collector.collect())
+
+
+class _Legacy(object):
+    # run the legacy_collect of a collector through the same _drain.
+
+    def __init__(self, collector):
+        self._collector = collector
+
+    def collect(self):
+        return self._collector.legacy_collect()
+
+
+class _Common(object):
+    # common_metrics_info as it is called by the legacy collectors.
+
+    def __init__(self, cluster, store, key, service):
+        self._cluster = cluster
+        self._store = store
+        self._key = key
+        self._service = service
+
+    def collect(self):
+        common_metrics = common_metrics_info(self._cluster, self._store.latest(self._key).beans, self._service)()
+        for families in common_metrics.values():
+            for family in families.values():
+                yield family
+
+
+class _Derive(object):
+    # add the latest snapshot to the RateDeriver of a collector like the scheduler does, then read the rates.
+
+    def __init__(self, collector, store, key):
+        self._collector = collector
+        self._store = store
+        self._key = key
+
+    def collect(self):
+        self._collector.rates.on_snapshot(self._store.latest(self._key))
+        return self._collector.rates.collect(['benchmark'])
+
+
+def measure(name, collector, store, key, beans, repeat):
+    '''
+    Scrape the collector repeat times, each one against a freshly published snapshot, so derived data
+    (bean index, decoded RMNMInfo) is paid by every scrape like the first scrape after a poll.
+    @return a dict of results, without the memory, see measure_memory.
+    '''
+    timings = []
+    samples = 0
+    for _ in range(repeat):
+        store.publish(key, Snapshot('benchmark', beans, time.time()))
+        gc.collect()
+        start = time.time()
+        samples = _drain(collector)
+        timings.append(time.time() - start)
+
+    timings.sort()
+    median = timings[len(timings) // 2]
+    return {
+        'name': name,
+        'beans': len(beans),
+        'samples': samples,
+        'repeat': repeat,
+        'scrape_seconds_median': median,
+        'scrape_seconds_min': timings[0],
+        'scrape_seconds_max': timings[-1],
+        'bean_seconds_median': median / len(beans) if beans else 0.0,
+    }
+
+
+def measure_memory(collector, store, key, beans):
+    '''
+    Scrape the collector once and measure its peak memory: traced by tracemalloc, or without it (python 2) the growth
+    of the resident memory, sampled every millisecond by a thread while the scrape runs. Run it in a fresh process,
+    see _memory_in_subprocess, memory freed by an earlier scrape is reused without growing the resident memory.
+    @return the peak memory in bytes.
+    '''
+    store.publish(key, Snapshot('benchmark', beans, time.time()))
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+        _drain(collector)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+    before = utils.get_process_memory()[0]
+    peak = [before]
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            peak[0] = max(peak[0], utils.get_process_memory()[0])
+            time.sleep(0.001)
+
+    sampler = threading.Thread(target=sample, name="memory-sampler")
+    sampler.start()
+    try:
+        _drain(collector)
+    finally:
+        done.set()
+        sampler.join()
+    return max(0, max(peak[0], utils.get_process_memory()[0]) - before)
+
+
+def _memory_in_subprocess(scenario, name):
+    '''
+    @return the peak memory in bytes of the case measured by measure_memory in a process of its own.
+    '''
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--memory-case', scenario, name])
+    return int(output.decode().strip().splitlines()[-1])
+
+
+def _cases(build, repeat, legacy_repeat, legacy):
+    '''
+    @return a tuple of (SnapshotStore, list of (name, collector, key, beans, scrapes)) of a scenario.
+    '''
+    nn_beans, rm_beans = build()
+    store = SnapshotStore()
+    nn = NameNodeMetricsCollector('benchmark', store, 'http://benchmark/jmx', 'namenode')
+    rm = ResourceManagerMetricsCollector('benchmark', store, 'http://benchmark/jmx', 'resourcemanager')
+    cases = [
+        ('namenode.collect', nn, 'namenode', nn_beans, repeat),
+        ('resourcemanager.collect', rm, 'resourcemanager', rm_beans, repeat),
+        ('common_metrics_info', _Common('benchmark', store, 'namenode', 'namenode'), 'namenode', nn_beans, repeat),
+        ('namenode.rates', _Derive(nn, store, 'namenode'), 'namenode', nn_beans, repeat),
+    ]
+    if legacy:
+        cases += [
+            ('namenode.legacy_collect', _Legacy(nn), 'namenode', nn_beans, min(repeat, legacy_repeat or repeat)),
+            ('resourcemanager.legacy_collect', _Legacy(rm), 'resourcemanager', rm_beans, min(repeat, legacy_repeat or repeat)),
+        ]
+    return store, cases
+
+
+def memory_case(scenario, name):
+    '''
+    Measure the peak memory of one case, called in the fresh process started by _memory_in_subprocess.
+    '''
+    for candidate, build, _ in SCENARIOS:
+        if candidate == scenario:
+            store, cases = _cases(build, 1, None, True)
+            for case, collector, key, beans, _ in cases:
+                if case == name:
+                    return measure_memory(collector, store, key, beans)
+    raise ValueError("unknown case {0} of {1}".format(name, scenario))
+
+
+def run(repeat, scenarios=None, legacy=True):
+    '''
+    @param repeat: Scrapes of every collector in every scenario.
+    @param scenarios: Names of the scenarios to run, all by default.
+    @param legacy: Also measure the legacy_collect of the collectors.
+    @return a list of result dicts.
+    '''
+    results = []
+    for scenario, build, legacy_repeat in SCENARIOS:
+        if scenarios and scenario not in scenarios:
+            continue
+        store, cases = _cases(build, repeat, legacy_repeat, legacy)
+        for name, collector, key, beans, count in cases:
+            result = measure(name, collector, store, key, beans, count)
+            result['scenario'] = scenario
+            result['peak_memory_bytes'] = _memory_in_subprocess(scenario, name)
+            result['peak_memory_source'] = 'tracemalloc' if tracemalloc is not None else 'rss_sampled'
+            results.append(result)
+            sys.stderr.write("{0:<20} {1:<32} {2:>10.3f} ms/scrape {3:>10.2f} us/bean {4:>12} bytes\n".format(
+                scenario, name, result['scrape_seconds_median'] * 1000, result['bean_seconds_median'] * 1e6,
+                result['peak_memory_bytes']))
+    return results
+
+
+def run_pool(repeat, worker_counts):
+    '''
+    Decode and classify the NameNode payload of the rpc_methods_2000 scenario serially in this process, then in a
+    workers.ClassifyPool of each size fed by as many threads as workers, like the fetcher threads of many targets.
+    @param repeat: Payloads per worker.
+    @param worker_counts: Pool sizes to measure.
+    @return a list of result dicts, payloads per second and the mean ipc cost of a payload.
+    '''
+    nn_beans, _ = SCENARIOS[1][1]()
+    body = jmx_fixtures.jmx_document(nn_beans).encode('utf-8')
+    classifier = workers.Classifier('namenode', ['namenode', 'common'], raw=['NameNodeInfo'] + list(rates.RATE_KINDS))
+    results = []
+    count = repeat * max(worker_counts)
+    gc.collect()
+    start = time.time()
+    for _ in range(count):
+        pickle.loads(workers.classify(classifier, body))
+    elapsed = time.time() - start
+    results.append({'name': 'serial', 'workers': 0, 'payloads': count, 'payload_bytes': len(body),
+                    'payloads_per_second': count / elapsed})
+    sys.stderr.write("{0:<12} {1:>10.1f} payloads/s\n".format('serial', count / elapsed))
+    for size in worker_counts:
+        pool = workers.ClassifyPool(size)
+        count = repeat * size
+        stats = [{} for _ in range(count)]
+        threads = ThreadPoolExecutor(max_workers=size)
+        gc.collect()
+        start = time.time()
+        list(threads.map(lambda s: pool.classify(classifier, body, stats=s), stats))
+        elapsed = time.time() - start
+        threads.shutdown()
+        pool.shutdown()
+        result = {
+            'name': 'pool', 'workers': size, 'payloads': count, 'payload_bytes': len(body),
+            'payloads_per_second': count / elapsed,
+            'ipc_seconds_mean': sum(s['ipc'] for s in stats) / count,
+            'ipc_bytes_mean': sum(s['ipc_bytes'] for s in stats) / count,
+            'worker_seconds_mean': sum(s['decode'] + s['classify'] for s in stats) / count,
+        }
+        results.append(result)
+        sys.stderr.write("{0:<12} {1:>10.1f} payloads/s {2:>8.2f} ms ipc {3:>10} ipc bytes {4:>8.2f} ms in worker\n".format(
+            'pool x{0}'.format(size), result['payloads_per_second'], result['ipc_seconds_mean'] * 1000,
+            result['ipc_bytes_mean'], result['worker_seconds_mean'] * 1000))
+    return results
+
+
+def run_logging(count):
+    '''
+    Measure what logging a failed fetch costs the thread logging it, e.g. a poll, with a decoded jmx document as
+    argument like the former logger.debug(result): written into a file by that thread, through utils.AsyncLogging,
+    and through utils.AsyncLogging with its rate limit, all records coming from one call site.
+    @param count: Records logged in every case.
+    @return a list of result dicts, latencies of one logger call.
+    '''
+    document = {'beans': jmx_fixtures.namenode_beans(rpc_methods=2000)}
+    fmt = logging.Formatter(fmt='%(asctime)s %(filename)s[line:%(lineno)d]-[%(levelname)s]: %(message)s')
+    results = []
+    for name, queued, rate_limit in [('sync_file', False, 0), ('async_queue', True, 0), ('async_rate_limited', True, 10)]:
+        fd, path = tempfile.mkstemp(suffix='.log')
+        os.close(fd)
+        handler = logging.FileHandler(path)
+        handler.setLevel(logging.ERROR)
+        handler.setFormatter(fmt)
+        pipeline = utils.AsyncLogging([handler], rate_limit=rate_limit) if queued else None
+        logger = logging.getLogger('benchmark.' + name)
+        logger.propagate = False
+        logger.setLevel(logging.ERROR)
+        logger.addHandler(pipeline.handler if queued else handler)
+        timings = []
+        gc.collect()
+        for _ in range(count):
+            start = time.time()
+            logger.error("Get %s failed, response is: %s", 'http://benchmark/jmx', document)
+            timings.append(time.time() - start)
+        if queued:
+            pipeline.stop(timeout=60)
+        handler.close()
+        size = os.path.getsize(path)
+        os.remove(path)
+        timings.sort()
+        result = {
+            'name': name, 'records': count, 'log_bytes': size,
+            'call_seconds_median': timings[len(timings) // 2],
+            'call_seconds_p99': timings[int(len(timings) * 0.99)],
+            'call_seconds_max': timings[-1],
+            'dropped': pipeline.handler.dropped if queued else 0,
+        }
+        results.append(result)
+        sys.stderr.write("{0:<20} {1:>10.1f} us median {2:>10.1f} us p99 {3:>12} log bytes {4:>6} dropped\n".format(
+            name, result['call_seconds_median'] * 1e6, result['call_seconds_p99'] * 1e6, size, result['dropped']))
+    return results
+
+
+def compare(results, baseline):
+    '''
+    Print the change of the median scrape time and peak memory against a previous output file.
+    '''
+    old = dict(((r['scenario'], r['name']), r) for r in baseline['results'])
+    for r in results:
+        o = old.get((r['scenario'], r['name']))
+        if o is None:
+            continue
+        sys.stderr.write("{0:<20} {1:<32} time {2:>+8.1f}%  memory {3:>+8.1f}%\n".format(
+            r['scenario'], r['name'],
+            (r['scrape_seconds_median'] / o['scrape_seconds_median'] - 1) * 100 if o['scrape_seconds_median'] else 0.0,
+            (float(r['peak_memory_bytes']) / o['peak_memory_bytes'] - 1) * 100 if o['peak_memory_bytes'] else 0.0))
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=jmx_fixtures.basedir).decode().strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the collectors on the scaled test/ samples.')
+    parser.add_argument('-r', '--repeat', type=int, default=10, help='Scrapes of every case. (default 10)')
+    parser.add_argument('-s', '--scenario', action='append', help='Run only this scenario, may be repeated.')
+    parser.add_argument('--no-legacy', action='store_true', help='Skip the legacy_collect cases.')
+    parser.add_argument('-o', '--output', help='Write the results as json into this file instead of stdout.')
+    parser.add_argument('--compare', metavar='file', help='A previous output file to compare the results with.')
+    parser.add_argument('--logging', action='store_true', help='Also measure the cost of a logger call for its caller.')
+    parser.add_argument('--pool', metavar='n,n', help='Also measure the process pool with these numbers of workers, e.g. 1,2,4.')
+    parser.add_argument('--memory-case', nargs=2, metavar=('scenario', 'case'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.memory_case:
+        print(memory_case(*args.memory_case))
+        return
+
+    # the pool forks its workers first, while this process has no other thread.
+    pool_results = run_pool(args.repeat, [int(n) for n in args.pool.split(',')]) if args.pool else None
+    results = run(args.repeat, args.scenario, not args.no_legacy)
+    report = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'timestamp': time.time(),
+        'results': results,
+    }
+    if pool_results is not None:
+        report['pool'] = pool_results
+    if args.logging:
+        report['logging'] = run_logging(args.repeat * 100)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(results, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import random
+import threading
+import time
+
+from config import Config
+
+# states of a CircuitBreaker, exported as the value of hadoop_exporter_breaker_state.
+CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+
+class CircuitBreaker(object):
+    '''
+    Stop sending requests to a host which keeps failing: after failures consecutive connection errors or timeouts the
+    breaker opens, and every request is refused at no cost until a jittered exponential backoff passes. The breaker then
+    half-opens, one cheap probe decides whether it closes again or opens for twice as long.
+    '''
+    def __init__(self, failures=Config.BREAKER_FAILURES, backoff=Config.BREAKER_BACKOFF, max_backoff=Config.BREAKER_MAX_BACKOFF):
+        '''
+        @param failures: Consecutive failures opening the breaker.
+        @param backoff: Seconds the breaker stays open the first time, doubled every time the probe fails.
+        @param max_backoff: Max seconds the breaker stays open.
+        '''
+        self.state = CLOSED
+        self._threshold = failures
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._failures = 0
+        self._opens = 0
+        self._retry_at = 0
+        self._lock = threading.Lock()
+        # held by the job running the probe, the other jobs of the host wait for its verdict.
+        self._probe_lock = threading.Lock()
+
+    def allow(self, now=None):
+        '''
+        @return True if a request may be sent, the breaker half-opens if its backoff passed.
+        '''
+        now = time.time() if now is None else now
+        with self._lock:
+            if self.state == OPEN and now >= self._retry_at:
+                self.state = HALF_OPEN
+            return self.state != OPEN
+
+    def probe(self, check):
+        '''
+        Run the probe of a half-open breaker once, however many requests wait for it.
+        @param check: A function returning True if the host answered.
+        @return True if the breaker is closed afterwards.
+        '''
+        with self._probe_lock:
+            if self.state == HALF_OPEN:
+                if check():
+                    self.success()
+                else:
+                    self.failure()
+            return self.state == CLOSED
+
+    def success(self):
+        with self._lock:
+            self.state = CLOSED
+            self._failures = 0
+            self._opens = 0
+
+    def failure(self, now=None):
+        '''
+        Count a failed request, the backoff escalates once per outage: on opening, or on a failed probe.
+        The other urls of the host fail while the breaker is open, e.g. the jobs in flight when it opened, they are
+        ignored.
+        '''
+        now = time.time() if now is None else now
+        with self._lock:
+            if self.state == OPEN:
+                return
+            self._failures += 1
+            if self.state == HALF_OPEN or self._failures >= self._threshold:
+                self._opens += 1
+                backoff = min(self._max_backoff, self._backoff * 2 ** min(self._opens - 1, 30))
+                # jitter, so the breakers of a rack which died at once do not probe at once.
+                self._retry_at = now + random.uniform(backoff / 2, backoff)
+                self.state = OPEN
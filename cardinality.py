@@ -0,0 +1,152 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import heapq
+import threading
+
+import selfmetrics
+from config import Config
+
+# label value of the series folded together.
+OTHER = 'other'
+
+
+class HeavyHitters(object):
+    '''
+    Streaming heavy hitters sketch with at most capacity counters: the keys of each round which are not counted yet
+    compete with the counted ones, and the lightest counters are evicted. So the heaviest keys of an unbounded stream
+    of keys stay counted in bounded memory. Counts decay every round, so the ranking follows recent activity and
+    keys which are gone fade out.
+    '''
+    def __init__(self, capacity, decay=0.9):
+        self.capacity = capacity
+        self._decay = decay
+        # key -> count.
+        self._counts = {}
+
+    def update(self, weights):
+        '''
+        Count one round of the stream.
+        @param weights: A dict of key -> weight of the key in this round.
+        '''
+        counts = self._counts
+        for key in counts:
+            counts[key] *= self._decay
+        for key, weight in weights.items():
+            counts[key] = counts.get(key, 0.0) + weight
+        if len(counts) > self.capacity:
+            self._counts = dict(heapq.nlargest(self.capacity, counts.items(), key=lambda item: item[1]))
+
+    def top(self, keys, k):
+        '''
+        @return a set of the k keys with the largest counts among keys.
+        '''
+        counts = self._counts
+        return set(heapq.nlargest(k, keys, key=lambda key: counts.get(key, 0)))
+
+
+def _label_keys(samples, labels):
+    '''
+    @return a list of the tuple of the values of labels of every sample.
+    '''
+    if len(labels) == 1:
+        label = labels[0]
+        return [(sample.labels.get(label, ''),) for sample in samples]
+    return [tuple([sample.labels.get(label, '') for label in labels]) for sample in samples]
+
+
+class CardinalityLimiter(object):
+    '''
+    Keep the series of the label dimensions which grow without bound, rpc methods and NodeManager hosts, within a
+    budget per family group. Only the most active label values, ranked by a HeavyHitters sketch of the activity family
+    of the group, keep their own series, the others are folded into one "other" series per family: summed for counts,
+    dropped for averages and states which can not be added up.
+    A running total, e.g. the NumOps of a rpc method, ranks a label value by its increase since the previous poll, so a
+    method busy long ago does not outrank the ones busy now.
+    '''
+    def __init__(self, prefix, key, budgets=None):
+        '''
+        @param prefix: Family name prefix of the collector, e.g. "hadoop_namenode_".
+        @param key: Target name, the kept / folded / dropped series are recorded into selfmetrics.stats under it.
+        @param budgets: A dict of family group -> (label names, activity family, budget, running total), see
+                        Config.CARDINALITY_BUDGETS.
+        '''
+        self._key = key
+        self._groups = []
+        for group, (labels, activity, budget, cumulative) in sorted((budgets if budgets is not None else Config.CARDINALITY_BUDGETS).items()):
+            self._groups.append((prefix + group, tuple(labels), prefix + group + activity, budget, cumulative,
+                                 HeavyHitters(budget * Config.CARDINALITY_SKETCH_FACTOR)))
+        # family group -> dict of label values -> activity of the previous round.
+        self._previous = {}
+        self._lock = threading.Lock()
+
+    def apply(self, families):
+        '''
+        Fold the series over budget, one round of the sketches.
+        @param families: An OrderedDict of family name -> metric family, changed in place.
+        '''
+        with self._lock:
+            for group, labels, activity, budget, cumulative, sketch in self._groups:
+                members = [(name, family) for name, family in families.items() if name.startswith(group)]
+                if not members:
+                    continue
+                keys = {}
+                distinct = set()
+                levels = {}
+                for name, family in members:
+                    keys[name] = _label_keys(family.samples, labels)
+                    distinct.update(keys[name])
+                    if name == activity:
+                        for key, sample in zip(keys[name], family.samples):
+                            levels[key] = levels.get(key, 0.0) + sample.value
+                previous = self._previous.get(group)
+                # the same poll scraped again is not another round, it would fade the activity of the last poll out.
+                if levels != previous:
+                    previous = previous or {}
+                    weights = dict.fromkeys(distinct, 0.0)
+                    for key, level in levels.items():
+                        if cumulative:
+                            last = previous.get(key)
+                            # a new key has no increase yet, a total reset by a restart counts from 0.
+                            level = 0.0 if last is None else (level - last if level >= last else level)
+                        # being there counts too, so idle but long lived keys outrank a burst of new ones.
+                        weights[key] += 1.0 + max(0.0, level)
+                    sketch.update(weights)
+                    self._previous[group] = levels
+                if len(distinct) <= budget:
+                    selfmetrics.stats.cardinality(self._key, group.rstrip('_'), len(distinct), 0, 0)
+                    continue
+                kept = sketch.top(distinct, budget)
+                folded, dropped = 0, 0
+                for name, family in members:
+                    if 'avg_time' in name or name.endswith('_state'):
+                        samples = [sample for key, sample in zip(keys[name], family.samples) if key in kept]
+                        dropped += len(family.samples) - len(samples)
+                        family.samples = samples
+                        continue
+                    samples = []
+                    # (sample name, the values of the other labels) -> [first folded sample, sum of the values].
+                    others = {}
+                    # sample name -> names of the other labels, sorted.
+                    other_names = {}
+                    for key, sample in zip(keys[name], family.samples):
+                        if key in kept:
+                            samples.append(sample)
+                        else:
+                            folded += 1
+                            names = other_names.get(sample.name)
+                            if names is None:
+                                names = other_names[sample.name] = sorted(l for l in sample.labels if l not in labels)
+                            other_key = (sample.name, tuple([sample.labels.get(l) for l in names]))
+                            other = others.get(other_key)
+                            if other is None:
+                                others[other_key] = [sample, sample.value]
+                            else:
+                                other[1] += sample.value
+                    for other_key in sorted(others):
+                        sample, value = others[other_key]
+                        other_labels = dict(sample.labels)
+                        other_labels.update((label, OTHER) for label in labels)
+                        samples.append(sample._replace(labels=other_labels, value=value))
+                    family.samples = samples
+                selfmetrics.stats.cardinality(self._key, group.rstrip('_'), len(kept), folded, dropped)
@@ -11,10 +11,78 @@ class Config(object):
     DEBUG = True
     LOGGER_LEVEL = logging.DEBUG
     LOGGER_FILE = os.path.join(basedir, 'hadoop.log')
+    # file the errors are written to, relative to the working directory.
+    LOG_FILE = 'hadoop_exporter.log'
+    # log records waiting for the logging thread before new ones are dropped, and records of one call site
+    # written per LOG_RATE_INTERVAL seconds.
+    LOG_QUEUE_SIZE = 10000
+    LOG_RATE_LIMIT = 10
+    LOG_RATE_INTERVAL = 60
     DEFAULT_ADDR = '10.9.11.95'
     DEFAULT_PORT = 9089
     DEFAULT_PATH = '/metrics'
 
+    # seconds between two polls of the same jmx url.
+    POLL_INTERVAL = 15
+    # seconds the last good beans of a target are still served after its polls started failing, then dropped.
+    SNAPSHOT_MAX_AGE = 120
+
+    # max number of jmx urls fetched at the same time.
+    FETCH_WORKERS = 8
+    # seconds a single jmx url may take, and seconds one round of fetching all due urls may take.
+    FETCH_TIMEOUT = 5
+    FETCH_DEADLINE = 10
+    # parse jmx responses as a stream and only decode the beans described in the spec files.
+    STREAM_PARSE = True
+    # a host failing BREAKER_FAILURES times in a row is not polled for BREAKER_BACKOFF seconds, doubled up to
+    # BREAKER_MAX_BACKOFF every time the probe of the host fails, the probe may take BREAKER_PROBE_TIMEOUT seconds.
+    BREAKER_FAILURES = 3
+    BREAKER_BACKOFF = 15
+    BREAKER_MAX_BACKOFF = 600
+    BREAKER_PROBE_TIMEOUT = 2
+
+    # find the DataNodes from the LiveNodes of the active NameNode instead of DATA_NODE*_URL,
+    # and poll them with their own pool of at most DATANODE_WORKERS concurrent requests.
+    DATANODE_DISCOVERY = True
+    DATANODE_WORKERS = 32
+    # export the stage duration histograms of every discovered DataNode and RegionServer, instead of one histogram
+    # per stage for all of them. A fleet of thousands of nodes then costs tens of thousands of series.
+    SELF_METRICS_PER_NODE = False
+
+    # find the RegionServers of a targets file without "hbase_regionservers" from the active HBase Master, their jmx is
+    # served on HBASE_REGIONSERVER_PORT, and poll them with their own pool of at most HBASE_REGIONSERVER_WORKERS requests.
+    HBASE_REGIONSERVER_PORT = 16030
+    HBASE_REGIONSERVER_WORKERS = 32
+
+    # derive ops per second, weighted average time and total time from the NumOps / AvgTime pairs of the masters,
+    # over the last RATE_WINDOW polls of each series.
+    DERIVE_RATES = True
+    RATE_WINDOW = 4
+
+    # series budget of the label dimensions which grow without bound, family group (the family name after
+    # "hadoop_<service>_") -> (label names, family ranking the label values by activity, label values kept, whether
+    # the activity family is a running total, ranked by its increase since the last poll, or a current level).
+    # The label values over budget are folded into "other", the sketch ranking them counts SKETCH_FACTOR times more.
+    # An empty dict turns the budgets off.
+    CARDINALITY_BUDGETS = {
+        'rpc_detailed_method_': (('method',), 'called_total', 500, True),
+        'node_': (('host', 'version', 'rack'), 'containers_total', 5000, False),
+        'table_': (('namespace', 'table'), 'read_request_count', 1000, True),
+    }
+    CARDINALITY_SKETCH_FACTOR = 4
+
+    # decode and classify the responses of the masters in PROCESS_WORKERS worker processes (0 for one per cpu),
+    # so a huge payload does not hold the GIL every other target needs.
+    PROCESS_POOL = False
+    PROCESS_WORKERS = 0
+
+    # requests the http server serves at the same time, requests waiting for a free slot before it answers 503,
+    # seconds a connection may stay idle, and connections open at the same time, the others wait in the listen backlog.
+    HTTP_MAX_IN_FLIGHT = 16
+    HTTP_MAX_QUEUE = 256
+    HTTP_IDLE_TIMEOUT = 60
+    HTTP_MAX_CONNECTIONS = 512
+
     # egrep -i -A 1 "namenode.http-address" /etc/hadoop/conf/hdfs-site.xml
     HDFS_ACTIVE_URL = "http://10.110.13.165:50070/jmx"
     HDFS_STANDBY_URL = "http://10.110.13.164:50070/jmx"
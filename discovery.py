@@ -0,0 +1,147 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import time
+
+import projection
+import selfmetrics
+from config import Config
+from utils import get_module_logger
+
+logger = get_module_logger(__name__)
+
+
+def get_datanode_urls(bean):
+    '''
+    Read the live DataNodes of a NameNode from the LiveNodes attribute of its NameNodeInfo bean.
+    @param bean: The NameNodeInfo bean of a NameNode.
+    @return a dict of DataNode host -> jmx url, e.g. {"dn1": "http://10.0.0.1:50075/jmx"}.
+    '''
+    live_nodes = bean.get('LiveNodes')
+    if not isinstance(live_nodes, dict):
+        live_nodes = json.loads(live_nodes or '{}')
+    urls = {}
+    for node, info in live_nodes.items():
+        # the key is "hostname:xferport", infoAddr is the http address of the DataNode web ui.
+        if info.get('infoAddr'):
+            urls[node.split(':')[0]] = "http://{0}/jmx".format(info['infoAddr'])
+    return urls
+
+
+def get_regionserver_urls(bean, port):
+    '''
+    Read the live RegionServers of a HBase Master from the tag.liveRegionServers attribute of its Server bean.
+    @param bean: The Server bean of a HBase Master.
+    @param port: The info port of the RegionServers, it is not part of their server names.
+    @return a dict of RegionServer host -> jmx url, None if the Master is not the active one.
+    '''
+    if str(bean.get('tag.isActiveMaster')).lower() != 'true':
+        return None
+    urls = {}
+    # "host,port,startcode;host,port,startcode".
+    for server in (bean.get('tag.liveRegionServers') or '').split(';'):
+        host = server.split(',')[0]
+        if host:
+            urls[host] = "http://{0}:{1}/jmx".format(host, port)
+    return urls
+
+
+class DataNodeDiscovery(object):
+    '''
+    Keep the DataNode targets of a scheduler in step with the live DataNodes reported by the active NameNode.
+    Each NameNode snapshot is diffed against the current targets, only added and removed DataNodes touch the scheduler.
+    '''
+    KIND = 'DataNode'
+    # base name and ObjectName properties of the bean listing the live nodes.
+    BEAN = ('NameNodeInfo', {})
+
+    def __init__(self, scheduler, interval, queries=None, key_prefix='datanode/', intervals=None):
+        '''
+        @param scheduler: The Scheduler polling the DataNodes, usually with its own bounded Fetcher.
+        @param interval: Poll interval in seconds of every DataNode.
+        @param queries: ObjectName queries of the DataNode beans, see projection.get_queries.
+        @param key_prefix: Prefix of the target names, the DataNode host is appended.
+        @param intervals: Poll intervals of the queries polled on their own interval, see projection.get_query_intervals.
+        '''
+        self._key_prefix = key_prefix
+        if not Config.SELF_METRICS_PER_NODE:
+            selfmetrics.stats.aggregate(key_prefix, key_prefix.rstrip('/'))
+        self._scheduler = scheduler
+        self._interval = interval
+        self._queries = queries
+        self._intervals = intervals
+        self._targets = {}
+        self._lock = threading.Lock()
+        self.added = 0
+        self.removed = 0
+        self.last_duration = 0.0
+        self.last_run = 0
+
+    def targets(self):
+        '''
+        @return a dict of target key -> DataNode host.
+        '''
+        with self._lock:
+            return dict((key, host) for host, (key, _) in self._targets.items())
+
+    def on_snapshot(self, snapshot):
+        '''
+        Scheduler listener of the NameNode target.
+        '''
+        start = time.time()
+        try:
+            urls = None
+            for bean in snapshot.derived('index', projection.BeanIndex).find(self.BEAN[0], **self.BEAN[1]):
+                # the bean may be polled less often than its master, it is decoded once per poll of it.
+                urls = snapshot.derived_bean(self.KIND, bean, self._get_urls)
+        except (TypeError, ValueError) as e:
+            logger.error("Decode the live %ss failed, error msg is: %s", self.KIND, e)
+            return
+        if urls is None:
+            # the master is down or standby, keep the known nodes instead of dropping the whole fleet.
+            return
+        self.update(urls)
+        self.last_duration = time.time() - start
+        self.last_run = time.time()
+
+    def _get_urls(self, bean):
+        return get_datanode_urls(bean)
+
+    def update(self, urls):
+        '''
+        @param urls: A dict of DataNode host -> jmx url, the complete live fleet.
+        '''
+        with self._lock:
+            current = self._targets
+            added = [host for host in urls if host not in current or current[host][1] != urls[host]]
+            removed = [host for host in current if host not in urls]
+            for host in removed:
+                self._scheduler.remove_target(current.pop(host)[0])
+            for host in added:
+                key = self._key_prefix + host
+                self._scheduler.add_target(key, urls[host], self._interval, self._queries, intervals=self._intervals)
+                current[host] = (key, urls[host])
+            self.added += len(added)
+            self.removed += len(removed)
+        if added or removed:
+            logger.info("{0} targets changed, {1} added, {2} removed, {3} in total.".format(self.KIND, len(added), len(removed), len(urls)))
+
+
+class RegionServerDiscovery(DataNodeDiscovery):
+    '''
+    Keep the RegionServer targets of a scheduler in step with the live RegionServers reported by the active HBase Master.
+    '''
+    KIND = 'RegionServer'
+    BEAN = ('Master', {'sub': 'Server'})
+
+    def __init__(self, scheduler, interval, queries=None, key_prefix='regionserver/', intervals=None, port=None):
+        '''
+        @param port: The info port of the RegionServers, Config.HBASE_REGIONSERVER_PORT by default.
+        '''
+        DataNodeDiscovery.__init__(self, scheduler, interval, queries, key_prefix, intervals)
+        self._port = port or Config.HBASE_REGIONSERVER_PORT
+
+    def _get_urls(self, bean):
+        return get_regionserver_urls(bean, self._port)
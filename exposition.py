@@ -0,0 +1,479 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import errno
+import gzip
+import hashlib
+import io
+import select
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from prometheus_client.core import REGISTRY
+from prometheus_client.exposition import generate_latest, CONTENT_TYPE_LATEST
+
+import selfmetrics
+from config import Config
+from utils import get_module_logger
+
+logger = get_module_logger(__name__)
+
+
+class Exposition(object):
+    '''
+    One rendered text exposition, kept both plain and gzip compressed.
+    '''
+    __slots__ = ('generation', 'plain', 'gzipped', 'etag', 'gzip_etag')
+
+    def __init__(self, generation, plain):
+        self.generation = generation
+        self.plain = plain
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6, mtime=0) as f:
+            f.write(plain)
+        self.gzipped = buf.getvalue()
+        # the etag only depends on the content, a new generation with the same values still answers 304.
+        self.etag = '"{0}"'.format(hashlib.md5(plain).hexdigest())
+        # the gzip body is another representation, a cache must not answer a gzip request with the plain one.
+        self.gzip_etag = '"{0}-gz"'.format(hashlib.md5(plain).hexdigest())
+
+
+class ExpositionCache(object):
+    '''
+    Render the registry once per snapshot generation of the store, every scrape in between is served from the same bytes.
+    So the cost of a scrape does not depend on the number of series, however many prometheus replicas scrape us.
+    '''
+    def __init__(self, store, registry=REGISTRY):
+        '''
+        @param store: The SnapshotStore whose generation decides when to render again.
+        @param registry: The registry holding the collectors.
+        '''
+        self._store = store
+        self._registry = registry
+        self._exposition = None
+        self._lock = threading.Lock()
+
+    def fresh(self):
+        '''
+        @return the Exposition of the current generation if it is rendered already, else None. Never blocks.
+        '''
+        exposition = self._exposition
+        if exposition is not None and exposition.generation == self._store.generation:
+            return exposition
+        return None
+
+    def get(self):
+        '''
+        @return the Exposition of the current generation, rendered by the first scrape which sees the generation.
+        '''
+        generation = self._store.generation
+        exposition = self._exposition
+        if exposition is not None and exposition.generation == generation:
+            return exposition
+        with self._lock:
+            if self._exposition is None or self._exposition.generation != generation:
+                start = time.time()
+                self._exposition = Exposition(generation, generate_latest(self._registry))
+                selfmetrics.stats.observe('exposition', 'render', time.time() - start)
+                selfmetrics.stats.set('response_bytes', 'exposition', len(self._exposition.plain))
+            return self._exposition
+
+
+def accepts_gzip(accept_encoding):
+    '''
+    @param accept_encoding: The Accept-Encoding request header, e.g. "gzip;q=0.5, identity".
+    @return True if the client accepts gzip, i.e. gzip, or * without gzip, is listed with a q-value above 0.
+    '''
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        params = coding.split(';')
+        name = params[0].strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+    return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+
+def build_response(exposition, if_none_match='', accept_encoding=''):
+    '''
+    @param exposition: The Exposition to serve.
+    @param if_none_match: The If-None-Match request header.
+    @param accept_encoding: The Accept-Encoding request header.
+    @return a tuple of (status code, list of (header, value), body bytes).
+    '''
+    gzipped = accepts_gzip(accept_encoding)
+    etag = exposition.gzip_etag if gzipped else exposition.etag
+    if etag in [t.strip() for t in if_none_match.split(',')]:
+        return 304, [('ETag', etag), ('Vary', 'Accept-Encoding')], b''
+    headers = [('Content-Type', CONTENT_TYPE_LATEST), ('ETag', etag), ('Vary', 'Accept-Encoding')]
+    if gzipped:
+        headers.append(('Content-Encoding', 'gzip'))
+        return 200, headers, exposition.gzipped
+    return 200, headers, exposition.plain
+
+
+_REASONS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            431: 'Request Header Fields Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+# states of a connection of the AsyncMetricsServer.
+_READING, _QUEUED, _RENDERING, _WRITING = range(4)
+
+
+class _Connection(object):
+
+    __slots__ = ('sock', 'fileno', 'inbuf', 'outbuf', 'state', 'keep_alive', 'head', 'request', 'started', 'active')
+
+    def __init__(self, sock):
+        self.sock = sock
+        # kept, the fileno of a closed socket is gone.
+        self.fileno = sock.fileno()
+        self.inbuf = b''
+        self.outbuf = b''
+        self.state = _READING
+        self.keep_alive = False
+        self.head = False
+        # (method, path, headers) of the request being served.
+        self.request = None
+        # when the request being served was read in full.
+        self.started = None
+        # when the connection last read or wrote something, an idle or stuck connection is closed.
+        self.active = time.time()
+
+
+class AsyncMetricsServer(object):
+    '''
+    Serve the cached exposition from one event loop thread, replaces the thread per request of
+    prometheus_client.start_http_server. All sockets are non-blocking and multiplexed with poll (select where there
+    is no poll, e.g. on Windows, which can not watch a fd above 1024), a new generation is rendered by one renderer thread,
+    and every scrape arriving during the render waits for that one render instead of running the collectors again.
+    At most max_in_flight requests are served at the same time, the others wait in a queue of at most max_queue
+    requests, and beyond it are answered 503 at once. The request latency is recorded into selfmetrics.stats as the
+    "request" stage of the "http" target, along with the requests in flight and the queue depth.
+    '''
+    def __init__(self, address, cache, metrics_paths=('/metrics',), max_in_flight=Config.HTTP_MAX_IN_FLIGHT,
+                 max_queue=Config.HTTP_MAX_QUEUE, idle_timeout=Config.HTTP_IDLE_TIMEOUT):
+        '''
+        @param address: A tuple of (listen address, port), "" listens on all interfaces.
+        @param cache: The ExpositionCache to serve.
+        @param metrics_paths: Paths under which to expose metrics.
+        @param max_in_flight: Max number of requests served at the same time.
+        @param max_queue: Max number of requests waiting for a free slot.
+        @param idle_timeout: Seconds a connection may stay idle, or a client take to send a request or read a response.
+        '''
+        self.cache = cache
+        self.metrics_paths = set(metrics_paths)
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.idle_timeout = idle_timeout
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(address)
+        self._sock.listen(128)
+        self._sock.setblocking(False)
+        self.server_address = self._sock.getsockname()
+        # the renderer thread and signal handlers wake the loop up through this socket pair.
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._connections = {}
+        self._queue = deque()
+        self._in_flight = 0
+        self._rendering = []
+        self._render = None
+        self._renderer = ThreadPoolExecutor(max_workers=1)
+        # no new connection is accepted before this unix time, e.g. after running out of file descriptors.
+        self._accept_after = 0
+        self._stopped = threading.Event()
+        self._done = threading.Event()
+
+    def serve_forever(self):
+        '''
+        Run the event loop in the calling thread until shutdown is called.
+        '''
+        try:
+            while not self._stopped.is_set():
+                readers = [self._wake_r.fileno()] + [c.fileno for c in self._connections.values() if c.state == _READING]
+                # the connections beyond the max wait in the listen backlog.
+                if len(self._connections) < Config.HTTP_MAX_CONNECTIONS and time.time() >= self._accept_after:
+                    readers.append(self._sock.fileno())
+                writers = [c.fileno for c in self._connections.values() if c.state == _WRITING]
+                try:
+                    readable, writable = _wait(readers, writers, 1.0)
+                except (select.error, OSError, IOError) as e:
+                    # a signal handler ran, e.g. the one calling shutdown.
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                for fileno in readable:
+                    if fileno == self._sock.fileno():
+                        self._accept()
+                    elif fileno == self._wake_r.fileno():
+                        self._on_wake()
+                    elif fileno in self._connections and self._connections[fileno].state == _READING:
+                        self._handle(self._read, self._connections[fileno])
+                for fileno in writable:
+                    # checked again, a handler above may have closed it and its fileno be reused by a new connection.
+                    if fileno in self._connections and self._connections[fileno].state == _WRITING:
+                        self._handle(self._write, self._connections[fileno])
+                self._expire()
+        finally:
+            for conn in list(self._connections.values()):
+                self._close(conn)
+            self._sock.close()
+            self._wake_r.close()
+            self._wake_w.close()
+            self._renderer.shutdown(wait=False)
+            self._done.set()
+
+    def shutdown(self, wait=False):
+        '''
+        Stop the event loop, safe from any thread and from a signal handler.
+        @param wait: Wait for the loop to close its sockets, not from the loop thread or a signal handler.
+        '''
+        self._stopped.set()
+        self._wake()
+        if wait:
+            self._done.wait()
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b'x')
+        except (socket.error, OSError):
+            # the wake socket is full or closed, the loop is woken up already.
+            pass
+
+    def _on_wake(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except (socket.error, OSError):
+            pass
+        render = self._render
+        if render is None or not render.done():
+            return
+        self._render = None
+        waiting, self._rendering = self._rendering, []
+        try:
+            exposition = render.result()
+        except Exception as e:
+            logger.error("Render metrics failed, error msg is: {0}".format(e))
+            exposition = None
+        for conn in waiting:
+            if exposition is None:
+                self._handle(lambda conn: self._respond(conn, 500, [], b'Render metrics failed.\n'), conn)
+            else:
+                self._handle(lambda conn: self._respond_exposition(conn, exposition), conn)
+        self._record()
+
+    def _handle(self, handler, conn):
+        '''
+        Run handler on one connection, an unexpected error closes that connection instead of stopping the server.
+        '''
+        try:
+            handler(conn)
+        except Exception as e:
+            logger.error("Serve a connection failed, error msg is: %s", e)
+            self._close(conn)
+
+    def _accept(self):
+        for _ in range(64):
+            try:
+                sock, _ = self._sock.accept()
+            except (socket.error, OSError) as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ECONNABORTED, errno.EINTR):
+                    return
+                # e.g. out of file descriptors, the pending connections wait in the backlog meanwhile.
+                logger.error("Accept a connection failed, error msg is: %s", e)
+                self._accept_after = time.time() + 1
+                return
+            sock.setblocking(False)
+            conn = _Connection(sock)
+            self._connections[conn.fileno] = conn
+
+    def _read(self, conn):
+        try:
+            data = conn.sock.recv(65536)
+        except (socket.error, OSError) as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = b''
+        if not data:
+            self._close(conn)
+            return
+        conn.active = time.time()
+        conn.inbuf += data
+        self._parse(conn)
+
+    def _parse(self, conn):
+        end = conn.inbuf.find(b'\r\n\r\n')
+        conn.started = time.time()
+        if end < 0:
+            if len(conn.inbuf) > 65536:
+                conn.keep_alive = False
+                self._respond(conn, 431, [], b'Request header is too large.\n', queued=False)
+            return
+        head, conn.inbuf = conn.inbuf[:end].decode('latin-1'), conn.inbuf[end + 4:]
+        lines = head.split('\r\n')
+        parts = lines[0].split()
+        if len(parts) != 3:
+            conn.keep_alive = False
+            self._respond(conn, 400, [], b'Bad request line.\n', queued=False)
+            return
+        method, path, version = parts
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        connection = headers.get('connection', '').lower()
+        conn.keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+        conn.head = method == 'HEAD'
+        conn.request = (method, path.split('?')[0], headers)
+        if self._in_flight < self.max_in_flight:
+            self._serve(conn)
+        elif len(self._queue) < self.max_queue:
+            conn.state = _QUEUED
+            self._queue.append(conn)
+            self._record()
+        else:
+            conn.keep_alive = False
+            self._respond(conn, 503, [('Retry-After', '1')], b'Too many requests.\n', queued=False)
+
+    def _serve(self, conn):
+        self._in_flight += 1
+        method, path, headers = conn.request
+        if method not in ('GET', 'HEAD'):
+            self._respond(conn, 405, [('Allow', 'GET, HEAD')], b'Method not allowed.\n')
+        elif path not in self.metrics_paths:
+            self._respond(conn, 404, [], b'Not found.\n')
+        else:
+            exposition = self.cache.fresh()
+            if exposition is not None:
+                self._respond_exposition(conn, exposition)
+            else:
+                # a new generation, render it off the loop, once for every scrape waiting for it.
+                conn.state = _RENDERING
+                self._rendering.append(conn)
+                if self._render is None:
+                    self._render = self._renderer.submit(self.cache.get)
+                    self._render.add_done_callback(lambda future: self._wake())
+        self._record()
+
+    def _respond_exposition(self, conn, exposition):
+        _, _, headers = conn.request
+        status, response_headers, body = build_response(exposition, headers.get('if-none-match', ''),
+                                                        headers.get('accept-encoding', ''))
+        self._respond(conn, status, response_headers, body)
+
+    def _respond(self, conn, status, headers, body, queued=True):
+        '''
+        @param queued: The request holds a slot, i.e. it went through _serve.
+        '''
+        if not queued:
+            # answered without a slot, e.g. 503, take one so _finish frees it like for any other request.
+            self._in_flight += 1
+        lines = ['HTTP/1.1 {0} {1}'.format(status, _REASONS.get(status, ''))]
+        lines.extend('{0}: {1}'.format(header, value) for header, value in headers)
+        if status != 304:
+            lines.append('Content-Length: {0}'.format(len(body)))
+        lines.append('Connection: {0}'.format('keep-alive' if conn.keep_alive else 'close'))
+        conn.outbuf = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        if not conn.head and status != 304:
+            conn.outbuf += body
+        conn.state = _WRITING
+        self._write(conn)
+
+    def _write(self, conn):
+        try:
+            sent = conn.sock.send(conn.outbuf)
+        except (socket.error, OSError) as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            self._close(conn)
+            return
+        conn.active = time.time()
+        conn.outbuf = conn.outbuf[sent:]
+        if conn.outbuf:
+            return
+        self._finish(conn)
+        conn.state = _READING
+        if not conn.keep_alive:
+            self._close(conn)
+            return
+        conn.request = None
+        if conn.inbuf:
+            # a pipelined request.
+            self._parse(conn)
+
+    def _finish(self, conn):
+        '''
+        The response of a request is written or given up, record its latency and hand its slot to a queued request.
+        '''
+        selfmetrics.stats.observe('http', 'request', time.time() - conn.started)
+        conn.started = None
+        self._in_flight -= 1
+        while self._queue and self._in_flight < self.max_in_flight:
+            queued = self._queue.popleft()
+            if self._connections.get(queued.fileno) is queued:
+                self._serve(queued)
+        self._record()
+
+    def _close(self, conn):
+        if self._connections.get(conn.fileno) is not conn:
+            return
+        del self._connections[conn.fileno]
+        if conn.state in (_RENDERING, _WRITING):
+            if conn in self._rendering:
+                self._rendering.remove(conn)
+            self._finish(conn)
+        elif conn.state == _QUEUED:
+            self._queue.remove(conn)
+            self._record()
+        try:
+            conn.sock.close()
+        except (socket.error, OSError):
+            pass
+
+    def _expire(self):
+        # a render is not the fault of the client, it is never timed out.
+        deadline = time.time() - self.idle_timeout
+        for conn in [c for c in self._connections.values() if c.active < deadline and c.state in (_READING, _WRITING)]:
+            self._close(conn)
+
+    def _record(self):
+        selfmetrics.stats.set('in_flight', 'http', self._in_flight)
+        selfmetrics.stats.set('queue_depth', 'http', len(self._queue))
+
+
+def _wait(readers, writers, timeout):
+    '''
+    Wait until some of the file descriptors are ready, with poll where the platform has it, select can not watch a file
+    descriptor above FD_SETSIZE (1024).
+    @return a tuple of (readable, writable) file descriptors, a closed or failed one is reported as ready.
+    '''
+    if not hasattr(select, 'poll'):
+        readable, writable, _ = select.select(readers, writers, [], timeout)
+        return readable, writable
+    poller = select.poll()
+    for fileno in readers:
+        poller.register(fileno, select.POLLIN)
+    for fileno in writers:
+        poller.register(fileno, select.POLLOUT)
+    readable, writable = [], []
+    failed = select.POLLERR | select.POLLHUP | select.POLLNVAL
+    for fileno, event in poller.poll(timeout * 1000):
+        if event & (select.POLLIN | failed):
+            readable.append(fileno)
+        if event & (select.POLLOUT | failed):
+            writable.append(fileno)
+    return readable, writable
@@ -0,0 +1,215 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+try:
+    from urlparse import urlsplit
+except ImportError:
+    from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import breaker
+import utils
+from utils import get_module_logger
+from config import Config
+
+logger = get_module_logger(__name__)
+
+# a request cheap for any jmx servlet, the bean is registered by every MBeanServer and holds a few strings.
+PROBE_QUERY = "JMImplementation:type=MBeanServerDelegate"
+# errors telling the host is unreachable, the others (e.g. a http status or a bad body) come from a living host.
+BREAKER_ERRORS = ('connection', 'timeout', 'deadline')
+
+
+class FetchResult(object):
+    '''
+    The outcome of fetching one jmx url.
+    '''
+    __slots__ = ('url', 'metrics', 'error', 'elapsed', 'stats')
+
+    def __init__(self, url, metrics=None, error=None, elapsed=0.0, stats=None):
+        '''
+        @param stats: The cost of the request, see utils.get_metrics. "error" holds the error type of a failed fetch.
+        '''
+        self.url = url
+        self.metrics = metrics
+        self.error = error
+        self.elapsed = elapsed
+        self.stats = stats if stats is not None else {'error': 'exception' if error else None}
+
+    @property
+    def ok(self):
+        return bool(self.metrics) and 'beans' in self.metrics
+
+
+class _Job(object):
+
+    __slots__ = ('url', 'keep', 'classifier', 'breaker', 'future', 'started', 'settled')
+
+    def __init__(self, url, keep=None, classifier=None, breaker=None):
+        self.url = url
+        self.keep = keep
+        self.classifier = classifier
+        self.breaker = breaker
+        self.future = None
+        self.started = None
+        # the outcome of the job is recorded into its breaker, by the job itself or by fetch_all giving it up.
+        self.settled = False
+
+
+class Fetcher(object):
+    '''
+    Fetch many jmx urls in parallel with a bounded thread pool.
+    Every url has its own deadline counted from the moment a worker picks it up, and a whole fan-out has a global deadline.
+    Urls which are still running when their deadline passes are given up, the others are returned as soon as they finish.
+    Every host has a breaker.CircuitBreaker, the urls of a host whose breaker is open are not fetched at all.
+    '''
+    def __init__(self, max_workers=Config.FETCH_WORKERS, timeout=Config.FETCH_TIMEOUT, deadline=Config.FETCH_DEADLINE, pool=None):
+        '''
+        @param max_workers: Max number of concurrent http requests.
+        @param timeout: Per-url deadline in seconds, also used as the http connect/read timeout.
+        @param deadline: Global deadline in seconds of one fetch_all call.
+        @param pool: A workers.ClassifyPool, the responses of the urls with a classifier are decoded and classified in it.
+        '''
+        self._timeout = timeout
+        self._deadline = deadline
+        self._pool = pool
+        # scheme://host:port -> breaker.CircuitBreaker.
+        self._breakers = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+
+    def _fetch(self, job):
+        with self._lock:
+            job.started = time.time()
+        stats = {}
+        if job.breaker.state == breaker.HALF_OPEN and not job.breaker.probe(lambda: self._probe(job.url)):
+            # the probe recorded its failure already.
+            self._settle(job, None)
+            stats.update(error='breaker_open', breaker=job.breaker.state)
+            return FetchResult(job.url, None, "circuit open", time.time() - job.started, stats)
+        if job.classifier is not None and self._pool is not None:
+            metrics = self._classify(job, stats)
+        else:
+            metrics = utils.get_metrics(job.url, timeout=self._timeout, keep=job.keep, stats=stats)
+        self._settle(job, stats.get('error') in BREAKER_ERRORS)
+        stats['breaker'] = job.breaker.state
+        return FetchResult(job.url, metrics, None if metrics else "fetch failed", time.time() - job.started, stats)
+
+    def _settle(self, job, failed, now=None):
+        '''
+        Record the outcome of a job into its breaker once, a job given up at its deadline keeps running and finishes
+        later, by then its failure is counted already.
+        @param failed: True for a failure, False for a success, None to record nothing.
+        '''
+        with self._lock:
+            if job.settled:
+                return
+            job.settled = True
+        if failed:
+            job.breaker.failure(now)
+        elif failed is not None:
+            job.breaker.success()
+
+    def _probe(self, url):
+        '''
+        @return True if the host of the url answers a cheap jmx query.
+        '''
+        parts = urlsplit(url)
+        stats = {}
+        utils.get_metrics("{0}://{1}{2}?qry={3}".format(parts.scheme, parts.netloc, parts.path, PROBE_QUERY),
+                          timeout=min(self._timeout, Config.BREAKER_PROBE_TIMEOUT), stats=stats)
+        return stats.get('error') not in BREAKER_ERRORS
+
+    def _breaker(self, url):
+        parts = urlsplit(url)
+        key = "{0}://{1}".format(parts.scheme, parts.netloc)
+        with self._lock:
+            if key not in self._breakers:
+                self._breakers[key] = breaker.CircuitBreaker()
+            return self._breakers[key]
+
+    def forget(self, url):
+        '''
+        Drop the breaker of the host of a url which is not polled any more, e.g. a decommissioned DataNode.
+        '''
+        parts = urlsplit(url)
+        with self._lock:
+            self._breakers.pop("{0}://{1}".format(parts.scheme, parts.netloc), None)
+
+    def _classify(self, job, stats):
+        response = utils.get_metrics(job.url, timeout=self._timeout, stats=stats, raw=True)
+        if not response:
+            return []
+        try:
+            return self._pool.classify(job.classifier, response['body'], response['encoding'], job.keep, stats)
+        except Exception as e:
+            stats['error'] = 'parse'
+            logger.error("Classify %s failed, error msg is: %s", job.url, e)
+            return []
+
+    def fetch_all(self, urls, deadline=None, keeps=None, classifiers=None):
+        '''
+        @param urls: The jmx urls to fetch.
+        @param deadline: Override the global deadline in seconds.
+        @param keeps: A dict of url -> bean name filter, the response of such url is parsed as a stream.
+        @param classifiers: A dict of url -> workers.Classifier, the response of such url is decoded and classified
+                            in the pool, its result has the "rows" too.
+        @return a dict of url -> FetchResult, slow or dead urls have a result with error set and no metrics.
+        '''
+        deadline = self._deadline if deadline is None else deadline
+        start = time.time()
+        end = start + deadline
+        jobs = {}
+        keeps = keeps or {}
+        classifiers = classifiers or {}
+        results = {}
+        for url in set(urls):
+            job = _Job(url, keeps.get(url), classifiers.get(url), self._breaker(url))
+            if not job.breaker.allow(start):
+                # an open breaker costs nothing, not even a thread of the pool.
+                results[url] = FetchResult(url, error="circuit open", stats={'error': 'breaker_open', 'breaker': breaker.OPEN})
+                continue
+            job.future = self._executor.submit(self._fetch, job)
+            jobs[job.future] = job
+
+        pending = set(jobs)
+        while pending:
+            now = time.time()
+            # the nearest moment some url or the whole fan-out may run out of time,
+            # a url still queued can not expire before now + timeout.
+            wake = end
+            with self._lock:
+                for f in pending:
+                    wake = min(wake, (jobs[f].started or now) + self._timeout)
+            if wake <= now:
+                wake = now
+            done, pending = wait(pending, timeout=wake - now, return_when=FIRST_COMPLETED)
+            for f in done:
+                job = jobs[f]
+                try:
+                    results[job.url] = f.result()
+                except Exception as e:
+                    results[job.url] = FetchResult(job.url, error=repr(e), elapsed=time.time() - (job.started or start))
+
+            now = time.time()
+            expired = set()
+            with self._lock:
+                for f in pending:
+                    job = jobs[f]
+                    if now >= end or (job.started is not None and now - job.started >= self._timeout):
+                        expired.add(f)
+            for f in expired:
+                job = jobs[f]
+                f.cancel()
+                if job.started is not None:
+                    self._settle(job, True, now)
+                results[job.url] = FetchResult(job.url, error="deadline exceeded", elapsed=now - (job.started or now),
+                                               stats={'error': 'deadline', 'breaker': job.breaker.state})
+                logger.error("Get %s exceeded the deadline, gave up.", job.url)
+            pending -= expired
+        return results
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
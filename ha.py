@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+import projection
+from utils import get_module_logger
+
+logger = get_module_logger(__name__)
+
+# the bean carrying the HA state of each service, and the attribute holding it. It is probed apart from the polls: a
+# poll only fetches the url taken for active, the standbys have to be asked too, and all states are compared from one
+# fan-out. The polled FSNamesystem is not reused for the active url, it may be classified in a worker process and
+# reach the scheduler as rows, without the bean.
+HA_PROBES = {
+    'namenode': ("Hadoop:service=NameNode,name=FSNamesystem", 'tag.HAState'),
+    'resourcemanager': ("Hadoop:service=ResourceManager,name=RMInfo", 'State'),
+}
+
+
+class HARouter(object):
+    '''
+    Find the active one of the HA urls of a NameNode or ResourceManager from the HA state the daemons report themselves.
+    The answer is cached for ttl seconds, the scheduler probes every url again once it expires or the active url fails,
+    so a failover is followed within one poll interval. Ambari is not needed.
+    '''
+    ACTIVE = 'active'
+
+    def __init__(self, service, urls, ttl):
+        '''
+        @param service: "namenode" or "resourcemanager".
+        @param urls: The jmx urls of all HA daemons, the first one is used until a probe finds the active one.
+        @param ttl: Seconds the probed HA states are trusted.
+        '''
+        self.service = service
+        self.urls = [url.rstrip('/') for url in urls]
+        self._ttl = ttl
+        self._active = self.urls[0]
+        self._expires = 0
+        self._lock = threading.Lock()
+        query, self._attr = HA_PROBES[service]
+        self._probe_urls = dict((projection.get_query_urls(url, [query])[0], url) for url in self.urls)
+        # url -> the last probed HA state, None if the probe failed.
+        self.states = dict((url, None) for url in self.urls)
+        self.failovers = 0
+
+    @property
+    def active(self):
+        return self._active
+
+    def expired(self, now=None):
+        return (now or time.time()) >= self._expires
+
+    def expire(self):
+        '''
+        Probe again on the next poll, e.g. because the active url failed.
+        '''
+        self._expires = 0
+
+    @property
+    def probe_urls(self):
+        return list(self._probe_urls)
+
+    def update(self, results, started=None):
+        '''
+        @param results: A dict of probe url -> FetchResult, see Fetcher.fetch_all.
+        @param started: Unix time the probes were sent, the ttl counts from it.
+        @return the active url.
+        '''
+        states = {}
+        for probe_url, url in self._probe_urls.items():
+            result = results.get(probe_url)
+            states[url] = None
+            if result is not None and result.ok:
+                for bean in result.metrics['beans']:
+                    if self._attr in bean:
+                        states[url] = bean[self._attr]
+        with self._lock:
+            self.states = states
+            # expire a little early, so the poll scheduled one ttl later probes again instead of missing it by a few ms.
+            self._expires = (started or time.time()) + self._ttl - min(1.0, self._ttl * 0.1)
+            active = [url for url in self.urls if states[url] == self.ACTIVE]
+            if active and active[0] != self._active:
+                logger.info("{0} failover, active url changed from {1} to {2}.".format(self.service, self._active, active[0]))
+                self._active = active[0]
+                self.failovers += 1
+            elif not active:
+                # no daemon claims to be active, keep the current one rather than flapping.
+                logger.error("No active {0} found in {1}, states are {2}.".format(self.service, self.urls, states))
+            return self._active
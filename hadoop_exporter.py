@@ -8,17 +8,35 @@ import requests
 import argparse
 from pprint import pprint
 
+import copy
 import json
 import os
+import signal
+import threading
+from collections import OrderedDict
 from sys import exit
-from prometheus_client import start_http_server
-from prometheus_client.core import GaugeMetricFamily, SummaryMetricFamily, HistogramMetricFamily, REGISTRY
+try:
+    from urlparse import urlsplit
+except ImportError:
+    from urllib.parse import urlsplit
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily, SummaryMetricFamily, HistogramMetricFamily, REGISTRY
 
 import utils
+import projection
+import spec
+import exposition
+import selfmetrics
+import rates
+import cardinality
+import workers
 from utils import get_module_logger
 from consul import Consul
 
 from config import Config
+from scheduler import Scheduler, SnapshotStore
+from fetcher import Fetcher
+from discovery import DataNodeDiscovery, RegionServerDiscovery
+from ha import HARouter
 
 logger = get_module_logger(__name__)
 
@@ -27,7 +45,7 @@ class MetricCol(object):
     '''
     MetricCol is a super class of all kinds of MetricsColleter classes. It setup common params like cluster, url, component and service.
     '''
-    def __init__(self, cluster, url, component, service):
+    def __init__(self, cluster, url, component, service, store=None, key=None):
         '''
         @param cluster: Cluster name, registered in the config file or ran in the command-line.
         @param url: All metrics are scraped in the url, corresponding to each component. 
@@ -35,19 +53,48 @@ class MetricCol(object):
                          "resourcemanager" metrics can be scraped in http://ip:8088/jmx.
         @param component: Component name. e.g. "hdfs", "resourcemanager", "mapreduce", "hive", "hbase".
         @param service: Service name. e.g. "namenode", "resourcemanager", "mapreduce".
+        @param store: The SnapshotStore filled by the scheduler.
+        @param key: Target name of the url in the store, e.g. "cluster1/namenode". The service name by default.
         '''
         self._cluster = cluster
         self._url = url.rstrip('/')
         self._component = component
+        self._service = service
         self._prefix = 'hadoop_{0}_'.format(service)
+        self._store = store if store is not None else SnapshotStore()
+        self._key = key or service
+
+    def _get_snapshot(self):
+        '''
+        @return the latest snapshot polled by the scheduler.
+        '''
+        return self._store.latest(self._key)
+
+    def _record_collect(self, families, started):
+        '''
+        Record the classify stage of a scrape and the number of emitted series into selfmetrics.stats.
+        '''
+        selfmetrics.stats.observe(self._key, 'classify', time.time() - started)
+        selfmetrics.stats.set('series', self._key, sum(len(family.samples) for family in families.values()))
+
+    def _get_index(self, snapshot):
+        '''
+        @return the projection.BeanIndex of the snapshot, built once and shared by all collectors of the snapshot.
+        '''
+        return snapshot.derived('index', projection.BeanIndex)
+
+    def _get_beans(self):
+        '''
+        @return the beans of the latest snapshot polled by the scheduler.
+        '''
+        return self._get_snapshot().beans
 
     def collect(self):
         '''
         This method needs to be override by all subclasses.
 
-        # request_data from url/jmx
-        metrics = get_metrics(self._base_url)
-        beans = metrics['beans']
+        # read the latest beans polled from url/jmx
+        beans = self._get_beans()
 
         # initial the metircs
         self._setup_metrics_labels()
@@ -375,17 +422,16 @@ def common_metrics_info(cluster, beans, service):
 
 class NameNodeMetricsCollector(MetricCol):
 
-    def __init__(self, cluster):
-        MetricCol.__init__(self, cluster, Config().HDFS_ACTIVE_URL, "HDFS", "namenode")
+    def __init__(self, cluster, store=None, url=Config().HDFS_ACTIVE_URL, key=None):
+        MetricCol.__init__(self, cluster, url, "HDFS", "namenode", store, key)
         # self._url = "{0}?qry=Hadoop:service=NameNode,name=*".format(self._base_url)
         self._file_list = utils.get_file_list("namenode")
         self._common_file = utils.get_file_list("common")
         self._merge_list = self._file_list + self._common_file
-        self._metrics_value = utils.get_metrics(self._url)
-        if self._metrics_value and 'beans' in self._metrics_value:
-            self._beans = self._metrics_value['beans']
-        else:
-            self._beans = []
+        self._spec = spec.get_compiled_spec("namenode", ["namenode", "common"])
+        # rates derived from the NumOps / AvgTime pairs, fed by the scheduler through rates.on_snapshot.
+        self.rates = rates.RateDeriver(self._spec, self._key)
+        self._limiter = cardinality.CardinalityLimiter(self._spec.prefix, self._key)
 
         self._metrics = {}
         self._hadoop_namenode_metrics = {}
@@ -394,18 +440,42 @@ class NameNodeMetricsCollector(MetricCol):
             self._hadoop_namenode_metrics.setdefault(self._file_list[i], {})
 
     def collect(self):
-        # Request data from ambari Collect Host API
-        # Request exactly the System level information we need from node
-        # beans returns a type of 'List'
+        # Read the beans polled by the scheduler, no http request is sent during a scrape.
+        snapshot = self._get_snapshot()
+
+        # the spec files are compiled once, each attribute is a single table lookup.
+        started = time.time()
+        families = self._spec.new_families()
+        if snapshot.rows is not None:
+            # classified by a worker process, the raw beans left are only read by the discovery and the rates.
+            self._spec.add_rows(families, workers.iter_rows(snapshot.rows), [self._cluster])
+        else:
+            for kind, bean in self._spec.select(self._get_index(snapshot)):
+                self._spec.add_bean(families, bean, [self._cluster], kind)
+        for family in self.rates.collect([self._cluster]):
+            families[family.name] = family
+        self._limiter.apply(families)
+        self._record_collect(families, started)
+
+        for family in families.values():
+            yield family
+
+    def legacy_collect(self):
+        '''
+        The collect before the spec files were compiled, kept as the reference of collect.
+        '''
+        # Read the beans polled by the scheduler, no http request is sent during a scrape.
+        # beans returns a type of 'Tuple'
+        beans = self._get_beans()
 
         # set up all metrics with labels and descriptions.
         self._setup_metrics_labels()
 
         # add metric value to every metric.
-        self._get_metrics(self._beans)
+        self._get_metrics(beans)
 
         # update namenode metrics with common metrics
-        common_metrics = common_metrics_info(self._cluster, self._beans, "namenode")
+        common_metrics = common_metrics_info(self._cluster, beans, "namenode")
         self._hadoop_namenode_metrics.update(common_metrics())
 
         for i in range(len(self._merge_list)):
@@ -692,17 +762,16 @@ class ResourceManagerMetricsCollector(MetricCol):
         'REBOOTED': 6,
     }
     
-    def __init__(self, cluster):
-        MetricCol.__init__(self, cluster, Config().YARN_ACTIVE_URL, "YARN", "resourcemanager")
+    def __init__(self, cluster, store=None, url=Config().YARN_ACTIVE_URL, key=None):
+        MetricCol.__init__(self, cluster, url, "YARN", "resourcemanager", store, key)
         # self._url = "{0}?qry=Hadoop:service=NameNode,name=*".format(self._base_url)
         self._file_list = utils.get_file_list("resourcemanager")
         self._common_file = utils.get_file_list("common")
         self._merge_list = self._file_list + self._common_file
-        self._metrics_value = utils.get_metrics(self._url)
-        if self._metrics_value and 'beans' in self._metrics_value:
-            self._beans = self._metrics_value['beans']
-        else:
-            self._beans = []
+        self._spec = spec.get_compiled_spec("resourcemanager", ["resourcemanager", "common"])
+        # rates derived from the NumOps / AvgTime pairs, fed by the scheduler through rates.on_snapshot.
+        self.rates = rates.RateDeriver(self._spec, self._key)
+        self._limiter = cardinality.CardinalityLimiter(self._spec.prefix, self._key)
 
         self._metrics = {}
         self._hadoop_resourcemanager_metrics = {}
@@ -711,18 +780,80 @@ class ResourceManagerMetricsCollector(MetricCol):
             self._hadoop_resourcemanager_metrics.setdefault(self._file_list[i], {})
 
     def collect(self):
-        # Request data from ambari Collect Host API
-        # Request exactly the System level information we need from node
-        # beans returns a type of 'List'
+        # Read the beans polled by the scheduler, no http request is sent during a scrape.
+        snapshot = self._get_snapshot()
+
+        # the spec files are compiled once, each attribute is a single table lookup.
+        started = time.time()
+        families = self._spec.new_families()
+        if snapshot.rows is not None:
+            # classified by a worker process, only RMNMInfo is left to add from the raw beans.
+            self._spec.add_rows(families, workers.iter_rows(snapshot.rows), [self._cluster])
+            beans = self._spec.select(self._get_index(snapshot), kinds=['RMNMInfo'])
+        else:
+            beans = self._spec.select(self._get_index(snapshot))
+        for kind, bean in beans:
+            if kind.name == 'RMNMInfo':
+                # LiveNodeManagers is decoded once per poll of RMNMInfo, not once per scrape and family.
+                self._add_node_managers(families, kind, snapshot.derived_bean('RMNMInfo', bean, self._decode_node_managers))
+            else:
+                self._spec.add_bean(families, bean, [self._cluster], kind)
+        for family in self.rates.collect([self._cluster]):
+            families[family.name] = family
+        self._limiter.apply(families)
+        self._record_collect(families, started)
+
+        for family in families.values():
+            yield family
+
+    def _decode_node_managers(self, bean):
+        '''
+        Decode the LiveNodeManagers json string of the RMNMInfo bean into a columnar table.
+        @return a dict with "labels", a list of (host, version, rack), and one list of values for each RMNMInfo metric.
+                The n-th entry of every list belongs to the n-th NodeManager.
+        '''
+        metrics = list(self._spec.kinds['RMNMInfo'].table)
+        table = dict((metric, []) for metric in metrics)
+        table['labels'] = []
+        try:
+            live_nm_list = json.loads(bean['LiveNodeManagers'])
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error("Decode LiveNodeManagers failed, error msg is: {0}".format(e))
+            return table
+        for node in live_nm_list:
+            table['labels'].append((node['HostName'], node['NodeManagerVersion'], node['Rack']))
+            for metric in metrics:
+                if 'State' == metric:
+                    table[metric].append(self.NODE_STATE.get(node.get('State'), 0))
+                else:
+                    table[metric].append(node.get(metric, 0))
+        return table
+
+    def _add_node_managers(self, families, kind, table):
+        '''
+        RMNMInfo has one series per live NodeManager, read from the table built by _decode_node_managers.
+        '''
+        for metric, rule in kind.table.items():
+            family = families[rule.family]
+            for label, value in zip(table['labels'], table[metric]):
+                family.add_metric([self._cluster, label[0], label[1], label[2]], value)
+
+    def legacy_collect(self):
+        '''
+        The collect before the spec files were compiled, kept as the reference of collect.
+        '''
+        # Read the beans polled by the scheduler, no http request is sent during a scrape.
+        # beans returns a type of 'Tuple'
+        beans = self._get_beans()
 
         # set up all metrics with labels and descriptions.
         self._setup_metrics_labels()
 
         # add metric value to every metric.
-        self._get_metrics(self._beans)
+        self._get_metrics(beans)
 
         # update namenode metrics with common metrics
-        common_metrics = common_metrics_info(self._cluster, self._beans, "resourcemanager")
+        common_metrics = common_metrics_info(self._cluster, beans, "resourcemanager")
         self._hadoop_resourcemanager_metrics.update(common_metrics())
 
         for i in range(len(self._merge_list)):
@@ -880,80 +1011,369 @@ class ResourceManagerMetricsCollector(MetricCol):
                         self._hadoop_resourcemanager_metrics['ClusterMetrics'][key].add_metric(label, beans[i][metric] if metric in beans[i] else 0)
 
 
+class DataNodeMetricsCollector(MetricCol):
+    '''
+    Export the common metrics of every DataNode found by a DataNodeDiscovery, labeled by the DataNode host.
+    '''
+    def __init__(self, cluster, store, discovery, key=None):
+        MetricCol.__init__(self, cluster, "", "HDFS", "datanode", store, key)
+        self._discovery = discovery
+        self._spec = spec.get_compiled_spec("datanode", ["common"], labels=("cluster", "host"))
+        self._limiter = cardinality.CardinalityLimiter(self._spec.prefix, self._key)
+
+    def collect(self):
+        started = time.time()
+        families = self._spec.new_families()
+        for key, host in sorted(self._discovery.targets().items()):
+            snapshot = self._store.latest(key)
+            for kind, bean in self._spec.select(self._get_index(snapshot)):
+                self._spec.add_bean(families, bean, [self._cluster, host], kind)
+        self._limiter.apply(families)
+        self._record_collect(families, started)
+
+        for family in families.values():
+            yield family
+
+
 class HBaseMetricsCollector(MetricCol):
+    '''
+    Export the Server, IPC, WAL and common metrics of every HBase Master and RegionServer of a cluster, labeled by the
+    role and host of the daemon. The per-region metrics of the RegionServers are summed per table and per namespace of
+    the cluster. The request and op counts of the regions restart when a region moves, they are exported as counters
+    which add up the increases of each RegionServer.
+    '''
+    def __init__(self, cluster, store, masters, discovery, key=None):
+        '''
+        @param masters: A dict of target key -> host of the HBase Masters.
+        @param discovery: The RegionServerDiscovery keeping the RegionServer targets.
+        '''
+        MetricCol.__init__(self, cluster, "", "HBase", "hbase", store, key)
+        self._masters = dict(masters)
+        self._discovery = discovery
+        self._spec = spec.get_compiled_spec("hbase", ["hbase", "common"], labels=("cluster", "role", "host"))
+        self._limiter = cardinality.CardinalityLimiter(self._spec.prefix, self._key)
+        # target key -> dict of (family, label values) -> the last value of a counter of the regions of the target.
+        self._last = {}
+        # (family, label values) -> running total of the increases of a counter of the regions.
+        self._totals = {}
+        self._lock = threading.Lock()
 
-    def __init__(self, cluster):
-        MetricCol.__init__(self, cluster, Config().HBASE_URL, "hbase")
-        self._url = "http://10.110.13.43:16010/jmx?qry=Hadoop:service=HBase,name=Master,sub=IPC"
-        self._file_list = utils.get_file_list("hbase")
+    def collect(self):
+        started = time.time()
+        families = self._spec.new_families()
+        # (family, label values) -> sum over the RegionServers of the rolled up regions.
+        tables = OrderedDict()
+        regionservers = self._discovery.targets()
+        for role, targets in (('master', self._masters), ('regionserver', regionservers)):
+            for key, host in sorted(targets.items()):
+                snapshot = self._store.latest(key)
+                labels = [self._cluster, role, host]
+                for kind, bean in self._spec.select(self._get_index(snapshot)):
+                    if kind.expand is not None:
+                        # the regions and histograms are built once per poll of the bean, not once per scrape.
+                        rows = snapshot.derived_bean(kind.name, bean, lambda bean: list(self._spec.bean_rows(bean, kind)))
+                        if kind.name == 'Regions':
+                            self._add_regions(tables, key, rows)
+                        else:
+                            self._spec.add_rows(families, rows, labels)
+                    else:
+                        self._spec.add_bean(families, bean, labels, kind)
+        self._forget(regionservers)
+        self._spec.add_rows(families, ((family, label_values, value) for (family, label_values), value in tables.items()),
+                            [self._cluster])
+        self._limiter.apply(families)
+        self._record_collect(families, started)
 
-        self._metrics = {}
-        self._hadoop_hbase_metrics = {}
+        for family in families.values():
+            yield family
+
+    def _add_regions(self, tables, key, rows):
+        '''
+        Add the rolled up regions of one RegionServer into tables, a counter gets the total of its increases.
+        An increase is the growth of the sum of a table on the server since its previous poll, so a region which moves
+        off the server, or restarts its counts on another one, is not taken for a counter reset of the whole table.
+        '''
+        with self._lock:
+            last = self._last.get(key, {})
+            current = self._last[key] = {}
+            for family, label_values, value in rows:
+                series = (family, tuple(label_values))
+                if self._spec.families[family][2] is CounterMetricFamily:
+                    previous = last.get(series)
+                    current[series] = value
+                    total = self._totals.get(series, 0.0)
+                    if previous is not None and value > previous:
+                        total += value - previous
+                    value = self._totals[series] = total
+                else:
+                    value += tables.get(series, 0)
+                tables[series] = value
+
+    def _forget(self, regionservers):
+        '''
+        Drop the counters of the RegionServers gone, e.g. decommissioned, and of the tables no RegionServer has.
+        '''
+        with self._lock:
+            for gone in set(self._last) - set(regionservers):
+                del self._last[gone]
+            alive = set()
+            for last in self._last.values():
+                alive.update(last)
+            for series in set(self._totals) - alive:
+                del self._totals[series]
 
-        for i in range(len(self._file_list)):
-            self._metrics.setdefault(self._file_list[i], utils.read_json_file("hbase", self._file_list[i]))
-            self._hadoop_hbase_metrics.setdefault(self._file_list[i], {})
+
+class ClusterMetricsCollector(object):
+    '''
+    Merge the families of the collectors of one component in every cluster. They all use the same family names, which
+    a registry refuses from two collectors, their series differ by the cluster label.
+    '''
+    def __init__(self):
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def add(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
 
     def collect(self):
-        # Request data from ambari Collect Host API
-        # Request exactly the System level information we need from node
-        # beans returns a type of 'List'
-        metrics = utils.get_metrics(self._url)
-        beans = metrics['beans']
+        with self._lock:
+            collectors = list(self._collectors)
+        families = OrderedDict()
+        copied = set()
+        for collector in collectors:
+            for family in collector.collect():
+                merged = families.get(family.name)
+                if merged is None:
+                    families[family.name] = family
+                    continue
+                if family.name not in copied:
+                    # the family of the first cluster may be held by its collector, extend a copy of it.
+                    merged = families[family.name] = copy.copy(merged)
+                    merged.samples = list(merged.samples)
+                    copied.add(family.name)
+                merged.samples.extend(family.samples)
+        return list(families.values())
 
-        # set up all metrics with labels and descriptions.
-        self._setup_metrics_labels()
 
-        # add metric value to every metric.
-        self._get_metrics(beans)
+_cluster_collectors = {}
+_cluster_collectors_lock = threading.Lock()
 
-        # yield all metrics
-        for i in range(len(self._file_list)):
-            service = self._file_list[i]
-            for metric in self._hadoop_hbase_metrics[service]:
-                yield self._hadoop_hbase_metrics[service][metric]
 
-    def _setup_metrics_labels(self):
-        if 'IPC' in self._metrics:
-            ipc_flag = 1
-            for metric in self._metrics['IPC']:
-                if 'TotalCallTime' in metric:
-                    if ipc_flag:
-                        key = 'TotalCallTime'
-                        ipc_flag = 0
-                        self._hadoop_hbase_metrics['IPC'][key] = HistogramMetricFamily('hadoop_hbase_call_time_total',
-                                                                                     'Total call time counts in each quantile')
-                    else:
-                        continue
-                else:
-                    pass
+def register_collector(component, collector):
+    '''
+    Register the collector of a component of one cluster into the REGISTRY, merged with the collectors of the same
+    component of the other clusters, see ClusterMetricsCollector.
+    @param component: Component name, e.g. "namenode".
+    '''
+    with _cluster_collectors_lock:
+        if component not in _cluster_collectors:
+            _cluster_collectors[component] = ClusterMetricsCollector()
+            REGISTRY.register(_cluster_collectors[component])
+        _cluster_collectors[component].add(collector)
 
-    def _get_metrics(self, beans):
-        # bean is a type of <Dict>
-        # status is a type of <Str>
 
-        for i in range(len(beans)):
-            if 'IPC' in beans[i]['name']:
-                if 'IPC' in self._metrics:
-                    count_value = 0
-                    sum_value = 0
-                    for metric in self._metrics['IPC']:
-                        key = 'TotalCallTime'
-                        if 'TotalCallTime' in metric and 'percentile' in metric:
-                            count_value += 1
-                            sum_value += beans[i][metric]
-                        self._hadoop_hbase_metrics['IPC'][key].add_metric([], count_value, sum_value)
+class ExporterMetricsCollector(object):
+    '''
+    Export the cost of the exporter itself, prefixed with "hadoop_exporter_".
+    '''
+    def __init__(self, discoveries=None, routers=None):
+        '''
+        @param discoveries: A dict of cluster -> DataNodeDiscovery whose latency and churn are exported.
+        @param routers: A dict of cluster -> list of HARouters whose HA states and failovers are exported.
+        '''
+        self._prefix = 'hadoop_exporter_'
+        self._discoveries = discoveries if discoveries is not None else {}
+        self._routers = routers if routers is not None else {}
 
+    def collect(self):
+        pool_stats = utils.get_pool_stats()
+        families = [
+            (CounterMetricFamily, 'requests', 'http_requests_total', 'Total number of http requests sent to the host.'),
+            (CounterMetricFamily, 'connections', 'http_connections_total', 'Total number of tcp connections opened to the host.'),
+            (GaugeMetricFamily, 'reuse_ratio', 'http_connection_reuse_ratio', 'Ratio of http requests sent over a reused keep-alive connection.'),
+            (CounterMetricFamily, 'wire_bytes', 'http_wire_bytes_total', 'Total number of response bytes received on the wire (compressed).'),
+            (CounterMetricFamily, 'decoded_bytes', 'http_decoded_bytes_total', 'Total number of response bytes after decompression.'),
+        ]
+        for family_type, key, name, descriptions in families:
+            family = family_type(self._prefix + name, descriptions, labels=["host"])
+            for host in pool_stats:
+                family.add_metric([host], pool_stats[host][key])
+            yield family
+
+        if self._discoveries:
+            for family_type, name, descriptions, value in [
+                (GaugeMetricFamily, 'discovery_targets', 'Current number of DataNode targets.', lambda d: len(d.targets())),
+                (CounterMetricFamily, 'discovery_targets_added_total', 'Total number of DataNode targets added.', lambda d: d.added),
+                (CounterMetricFamily, 'discovery_targets_removed_total', 'Total number of DataNode targets removed.', lambda d: d.removed),
+                (GaugeMetricFamily, 'discovery_duration_seconds', 'Seconds the last DataNode discovery took.', lambda d: d.last_duration),
+                (GaugeMetricFamily, 'discovery_last_run_timestamp_seconds', 'Unix time of the last DataNode discovery.', lambda d: d.last_run),
+            ]:
+                family = family_type(self._prefix + name, descriptions, labels=["cluster"])
+                for cluster, discovery in sorted(self._discoveries.items()):
+                    family.add_metric([cluster], value(discovery))
+                yield family
+
+        if any(self._routers.values()):
+            active = GaugeMetricFamily(self._prefix + 'ha_active', 'Whether the url is the one polled as the active daemon.',
+                                       labels=["cluster", "service", "url", "state"])
+            failovers = CounterMetricFamily(self._prefix + 'ha_failovers_total', 'Total number of failovers followed.',
+                                            labels=["cluster", "service"])
+            for cluster, routers in sorted(self._routers.items()):
+                for router in routers:
+                    for url in router.urls:
+                        active.add_metric([cluster, router.service, url, router.states.get(url) or 'unknown'],
+                                          1 if url == router.active else 0)
+                    failovers.add_metric([cluster, router.service], router.failovers)
+            yield active
+            yield failovers
+
+        for family in selfmetrics.stats.collect(self._prefix):
+            yield family
+
+        # memory of the whole process, shared by all clusters it polls.
+        resident, peak = utils.get_process_memory()
+        yield GaugeMetricFamily(self._prefix + 'memory_resident_bytes', 'Current resident memory of the exporter process in bytes.', value=resident)
+        yield GaugeMetricFamily(self._prefix + 'memory_resident_peak_bytes', 'Peak resident memory of the exporter process in bytes.', value=peak)
+
+
+def start_cluster(cluster, targets, store, pool=None):
+    '''
+    Poll the components of one cluster on its own schedule and register their collectors, merged with the ones of the
+    other clusters, see register_collector.
+    The snapshots of the cluster are kept in the store under "<cluster>/<component>".
+    @param cluster: Cluster name, exported as the cluster label.
+    @param targets: A dict of component -> jmx url (or list of HA jmx urls) and options, see utils.read_targets_file.
+    @param store: The SnapshotStore shared by all clusters.
+    @param pool: A workers.ClassifyPool shared by all clusters, the masters are then decoded and classified in it.
+    @return a tuple of (list of started schedulers, DataNodeDiscovery or None, list of HARouters).
+    '''
+    interval = targets.get('interval', Config.POLL_INTERVAL)
+    max_age = targets.get('max_age', Config.SNAPSHOT_MAX_AGE)
+    # poll jmx urls in background, collectors only read the latest snapshots.
+    scheduler = Scheduler(store, Fetcher(pool=pool), max_age)
+    schedulers = [scheduler]
+    discovery = None
+    routers = []
+
+    def route(service):
+        '''
+        @return a tuple of (primary url, HARouter or None) of the component.
+        '''
+        urls = targets[service] if isinstance(targets[service], list) else [targets[service]]
+        if len(urls) < 2:
+            return urls[0], None
+        # the HA states are trusted for one poll interval, so a failover is followed on the next poll.
+        router = HARouter(service, urls, interval)
+        routers.append(router)
+        return urls[0], router
+
+    def classifier(service, raw):
+        '''
+        @return the workers.Classifier of the component, None without a pool.
+        '''
+        if pool is None:
+            return None
+        if Config.DERIVE_RATES:
+            raw = raw + list(rates.RATE_KINDS)
+        return workers.Classifier(service, [service, "common"], raw=raw)
+
+    # only fetch the beans described in the spec directories of each collector.
+    if targets.get('resourcemanager'):
+        key = cluster + '/resourcemanager'
+        url, router = route('resourcemanager')
+        scheduler.add_target(key, url, interval,
+                             projection.get_queries("resourcemanager", ["resourcemanager", "common"]), router,
+                             classifier("resourcemanager", ['RMNMInfo']),
+                             intervals=projection.get_query_intervals("resourcemanager", ["resourcemanager", "common"]))
+        collector = ResourceManagerMetricsCollector(cluster, store, url, key)
+        if Config.DERIVE_RATES:
+            scheduler.add_listener(key, collector.rates.on_snapshot)
+        register_collector('resourcemanager', collector)
+
+    if targets.get('namenode'):
+        key = cluster + '/namenode'
+        queries = projection.get_queries("namenode", ["namenode", "common"])
+        if targets.get('datanode_discovery', Config.DATANODE_DISCOVERY):
+            # the DataNodes are polled by their own scheduler and pool, a large fleet can not delay the masters.
+            datanode_scheduler = Scheduler(store, Fetcher(max_workers=Config.DATANODE_WORKERS), max_age)
+            discovery = DataNodeDiscovery(datanode_scheduler, interval, projection.get_queries("datanode", ["common"]),
+                                          key_prefix=cluster + '/datanode/')
+            queries.append("Hadoop:service=NameNode,name=NameNodeInfo")
+            scheduler.add_listener(key, discovery.on_snapshot)
+            datanode_scheduler.start(cluster + "-datanode-scheduler")
+            schedulers.append(datanode_scheduler)
+            register_collector('datanode', DataNodeMetricsCollector(cluster, store, discovery, cluster + '/datanode'))
+        url, router = route('namenode')
+        scheduler.add_target(key, url, interval, queries, router, classifier("namenode", ['NameNodeInfo']),
+                             intervals=projection.get_query_intervals("namenode", ["namenode", "common"]))
+        collector = NameNodeMetricsCollector(cluster, store, url, key)
+        if Config.DERIVE_RATES:
+            scheduler.add_listener(key, collector.rates.on_snapshot)
+        register_collector('namenode', collector)
+
+    if targets.get('hbase_master') or targets.get('hbase_regionservers'):
+        # the RegionServers are polled by their own scheduler and pool, like the DataNodes.
+        regionserver_scheduler = Scheduler(store, Fetcher(max_workers=Config.HBASE_REGIONSERVER_WORKERS), max_age)
+        regionservers = RegionServerDiscovery(regionserver_scheduler, interval,
+                                              projection.get_queries("hbase", ["hbase", "common"], projection.HBASE_SKIPPED['regionserver']),
+                                              key_prefix=cluster + '/hbase/regionserver/',
+                                              intervals=projection.get_query_intervals("hbase", ["hbase", "common"]))
+        masters = {}
+        urls = targets.get('hbase_master') or []
+        # every Master is polled, a backup Master exports its own metrics and is ignored by the discovery.
+        for url in urls if isinstance(urls, list) else [urls]:
+            host = urlsplit(url).netloc
+            key = '{0}/hbase/master/{1}'.format(cluster, host)
+            scheduler.add_target(key, url, interval,
+                                 projection.get_queries("hbase", ["hbase", "common"], projection.HBASE_SKIPPED['master']),
+                                 intervals=projection.get_query_intervals("hbase", ["hbase", "common"]))
+            if not targets.get('hbase_regionservers'):
+                scheduler.add_listener(key, regionservers.on_snapshot)
+            masters[key] = host
+        if targets.get('hbase_regionservers'):
+            regionservers.update(dict((urlsplit(url).netloc, url) for url in targets['hbase_regionservers']))
+        regionserver_scheduler.start(cluster + "-hbase-scheduler")
+        schedulers.append(regionserver_scheduler)
+        register_collector('hbase', HBaseMetricsCollector(cluster, store, masters, regionservers, cluster + '/hbase'))
+
+    scheduler.start(cluster + "-scheduler")
+    return schedulers, discovery, routers
 
 
 def main():
+    args = utils.parse_args()
+    port = int(args.port)
+    schedulers = []
+    pool = None
+    consul = None
     try:
-        args = utils.parse_args()
-        port = int(args.port)
 
-        # REGISTRY.register(NameNodeMetricsCollector(args.cluster))
-        REGISTRY.register(ResourceManagerMetricsCollector(args.cluster))
-        # REGISTRY.register(HBaseMetricsCollector(args.cluster,Config().HDFS_ACTIVE_URL))
+        if args.targets_file:
+            clusters = utils.read_targets_file(args.targets_file)
+        else:
+            clusters = {args.cluster: {'namenode': [u for u in (args.namenode_url, args.namenode_standby_url) if u],
+                                       'resourcemanager': [u for u in (args.resourcemanager_url, args.resourcemanager_standby_url) if u],
+                                       'interval': args.interval}}
+
+        # every cluster has its own schedulers, all of them publish into one store served by one http server.
+        store = SnapshotStore()
+        # the worker processes are forked before any scheduler thread starts.
+        pool = workers.ClassifyPool() if Config.PROCESS_POOL else None
+        discoveries = {}
+        routers = {}
+        for cluster, targets in clusters.items():
+            cluster_schedulers, discovery, routers[cluster] = start_cluster(cluster, targets, store, pool)
+            schedulers.extend(cluster_schedulers)
+            if discovery is not None:
+                discoveries[cluster] = discovery
+
+        REGISTRY.register(ExporterMetricsCollector(discoveries, routers))
+
+        # render the registry once per poll, scrapes are served from the cached bytes by one event loop.
+        # bind before registering into consul, a taken port must not be announced.
+        server = exposition.AsyncMetricsServer(('', port), exposition.ExpositionCache(store),
+                                               metrics_paths=set(['/metrics', args.path]))
 
         c = Consul(host='10.110.13.216')
         # Register Service
@@ -964,14 +1384,24 @@ def main():
                                  address='10.9.11.95',
                                  port=port,
                                  tags=['hadoop'])
-        start_http_server(port)
+        consul = c
+
+        # SIGINT and SIGTERM stop the event loop, then everything is torn down below.
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda signum, frame: server.shutdown())
         print("Polling %s. Serving at port: %s" % (args.address, port))
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        c.agent.service.deregister(service_id='consul_python_test2323')
+        server.serve_forever()
         print(" Interrupted")
-        exit(0)
+    finally:
+        if consul is not None:
+            try:
+                consul.agent.service.deregister(service_id='consul_python_test2323')
+            except Exception as e:
+                logger.error("Deregister from consul failed, error msg is: {0}".format(e))
+        for scheduler in schedulers:
+            scheduler.stop()
+        if pool is not None:
+            pool.shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,283 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import copy
+import glob
+import json
+import os
+
+basedir = os.path.dirname(os.path.abspath(__file__))
+
+# the beans every hadoop daemon has, copied from the NameNode samples into the other services.
+COMMON_BEANS = ('JvmMetrics', 'RpcActivity', 'RpcDetailedActivity', 'UgiMetrics', 'MetricsSystem')
+
+NODE_STATES = ('RUNNING', 'RUNNING', 'RUNNING', 'UNHEALTHY', 'DECOMMISSIONED', 'LOST')
+
+
+def load_beans(component):
+    '''
+    @param component: Sub directory of test/, e.g. "namenode", "yarn".
+    @return the sample beans of the directory, sorted by file name.
+    '''
+    beans = []
+    for path in sorted(glob.glob(os.path.join(basedir, 'test', component, '*.json'))):
+        with open(path, 'r') as f:
+            beans.append(json.load(f))
+    return beans
+
+
+def _find(beans, name):
+    for bean in beans:
+        if name in bean['name']:
+            return bean
+    raise KeyError(name)
+
+
+def rpc_beans(service, template, detailed_template, ports, methods):
+    '''
+    @param service: ObjectName service, e.g. "NameNode".
+    @param ports: Number of rpc ports, each one has a RpcActivity and a RpcDetailedActivity bean.
+    @param methods: Number of rpc methods in each RpcDetailedActivity bean, 0 keeps the methods of the sample.
+    '''
+    beans = []
+    for i in range(ports):
+        port = str(8020 + i)
+        rpc = copy.deepcopy(template)
+        rpc['name'] = "Hadoop:service={0},name=RpcActivityForPort{1}".format(service, port)
+        rpc['tag.port'] = port
+        detailed = copy.deepcopy(detailed_template)
+        detailed['name'] = "Hadoop:service={0},name=RpcDetailedActivityForPort{1}".format(service, port)
+        detailed['tag.port'] = port
+        for j in range(methods):
+            detailed["Method{0}NumOps".format(j)] = j * 7
+            detailed["Method{0}AvgTime".format(j)] = j * 0.25
+        beans.extend([rpc, detailed])
+    return beans
+
+
+def namenode_beans(rpc_ports=1, rpc_methods=0, ha_state=None, live_nodes=None):
+    '''
+    @param ha_state: "active" or "standby" to put into FSNamesystem and NameNodeStatus, None keeps the sample.
+    @param live_nodes: A dict of DataNode "host:xferport" -> http "host:port", adds a NameNodeInfo bean listing them.
+    @return the NameNode sample beans, with rpc_ports RpcActivity / RpcDetailedActivity pairs of rpc_methods methods each.
+    '''
+    samples = load_beans('namenode')
+    beans = [b for b in samples if 'RpcActivity' not in b['name'] and 'RpcDetailedActivity' not in b['name']]
+    if ha_state is not None:
+        _find(beans, 'FSNamesystem')['tag.HAState'] = ha_state
+        _find(beans, 'NameNodeStatus')['State'] = ha_state
+    if live_nodes is not None:
+        beans.append({
+            "name": "Hadoop:service=NameNode,name=NameNodeInfo",
+            "modelerType": "org.apache.hadoop.hdfs.server.namenode.FSNamesystem",
+            "LiveNodes": json.dumps(dict((node, {"infoAddr": info_addr, "adminState": "In Service", "xferaddr": node})
+                                         for node, info_addr in live_nodes.items())),
+        })
+    return beans + rpc_beans('NameNode', _find(samples, 'RpcActivity'), _find(samples, 'RpcDetailedActivity'),
+                             rpc_ports, rpc_methods)
+
+
+def _common_beans(service):
+    # the jvm, ugi and metrics system beans of the NameNode samples, renamed to another service.
+    beans = []
+    for bean in load_beans('namenode'):
+        if any(name in bean['name'] for name in COMMON_BEANS) and 'Rpc' not in bean['name']:
+            bean = copy.deepcopy(bean)
+            bean['name'] = bean['name'].replace('NameNode', service)
+            beans.append(bean)
+    return beans
+
+
+def datanode_beans(host, rpc_methods=0):
+    '''
+    @return the beans of a DataNode: the common beans of the NameNode samples renamed to DataNode, and DataNodeInfo.
+    '''
+    samples = load_beans('namenode')
+    beans = _common_beans('DataNode')
+    beans.append({
+        "name": "Hadoop:service=DataNode,name=DataNodeInfo",
+        "modelerType": "org.apache.hadoop.hdfs.server.datanode.DataNode",
+        "XceiverCount": 4,
+        "Version": "2.7.3",
+        "RpcPort": "8010",
+        "HttpPort": None,
+        "ClusterId": "CID-stub",
+        "VolumeInfo": "{}",
+    })
+    beans.append({
+        "name": "Hadoop:service=DataNode,name=DataNodeActivity-{0}-50010".format(host),
+        "modelerType": "DataNodeActivity-{0}-50010".format(host),
+        "tag.SessionId": None,
+        "tag.Context": "dfs",
+        "tag.Hostname": host,
+        "BytesWritten": 1 << 30, "BytesRead": 1 << 31, "BlocksWritten": 8192, "BlocksRead": 16384,
+        "ReadsFromLocalClient": 100, "ReadsFromRemoteClient": 200, "WritesFromLocalClient": 300, "WritesFromRemoteClient": 400,
+        "HeartbeatsNumOps": 1000, "HeartbeatsAvgTime": 1.5,
+    })
+    return beans + rpc_beans('DataNode', _find(samples, 'RpcActivity'), _find(samples, 'RpcDetailedActivity'), 1, rpc_methods)
+
+
+def node_managers(count):
+    '''
+    @return the LiveNodeManagers list of a RMNMInfo bean with count NodeManagers.
+    '''
+    return [{
+        "HostName": "nm{0:05d}.example.com".format(i),
+        "Rack": "/rack{0}".format(i % 40),
+        "State": NODE_STATES[i % len(NODE_STATES)],
+        "NodeId": "nm{0:05d}.example.com:45454".format(i),
+        "NodeHTTPAddress": "nm{0:05d}.example.com:8042".format(i),
+        "LastHealthUpdate": 1500000000000 + i,
+        "HealthReport": "",
+        "NodeManagerVersion": "2.7.3",
+        "NumContainers": i % 32,
+        "UsedMemoryMB": (i % 32) * 2048,
+        "AvailableMemoryMB": 65536 - (i % 32) * 2048,
+    } for i in range(count)]
+
+
+def resourcemanager_beans(node_manager_count=3, rpc_ports=1, rpc_methods=0, ha_state=None):
+    '''
+    @param ha_state: "active" or "standby", adds a RMInfo bean of that HA state.
+    @return the ResourceManager sample beans plus a RMNMInfo bean of node_manager_count NodeManagers, a root
+            QueueMetrics bean and the common beans of the NameNode samples renamed to ResourceManager.
+    '''
+    samples = load_beans('namenode')
+    beans = load_beans('yarn')
+    if ha_state is not None:
+        beans.append({
+            "name": "Hadoop:service=ResourceManager,name=RMInfo",
+            "modelerType": "org.apache.hadoop.yarn.server.resourcemanager.ResourceManager",
+            "State": ha_state,
+            "HAState": ha_state.upper(),
+        })
+    beans.append({
+        "name": "Hadoop:service=ResourceManager,name=RMNMInfo",
+        "modelerType": "org.apache.hadoop.yarn.server.resourcemanager.RMNMInfo",
+        "LiveNodeManagers": json.dumps(node_managers(node_manager_count)),
+    })
+    beans.append({
+        "name": "Hadoop:service=ResourceManager,name=QueueMetrics,q0=root",
+        "modelerType": "QueueMetrics,q0=root",
+        "tag.Queue": "root",
+        "running_0": 12, "running_60": 3, "running_300": 1, "running_1440": 0,
+        "AppsSubmitted": 1024, "AppsRunning": 16, "AppsPending": 2, "AppsCompleted": 990, "AppsKilled": 10, "AppsFailed": 6,
+        "AllocatedMB": 409600, "AllocatedVCores": 200, "AllocatedContainers": 190,
+        "AvailableMB": 819200, "AvailableVCores": 400, "PendingMB": 0, "PendingVCores": 0, "PendingContainers": 0,
+    })
+    return beans + _common_beans('ResourceManager') + rpc_beans('ResourceManager', _find(samples, 'RpcActivity'), _find(samples, 'RpcDetailedActivity'),
+                             rpc_ports, rpc_methods)
+
+
+def _hbase_ipc(service):
+    # the attributes of the hbase/IPC.json spec with made up values.
+    bean = {
+        "name": "Hadoop:service=HBase,name={0},sub=IPC".format(service),
+        "modelerType": "{0},sub=IPC".format(service),
+        "tag.Context": service.lower(),
+    }
+    with open(os.path.join(basedir, 'hbase', 'IPC.json'), 'r') as f:
+        for i, attr in enumerate(sorted(json.load(f))):
+            bean[attr] = i * 3
+    return bean
+
+
+def _hbase_percentiles(bean, metric, scale):
+    # the _num_ops, min/max/mean and percentile attributes of a hbase histogram.
+    bean["{0}_num_ops".format(metric)] = 1000 * scale
+    for i, suffix in enumerate(("min", "25th_percentile", "median", "75th_percentile", "90th_percentile",
+                                "95th_percentile", "98th_percentile", "99th_percentile", "99.9th_percentile", "max")):
+        bean["{0}_{1}".format(metric, suffix)] = i * scale
+    bean["{0}_mean".format(metric)] = 4 * scale
+
+
+def hbase_master_beans(region_servers=3, active=True):
+    '''
+    @return the beans of a HBase Master: Server and IPC plus the common beans.
+    '''
+    beans = _common_beans('HBase')
+    beans.append({
+        "name": "Hadoop:service=HBase,name=Master,sub=Server",
+        "modelerType": "Master,sub=Server",
+        "tag.isActiveMaster": "true" if active else "false",
+        "tag.liveRegionServers": ";".join("rs{0}.stub,16020,1500000000000".format(i) for i in range(region_servers)),
+        "tag.deadRegionServers": "",
+        "tag.clusterId": "stub",
+        "masterActiveTime": 1500000000000,
+        "masterStartTime": 1500000000000,
+        "averageLoad": 12.5,
+        "numRegionServers": region_servers,
+        "numDeadRegionServers": 0,
+        "clusterRequests": 123456,
+    })
+    beans.append(_hbase_ipc('Master'))
+    return beans
+
+
+def hbase_regionserver_beans(host, tables=4, regions_per_table=8, namespaces=2):
+    '''
+    @param tables: Number of tables, spread over namespaces, each one has regions_per_table regions on this server.
+    @return the beans of a HBase RegionServer: Server, IPC, WAL and Regions plus the common beans.
+    '''
+    beans = _common_beans('HBase')
+    server = {
+        "name": "Hadoop:service=HBase,name=RegionServer,sub=Server",
+        "modelerType": "RegionServer,sub=Server",
+        "tag.serverName": "{0},16020,1500000000000".format(host),
+        "tag.Hostname": host,
+        "regionCount": tables * regions_per_table,
+        "storeCount": tables * regions_per_table * 2,
+        "storeFileCount": tables * regions_per_table * 5,
+        "memStoreSize": 1 << 27, "storeFileSize": 1 << 34, "hlogFileCount": 7, "hlogFileSize": 1 << 28,
+        "totalRequestCount": 99999, "readRequestCount": 77777, "writeRequestCount": 22222,
+        "blockCacheCount": 5000, "blockCacheSize": 1 << 30, "blockCacheHitCount": 90000, "blockCacheMissCount": 10000,
+        "blockCacheExpressHitPercent": 90.0, "compactionQueueLength": 0, "flushQueueLength": 0,
+        "slowGetCount": 1, "slowPutCount": 2, "slowDeleteCount": 0, "slowAppendCount": 0, "slowIncrementCount": 0,
+    }
+    for metric in ("Get", "Mutate", "Delete", "Append", "Increment", "Replay", "ScanNext"):
+        _hbase_percentiles(server, metric, 1)
+        server["{0}_TimeRangeCount_0-1".format(metric)] = 900
+        server["{0}_TimeRangeCount_1-3".format(metric)] = 80
+        server["{0}_TimeRangeCount_3-10".format(metric)] = 20
+    beans.append(server)
+    beans.append(_hbase_ipc('RegionServer'))
+    wal = {
+        "name": "Hadoop:service=HBase,name=RegionServer,sub=WAL",
+        "modelerType": "RegionServer,sub=WAL",
+        "appendCount": 500000, "slowAppendCount": 3, "rollRequest": 12, "lowReplicaRollRequest": 0,
+    }
+    for metric, scale in (("AppendTime", 1), ("AppendSize", 1024), ("SyncTime", 2)):
+        _hbase_percentiles(wal, metric, scale)
+    wal["SyncTime_TimeRangeCount_0-1"] = 700
+    wal["SyncTime_TimeRangeCount_1-3"] = 250
+    wal["AppendSize_SizeRangeCount_100-1000"] = 400
+    wal["AppendSize_SizeRangeCount_1000-10000"] = 600
+    beans.append(wal)
+    regions = {
+        "name": "Hadoop:service=HBase,name=RegionServer,sub=Regions",
+        "modelerType": "RegionServer,sub=Regions",
+        "numRegions": tables * regions_per_table,
+    }
+    for t in range(tables):
+        namespace = "default" if t % namespaces == 0 else "ns{0}".format(t % namespaces)
+        for r in range(regions_per_table):
+            prefix = "Namespace_{0}_table_t{1}_region_{2:032x}_metric_".format(namespace, t, t * 100003 + r)
+            for i, metric in enumerate(("storeCount", "storeFileCount", "memStoreSize", "storeFileSize",
+                                        "readRequestCount", "writeRequestCount", "compactionsCompletedCount")):
+                regions[prefix + metric] = (t + 1) * (r + 1) * (i + 1)
+            for op in ("get_num_ops", "scanNext_num_ops", "mutateCount", "appendCount", "deleteCount", "incrementCount"):
+                regions[prefix + op] = (t + r + 1) * 10
+    beans.append(regions)
+    return beans
+
+
+def jmx_document(beans):
+    '''
+    @return the text of a /jmx response holding the beans, "name" first in every bean like the jmx servlet writes it.
+    '''
+    parts = []
+    for bean in beans:
+        rest = json.dumps(dict((k, v) for k, v in bean.items() if k != 'name'), indent=2)
+        parts.append('{{\n  "name" : {0},{1}'.format(json.dumps(bean['name']), rest[1:]) if len(rest) > 2
+                     else '{{\n  "name" : {0}\n}}'.format(json.dumps(bean['name'])))
+    return '{\n  "beans" : [ ' + ', '.join(parts) + ' ]\n}'
@@ -0,0 +1,244 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import codecs
+import json
+import re
+import time
+
+# the jmx servlet always writes "name" as the first key of a bean, a bean whose head is still not recognized
+# after this many characters is decoded without filtering.
+MAX_HEAD_SIZE = 4096
+
+_BEANS_RE = re.compile(r'"beans"\s*:\s*\[')
+_NAME_RE = re.compile(r'\{\s*"name"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_KEY_RE = re.compile(r'\{\s*"((?:[^"\\]|\\.)*)"\s*:')
+_SPACE_RE = re.compile(r'[\s,]*')
+_STRUCT_RE = re.compile(r'[{}\[\]"]')
+_STRING_RE = re.compile(r'["\\]')
+# one attribute of a flat bean, the value is a string or a scalar.
+_PAIR_RE = re.compile(r'\s*,?\s*"((?:[^"\\]|\\.)*)"\s*:\s*("(?:[^"\\]|\\.)*"|[^\s,{}\[\]"]+)')
+_END_RE = re.compile(r'\s*}')
+_NESTED_RE = re.compile(r'\s*,?\s*"(?:[^"\\]|\\.)*"\s*:\s*[{\[]')
+_SCALARS = {'true': True, 'false': False, 'null': None}
+
+
+class BeanStreamParser(object):
+    '''
+    Walk the "beans" array of a jmx response piece by piece.
+    Only beans accepted by the keep function are decoded, the others are skipped by scanning brackets and strings,
+    so their values (e.g. NameNodeInfo LiveNodes) are never materialized as python objects.
+    Peak memory is bounded by the largest kept bean plus one chunk, not by the response size.
+    A flat bean may be folded instead, attribute by attribute as it is read, e.g. the HBase Regions bean with one
+    attribute per region, so only the folded result is ever held.
+    '''
+    # parser phases.
+    HEADER, ARRAY, HEAD, SCAN, FOLD, DONE = range(6)
+
+    def __init__(self, keep):
+        '''
+        @param keep: A function of the bean name, returns True if the bean should be decoded. It may return a reducer
+                     instead, an object whose add(attribute, value) is called for every attribute of the bean, and
+                     whose bean() is returned in place of the bean.
+        '''
+        self._keep = keep
+        self._buf = u''
+        self._pos = 0
+        self._phase = self.HEADER
+        # state of the bean being scanned.
+        self._start = 0
+        self._keeping = False
+        self._reducer = None
+        self._depth = 0
+        self._in_string = False
+        self.skipped = 0
+
+    @property
+    def done(self):
+        return self._phase == self.DONE
+
+    def feed(self, text):
+        '''
+        @param text: Next piece of the response text.
+        @return a list of the beans completed by this piece.
+        '''
+        self._buf += text
+        beans = []
+        while self._phase != self.DONE and self._step(beans):
+            pass
+        self._compact()
+        return beans
+
+    def _compact(self):
+        # drop the characters which will never be read again.
+        if self._phase == self.SCAN and self._keeping is True:
+            cut = self._start
+        elif self._phase == self.HEADER:
+            cut = max(len(self._buf) - 32, 0)
+        else:
+            cut = self._pos
+        if cut:
+            self._buf = self._buf[cut:]
+            self._pos -= cut
+            self._start -= cut
+
+    def _step(self, beans):
+        '''
+        Advance the parser as far as the buffered text allows.
+        @return False if more text is needed.
+        '''
+        buf = self._buf
+        if self._phase == self.HEADER:
+            m = _BEANS_RE.search(buf)
+            if not m:
+                return False
+            self._pos = m.end()
+            self._phase = self.ARRAY
+            return True
+
+        if self._phase == self.ARRAY:
+            self._pos = _SPACE_RE.match(buf, self._pos).end()
+            if self._pos >= len(buf):
+                return False
+            c = buf[self._pos]
+            if c == ']':
+                self._phase = self.DONE
+                return False
+            if c != '{':
+                raise ValueError("Unexpected character {0!r} in beans array.".format(c))
+            self._start = self._pos
+            self._phase = self.HEAD
+            return True
+
+        if self._phase == self.HEAD:
+            m = _NAME_RE.match(buf, self._start)
+            if m:
+                keeping = self._keep(json.loads(u'"{0}"'.format(m.group(1))))
+                if hasattr(keeping, 'add'):
+                    self._reducer = keeping
+                    self._pos = self._start + 1
+                    self._phase = self.FOLD
+                    return True
+                self._keeping = bool(keeping)
+            else:
+                # a bean whose first key is not "name" can not be filtered, decode it.
+                m = _KEY_RE.match(buf, self._start)
+                if (m and m.group(1) != 'name') or len(buf) - self._start > MAX_HEAD_SIZE:
+                    self._keeping = True
+                else:
+                    return False
+            self._pos = self._start
+            self._depth = 0
+            self._in_string = False
+            self._phase = self.SCAN
+            return True
+
+        if self._phase == self.SCAN:
+            return self._scan(beans)
+        if self._phase == self.FOLD:
+            return self._fold(beans)
+        return False
+
+    def _fold(self, beans):
+        buf = self._buf
+        pos = self._pos
+        add = self._reducer.add
+        while True:
+            m = _PAIR_RE.match(buf, pos)
+            # a scalar at the end of the buffer may go on in the next piece.
+            if m is None or m.end() == len(buf):
+                break
+            key, value = m.groups()
+            add(json.loads(u'"{0}"'.format(key)) if '\\' in key else key,
+                json.loads(value) if value[0] == '"' or value not in _SCALARS else _SCALARS[value])
+            pos = m.end()
+        self._pos = pos
+        m = _END_RE.match(buf, pos)
+        if m is None:
+            if _NESTED_RE.match(buf, pos) or len(buf) - pos > MAX_HEAD_SIZE:
+                raise ValueError("Unexpected value at {0!r} in a folded bean.".format(buf[pos:pos + 64]))
+            return False
+        beans.append(self._reducer.bean())
+        self._reducer = None
+        self._pos = m.end()
+        self._phase = self.ARRAY
+        return True
+
+    def _scan(self, beans):
+        buf = self._buf
+        pos = self._pos
+        depth = self._depth
+        in_string = self._in_string
+        end = None
+        while True:
+            if in_string:
+                m = _STRING_RE.search(buf, pos)
+                if not m:
+                    pos = len(buf)
+                    break
+                if m.group() == '\\':
+                    if m.end() >= len(buf):
+                        # the escaped character is not buffered yet.
+                        pos = m.start()
+                        break
+                    pos = m.end() + 1
+                    continue
+                in_string = False
+                pos = m.end()
+            else:
+                m = _STRUCT_RE.search(buf, pos)
+                if not m:
+                    pos = len(buf)
+                    break
+                c = m.group()
+                pos = m.end()
+                if c == '"':
+                    in_string = True
+                elif c in '{[':
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        end = pos
+                        break
+        self._pos = pos
+        self._depth = depth
+        self._in_string = in_string
+        if end is None:
+            return False
+        if self._keeping:
+            beans.append(json.loads(buf[self._start:end]))
+        else:
+            self.skipped += 1
+        self._phase = self.ARRAY
+        return True
+
+
+def iter_beans(chunks, keep, encoding='utf-8', stats=None):
+    '''
+    Stream the kept beans of a jmx response.
+    @param chunks: An iterable of response body bytes, e.g. response.iter_content().
+    @param keep: A function of the bean name, returns True if the bean should be decoded.
+    @param stats: A dict, "decode" is increased by the seconds spent parsing and "bytes" by the body size.
+    @return a generator of bean dicts.
+    '''
+    stats = stats if stats is not None else {}
+    stats.setdefault('decode', 0.0)
+    stats.setdefault('bytes', 0)
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    parser = BeanStreamParser(keep)
+    for chunk in chunks:
+        stats['bytes'] += len(chunk)
+        if parser.done:
+            # keep draining, so a keep-alive connection can go back to the pool.
+            continue
+        start = time.time()
+        beans = parser.feed(decoder.decode(chunk))
+        stats['decode'] += time.time() - start
+        for bean in beans:
+            yield bean
+    if not parser.done:
+        for bean in parser.feed(decoder.decode(b'', final=True)):
+            yield bean
+    if not parser.done:
+        raise ValueError("Truncated jmx response, the beans array is not closed.")
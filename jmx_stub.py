@@ -0,0 +1,384 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+'''
+A local /jmx stub of whole hadoop clusters built from the test/ samples, with injected faults, to load test and
+break the exporter on one machine.
+
+    python jmx_stub.py --clusters 2 --ha --datanodes 50 --latency exp:0.05 --errors status=0.01,reset=0.01 \
+        --flip-interval 60 --targets-file stub_targets.json
+    python hadoop_exporter.py -t stub_targets.json
+'''
+
+import argparse
+import gzip
+import io
+import json
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+import jmx_fixtures
+import projection
+
+# the faults a response can get, in the order their rates are rolled.
+#   status: an http 500 error page.
+#   reset: the connection is reset without any response.
+#   truncate: the headers announce the whole body, the connection is closed after half of it.
+#   garbage: a complete http 200 response whose body is cut in half, so it is not valid json.
+#   hang: the response is held back for the hang seconds, long enough for the client to time out.
+FAULTS = ('status', 'reset', 'truncate', 'garbage', 'hang')
+
+
+def parse_latency(spec):
+    '''
+    @param spec: "0.05" for a fixed delay in seconds, "uniform:0.01,0.2", "exp:0.05" (mean) or "lognormal:-3,1" (mu,sigma).
+    @return a function of a random.Random returning a delay in seconds.
+    '''
+    kind, _, args = spec.partition(':')
+    if not args:
+        value = float(kind)
+        return lambda rng: value
+    params = [float(a) for a in args.split(',')]
+    if kind == 'uniform' and len(params) == 2:
+        return lambda rng: rng.uniform(params[0], params[1])
+    if kind == 'exp' and len(params) == 1:
+        return lambda rng: rng.expovariate(1.0 / params[0]) if params[0] > 0 else 0.0
+    if kind == 'lognormal' and len(params) == 2:
+        return lambda rng: rng.lognormvariate(params[0], params[1])
+    raise ValueError("Invalid latency {0}, expected seconds, uniform:a,b, exp:mean or lognormal:mu,sigma.".format(spec))
+
+
+def parse_errors(spec):
+    '''
+    @param spec: e.g. "status=0.01,reset=0.005", the fraction of responses getting each fault of FAULTS.
+    @return a dict of fault -> rate.
+    '''
+    rates = {}
+    for item in (spec or '').split(','):
+        if not item.strip():
+            continue
+        fault, _, rate = item.partition('=')
+        fault = fault.strip()
+        if fault not in FAULTS:
+            raise ValueError("Invalid fault {0}, expected one of {1}.".format(fault, ', '.join(FAULTS)))
+        rates[fault] = float(rate)
+    if sum(rates.values()) > 1:
+        raise ValueError("Fault rates {0} add up to more than 1.".format(spec))
+    return rates
+
+
+class Faults(object):
+    '''
+    The latency and faults injected into the responses of the stub, with a count of every fault injected.
+    '''
+    def __init__(self, latency='0', errors=None, hang=30.0, seed=None):
+        self._latency = parse_latency(latency)
+        self._rates = parse_errors(errors) if not isinstance(errors, dict) else errors
+        self.hang = hang
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = dict((fault, 0) for fault in ('ok',) + FAULTS)
+
+    def roll(self):
+        '''
+        @return a tuple of (delay in seconds, fault or None) for one response.
+        '''
+        with self._lock:
+            delay = max(0.0, self._latency(self._random))
+            r = self._random.random()
+            fault = None
+            for name in FAULTS:
+                rate = self._rates.get(name, 0)
+                if r < rate:
+                    fault = name
+                    break
+                r -= rate
+            self.counts[fault or 'ok'] += 1
+        return delay, fault
+
+
+class HAGroup(object):
+    '''
+    The HA daemons of one service, the active one moves to the next daemon every flip_interval seconds.
+    '''
+    def __init__(self, size, flip_interval=0, started=None):
+        self.size = size
+        self.flip_interval = flip_interval
+        self.started = started or time.time()
+
+    def state(self, index, now=None):
+        active = 0
+        if self.flip_interval > 0:
+            active = int(((now or time.time()) - self.started) // self.flip_interval) % self.size
+        return 'active' if index == active else 'standby'
+
+
+class StubInstance(object):
+    '''
+    One virtual daemon. The /jmx document of every HA state and qry is rendered once and then served from memory,
+    so the stub stays cheap even when it serves 5000 NodeManagers.
+    '''
+    def __init__(self, name, service, build, ha_group=None, ha_index=0):
+        '''
+        @param service: "namenode", "datanode", "resourcemanager", "hbase_master" or "hbase_regionserver".
+        @param build: A function of the HA state (None without HA) returning the beans of the daemon.
+        '''
+        self.name = name
+        self.service = service
+        self.url = None
+        self._build = build
+        self._ha_group = ha_group
+        self._ha_index = ha_index
+        self._beans = {}
+        self._documents = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ha_state(self):
+        return self._ha_group.state(self._ha_index) if self._ha_group is not None else None
+
+    def document(self, qry=None, gzipped=False):
+        '''
+        @param qry: An ObjectName pattern, e.g. "Hadoop:service=NameNode,name=*", only the matching beans are served.
+        @return the body of the /jmx response.
+        '''
+        state = self.ha_state
+        key = (state, qry, gzipped)
+        body = self._documents.get(key)
+        if body is not None:
+            return body
+        with self._lock:
+            if state not in self._beans:
+                self._beans[state] = self._build(state)
+            beans = self._beans[state]
+            if qry:
+                matcher = projection.BeanMatcher([qry])
+                beans = [bean for bean in beans if matcher(bean['name'])]
+            body = jmx_fixtures.jmx_document(beans).encode('utf-8')
+            if gzipped:
+                buf = io.BytesIO()
+                with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+                    f.write(body)
+                body = buf.getvalue()
+            self._documents[key] = body
+        return body
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.rstrip('/') != '/jmx':
+            self.send_error(404)
+            return
+        delay, fault = self.server.faults.roll()
+        if fault == 'hang':
+            delay += self.server.faults.hang
+        if delay:
+            time.sleep(delay)
+        if fault == 'status':
+            self.send_error(500, "Injected fault")
+            return
+        if fault == 'reset':
+            # linger 0 turns the close into a RST, like a daemon which died mid request.
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.close_connection = True
+            return
+
+        gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+        body = self.server.instance.document(parse_qs(url.query).get('qry', [None])[0], gzipped)
+        length = len(body)
+        if fault == 'garbage':
+            body = body[:len(body) // 2]
+            length = len(body)
+        elif fault == 'truncate':
+            body = body[:len(body) // 2]
+            self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf8')
+        self.send_header('Content-Length', str(length))
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, instance, faults):
+        HTTPServer.__init__(self, address, StubHandler)
+        self.instance = instance
+        self.faults = faults
+
+
+class JmxStub(object):
+    '''
+    Virtual clusters of NameNodes, DataNodes, ResourceManagers and HBase daemons, one http port per daemon.
+    NameNodeInfo lists the stub DataNodes, so the exporter's DataNode discovery finds them.
+    '''
+    def __init__(self, faults, clusters=1, namenodes=1, resourcemanagers=1, datanodes=3, hbase_masters=0,
+                 regionservers=0, ha=False, flip_interval=0, rpc_ports=1, rpc_methods=0, node_managers=3, tables=4,
+                 regions_per_table=8, addr='127.0.0.1', port=19000):
+        self.faults = faults
+        self.addr = addr
+        # cluster -> service -> list of StubInstance.
+        self.clusters = {}
+        self._servers = []
+        self._next_port = port
+        started = time.time()
+
+        for c in range(clusters):
+            cluster = "stub{0}".format(c)
+            services = self.clusters[cluster] = {}
+
+            datanode_ports = {}
+            for i in range(datanodes):
+                host = "dn{0}.{1}".format(i, cluster)
+                instance = self._add(services, StubInstance(
+                    host, 'datanode', lambda state, host=host: jmx_fixtures.datanode_beans(host, rpc_methods)))
+                datanode_ports["{0}:50010".format(host)] = "{0}:{1}".format(addr, instance.port)
+
+            group = HAGroup(namenodes, flip_interval, started) if ha else None
+            for i in range(namenodes):
+                self._add(services, StubInstance(
+                    "nn{0}.{1}".format(i, cluster), 'namenode',
+                    lambda state: jmx_fixtures.namenode_beans(rpc_ports, rpc_methods, state, datanode_ports), group, i))
+
+            group = HAGroup(resourcemanagers, flip_interval, started) if ha else None
+            for i in range(resourcemanagers):
+                self._add(services, StubInstance(
+                    "rm{0}.{1}".format(i, cluster), 'resourcemanager',
+                    lambda state: jmx_fixtures.resourcemanager_beans(node_managers, rpc_ports, rpc_methods, state),
+                    group, i))
+
+            group = HAGroup(hbase_masters, flip_interval, started)
+            for i in range(hbase_masters):
+                self._add(services, StubInstance(
+                    "master{0}.{1}".format(i, cluster), 'hbase_master',
+                    lambda state: jmx_fixtures.hbase_master_beans(regionservers, state == 'active'), group, i))
+
+            for i in range(regionservers):
+                host = "rs{0}.{1}".format(i, cluster)
+                self._add(services, StubInstance(
+                    host, 'hbase_regionserver',
+                    lambda state, host=host: jmx_fixtures.hbase_regionserver_beans(host, tables, regions_per_table)))
+
+    def _add(self, services, instance):
+        instance.port = self._next_port
+        instance.url = "http://{0}:{1}/jmx".format(self.addr, instance.port)
+        self._next_port += 1
+        services.setdefault(instance.service, []).append(instance)
+        return instance
+
+    def start(self):
+        for services in self.clusters.values():
+            for instances in services.values():
+                for instance in instances:
+                    server = StubServer((self.addr, instance.port), instance, self.faults)
+                    thread = threading.Thread(target=server.serve_forever, name="stub-{0}".format(instance.name))
+                    thread.daemon = True
+                    thread.start()
+                    self._servers.append(server)
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+
+    def targets(self, interval=None):
+        '''
+        @return the stub clusters in the format of the exporter's targets file, see utils.read_targets_file.
+        '''
+        rlt = {}
+        for cluster, services in sorted(self.clusters.items()):
+            target = rlt[cluster] = {}
+            for service in ('namenode', 'resourcemanager'):
+                urls = [instance.url for instance in services.get(service, [])]
+                if urls:
+                    target[service] = urls if len(urls) > 1 else urls[0]
+            # the server names the stub Masters report are not the stub ports, list the RegionServers instead.
+            masters = [instance.url for instance in services.get('hbase_master', [])]
+            if masters:
+                target['hbase_master'] = masters
+            regionservers = [instance.url for instance in services.get('hbase_regionserver', [])]
+            if regionservers:
+                target['hbase_regionservers'] = regionservers
+            if interval:
+                target['interval'] = interval
+        return rlt
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve stub /jmx documents of hadoop clusters with injected faults.')
+    parser.add_argument('--clusters', type=int, default=1, help='Number of clusters. (default 1)')
+    parser.add_argument('--namenodes', type=int, default=1, help='NameNodes per cluster. (default 1)')
+    parser.add_argument('--resourcemanagers', type=int, default=1, help='ResourceManagers per cluster. (default 1)')
+    parser.add_argument('--datanodes', type=int, default=3, help='DataNodes per cluster. (default 3)')
+    parser.add_argument('--hbase-masters', type=int, default=0, help='HBase Masters per cluster. (default 0)')
+    parser.add_argument('--regionservers', type=int, default=0, help='HBase RegionServers per cluster. (default 0)')
+    parser.add_argument('--ha', action='store_true', help='The NameNodes and the ResourceManagers of a cluster are HA.')
+    parser.add_argument('--flip-interval', type=float, default=0,
+                        help='Seconds until the active HA daemon moves to the next one, 0 never. (default 0)')
+    parser.add_argument('--rpc-ports', type=int, default=1, help='Rpc ports of every daemon. (default 1)')
+    parser.add_argument('--rpc-methods', type=int, default=0,
+                        help='Methods in every RpcDetailedActivity bean, 0 keeps the sample. (default 0)')
+    parser.add_argument('--node-managers', type=int, default=3, help='NodeManagers in RMNMInfo. (default 3)')
+    parser.add_argument('--tables', type=int, default=4, help='Tables on every RegionServer. (default 4)')
+    parser.add_argument('--regions-per-table', type=int, default=8, help='Regions of a table on every RegionServer. (default 8)')
+    parser.add_argument('--latency', default='0', help='Response latency, seconds, uniform:a,b, exp:mean or lognormal:mu,sigma. (default 0)')
+    parser.add_argument('--errors', default='', help='Fault rates, e.g. status=0.01,reset=0.01,truncate=0.01,garbage=0.01,hang=0.01.')
+    parser.add_argument('--hang', type=float, default=30.0, help='Seconds a "hang" fault holds the response. (default 30)')
+    parser.add_argument('--seed', type=int, help='Seed of the latencies and faults.')
+    parser.add_argument('--addr', default='127.0.0.1', help='Listen on this address. (default "127.0.0.1")')
+    parser.add_argument('--port', type=int, default=19000, help='Port of the first daemon, the others follow it. (default 19000)')
+    parser.add_argument('--interval', type=int, help='Poll interval written into the targets file.')
+    parser.add_argument('--targets-file', help='Write the stub clusters into this targets file of the exporter.')
+    args = parser.parse_args()
+
+    try:
+        faults = Faults(args.latency, args.errors, args.hang, args.seed)
+    except ValueError as e:
+        parser.error(str(e))
+    stub = JmxStub(faults, args.clusters, args.namenodes, args.resourcemanagers, args.datanodes, args.hbase_masters,
+                   args.regionservers, args.ha, args.flip_interval, args.rpc_ports, args.rpc_methods,
+                   args.node_managers, args.tables, args.regions_per_table, args.addr, args.port)
+    stub.start()
+    for cluster, services in sorted(stub.clusters.items()):
+        for service, instances in sorted(services.items()):
+            for instance in instances:
+                sys.stderr.write("{0:<8} {1:<20} {2:<24} {3}\n".format(cluster, service, instance.name, instance.url))
+    if args.targets_file:
+        with open(args.targets_file, 'w') as f:
+            json.dump(stub.targets(args.interval), f, indent=4, sort_keys=True)
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
+        sys.stderr.write("Responses: {0}\n".format(json.dumps(faults.counts, sort_keys=True)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import fnmatch
+import os
+import re
+
+import spec
+import utils
+
+# hadoop service name used in the jmx ObjectName of each collector service.
+SERVICES = {
+    'namenode': 'NameNode',
+    'datanode': 'DataNode',
+    'journalnode': 'JournalNode',
+    'resourcemanager': 'ResourceManager',
+    'nodemanager': 'NodeManager',
+    'mapreduce': 'JobHistoryServer',
+    'hbase': 'HBase',
+}
+
+# "RpcActivityForPort8020" -> ("RpcActivity", "8020"), "RetryCache.NameNodeRetryCache" -> ("RetryCache", None).
+_BEAN_NAME_RE = re.compile(r'^(\w+?)(?:ForPort(\d+)|\..*)?$')
+
+# ObjectName properties of the beans described by a spec file, when they differ from "name=<spec file name>".
+BEAN_PATTERNS = {
+    'RpcActivity': 'name=RpcActivityForPort*',
+    'RpcDetailedActivity': 'name=RpcDetailedActivityForPort*',
+    'MetricsSystem': 'name=MetricsSystem,sub=Stats',
+    'RetryCache': 'name=RetryCache*',
+    'QueueMetrics': 'name=QueueMetrics,q0=root',
+    'Master': 'name=Master,sub=Server',
+    'RegionServer': 'name=RegionServer,sub=Server',
+    'IPC': 'name=*,sub=IPC',
+    'WAL': 'name=RegionServer,sub=WAL',
+    'Regions': 'name=RegionServer,sub=Regions',
+}
+
+# spec files of the beans a HBase daemon of each role does not have.
+HBASE_SKIPPED = {
+    'master': ('RegionServer', 'WAL', 'Regions'),
+    'regionserver': ('Master',),
+}
+
+
+# (service, spec file) -> reducer class of the beans which are folded while they are parsed, see BeanMatcher.
+BEAN_REDUCERS = {
+    ('hbase', 'Regions'): spec.RegionRollup,
+}
+
+
+def get_queries(service, spec_dirs, skipped=()):
+    '''
+    Build the jmx ObjectName queries of all beans described in the spec directories.
+    @param service: Service name, e.g. "namenode", "resourcemanager".
+    @param spec_dirs: Spec directories read by the collector, e.g. ["namenode", "common"].
+    @param skipped: Spec files whose beans are not queried, e.g. HBASE_SKIPPED["master"].
+    @return a list of queries, e.g. ["Hadoop:service=NameNode,name=FSNamesystem", ...].
+    '''
+    queries = []
+    for spec_dir in spec_dirs:
+        for spec in sorted(utils.get_file_list(spec_dir)):
+            if spec in skipped:
+                continue
+            query = _get_query(service, spec)
+            if query not in queries:
+                queries.append(query)
+    return queries
+
+
+def _get_query(service, spec):
+    return "Hadoop:service={0},{1}".format(SERVICES[service], BEAN_PATTERNS.get(spec, "name=" + spec))
+
+
+def get_query_intervals(service, spec_dirs):
+    '''
+    Read the poll intervals of the beans which are not polled on the interval of their target, from the _intervals.json
+    of each spec directory, e.g. {"NameNodeInfo": 60, "StartupProgress": 300}. The keys are spec file names, or the
+    base name of other beans the collector queries.
+    @param service: Service name, e.g. "namenode".
+    @param spec_dirs: Spec directories read by the collector, e.g. ["namenode", "common"].
+    @return a dict of query -> poll interval in seconds, see get_queries.
+    '''
+    intervals = {}
+    for spec_dir in spec_dirs:
+        if os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)), spec_dir, '_intervals.json')):
+            for spec, interval in utils.read_json_file(spec_dir, '_intervals').items():
+                intervals[_get_query(service, spec)] = interval
+    return intervals
+
+
+def get_query_urls(url, queries):
+    '''
+    @param url: The jmx url, e.g. http://host1:50070/jmx.
+    @param queries: ObjectName queries returned by get_queries.
+    @return a list of jmx urls, each one only fetches the beans matched by one query.
+    '''
+    base_url = url.rstrip('/').split('?')[0]
+    return ["{0}?qry={1}".format(base_url, query) for query in queries]
+
+
+def parse_object_name(name):
+    '''
+    @param name: A jmx ObjectName, e.g. "Hadoop:service=NameNode,name=MetricsSystem,sub=Stats".
+    @return a tuple of (domain, dict of properties).
+    '''
+    domain, _, props = name.partition(':')
+    properties = {}
+    for prop in props.split(','):
+        key, _, value = prop.partition('=')
+        properties[key] = value
+    return domain, properties
+
+
+class BeanMatcher(object):
+    '''
+    Match bean names against ObjectName queries the way the jmx servlet does: the property lists must be equal,
+    and "*" / "?" are wildcards inside the domain and property values. A bean matched by the query of a spec file of
+    BEAN_REDUCERS is folded by a new reducer instead of being decoded, see jmx_stream.BeanStreamParser.
+    '''
+    def __init__(self, queries):
+        reducers = dict((_get_query(service, spec), reducer) for (service, spec), reducer in BEAN_REDUCERS.items())
+        self._patterns = [parse_object_name(query) + (reducers.get(query),) for query in queries]
+
+    def __call__(self, name):
+        domain, props = parse_object_name(name)
+        for p_domain, p_props, reducer in self._patterns:
+            if len(p_props) != len(props) or not fnmatch.fnmatchcase(domain, p_domain):
+                continue
+            if all(key in props and fnmatch.fnmatchcase(props[key], value) for key, value in p_props.items()):
+                return reducer() if reducer is not None else True
+        return False
+
+
+class BeanIndex(object):
+    '''
+    Index the beans of one snapshot by their parsed ObjectName properties, so a collector finds the beans of a kind
+    with a dict lookup instead of scanning every bean name for a substring.
+    The "name" property is indexed by its base name, e.g. both RpcActivityForPort8020 and RpcActivityForPort8040 are
+    found under "RpcActivity", and told apart by their port.
+    '''
+    def __init__(self, beans):
+        self._beans = {}
+        for bean in beans:
+            domain, props = parse_object_name(bean.get('name', ''))
+            m = _BEAN_NAME_RE.match(props.get('name', ''))
+            base, port = m.groups() if m else (props.get('name'), None)
+            props['port'] = bean.get('tag.port', port)
+            self._beans.setdefault(base, []).append((props, bean))
+
+    def find(self, name, service=None, sub=None, port=None, **props):
+        '''
+        @param name: Base name of the beans, e.g. "FSNamesystem", "RpcActivity".
+        @param service: The service property, e.g. "NameNode". Any service by default.
+        @param sub: The sub property, e.g. "Stats". Any sub by default.
+        @param port: The rpc port, read from tag.port or the bean name. Any port by default.
+        @param props: Other ObjectName properties the beans must have, a None value means the property must be absent.
+        @return a list of the matched beans, in the order of the snapshot.
+        '''
+        props.update(service=service, sub=sub, port=port)
+        wanted = [(k, v) for k, v in props.items() if v is not None or k not in ('service', 'sub', 'port')]
+        return [bean for bean_props, bean in self._beans.get(name, ())
+                if all(bean_props.get(k) == v for k, v in wanted)]
@@ -0,0 +1,191 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+
+import projection
+import selfmetrics
+from config import Config
+
+# kinds whose XxxNumOps / XxxAvgTime attributes are a metrics2 MutableRate, and the name of their derived families.
+RATE_KINDS = OrderedDict([
+    ('NameNodeActivity', 'nnactivity_method'),
+    ('RpcActivity', 'rpc_method'),
+    ('RpcDetailedActivity', 'rpc_detailed_method'),
+    ('UgiMetrics', 'ugi_method'),
+    ('ClusterMetrics', 'ams'),
+])
+
+
+class _Ring(object):
+    '''
+    The last polls of one NumOps / AvgTime pair: a flat array of (timestamp, ops delta, time delta) per poll,
+    plus the last NumOps, the running total time and the sums of the deltas in the window, kept up to date as polls
+    come and go, so a poll costs the same whatever the window.
+    '''
+    __slots__ = ('values', 'head', 'count', 'last', 'total', 'ops', 'spent')
+
+    def __init__(self, size):
+        self.values = array('d', [0.0]) * (3 * size)
+        self.head = 0
+        self.count = 0
+        self.last = 0.0
+        self.total = 0.0
+        self.ops = 0.0
+        self.spent = 0.0
+
+    def add(self, timestamp, num_ops, avg_time):
+        size = len(self.values) // 3
+        if not self.count:
+            delta = 0.0
+        elif num_ops >= self.last:
+            delta = num_ops - self.last
+        else:
+            # NumOps went down, the daemon restarted and its counter started again from 0.
+            delta = num_ops
+        self.last = num_ops
+        spent = delta * avg_time
+        self.total += spent
+
+        # the sums hold the deltas of all but the oldest poll, those fall between the oldest timestamp and the newest.
+        if self.count == size:
+            # the oldest poll is overwritten, the one after it becomes the oldest and leaves the sums.
+            k = (self.head + 1) % size * 3
+            self.ops = max(0.0, self.ops - self.values[k + 1])
+            self.spent = max(0.0, self.spent - self.values[k + 2])
+        if self.count:
+            self.ops += delta
+            self.spent += spent
+
+        i = self.head * 3
+        self.values[i] = timestamp
+        self.values[i + 1] = delta
+        self.values[i + 2] = spent
+        self.head = (self.head + 1) % size
+        self.count = min(self.count + 1, size)
+
+    @property
+    def newest(self):
+        '''
+        Timestamp of the newest poll, 0 if none.
+        '''
+        size = len(self.values) // 3
+        return self.values[(self.head - 1) % size * 3] if self.count else 0.0
+
+    @property
+    def rate(self):
+        size = len(self.values) // 3
+        newest = (self.head - 1) % size * 3
+        oldest = (self.head - self.count) % size * 3
+        elapsed = self.values[newest] - self.values[oldest]
+        return self.ops / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def avg(self):
+        return self.spent / self.ops if self.ops else 0.0
+
+
+class RateDeriver(object):
+    '''
+    Derive rates from the metrics2 MutableRate pairs of one target: XxxNumOps is a counter, XxxAvgTime the average
+    time of the last metrics2 period only. Each poll adds its NumOps delta and delta * AvgTime to a ring of the last
+    window polls, which gives the ops per second, the average time weighted by the ops of each poll, and the total time
+    spent, without any rate() over thousands of methods in Prometheus.
+    '''
+    def __init__(self, compiled, key=None, window=Config.RATE_WINDOW):
+        '''
+        @param compiled: The spec.CompiledSpec of the collector, its NumOps rules give the labels of each series.
+        @param key: Target name, the derive stage is recorded into selfmetrics.stats under it.
+        @param window: Number of polls the rates and the weighted average time are computed over, at least 2.
+        '''
+        self._spec = compiled
+        self._key = key
+        self._window = max(2, window)
+        self._kinds = [name for name in RATE_KINDS if name in compiled.kinds]
+        # (kind name, label values without the leading labels) -> _Ring.
+        self._rings = {}
+        # kind name -> label names of its NumOps family.
+        self._labels = {}
+        self._url = None
+        self._timestamp = 0
+        self._lock = threading.Lock()
+
+    def on_snapshot(self, snapshot):
+        '''
+        Add a polled snapshot, a scheduler listener. Failed polls are skipped, they neither derive nor forget series.
+        '''
+        if not snapshot.beans or snapshot.timestamp <= self._timestamp:
+            return
+        started = time.time()
+        index = snapshot.derived('index', projection.BeanIndex)
+        with self._lock:
+            if snapshot.url != self._url:
+                # a failover or a new url: the counters of another daemon do not continue the old ones, start new
+                # rings but keep the total time going up, it is a counter.
+                for series, ring in list(self._rings.items()):
+                    self._rings[series] = _Ring(self._window)
+                    self._rings[series].total = ring.total
+                self._url = snapshot.url
+            rings = {}
+            for kind, bean in self._spec.select(index, kinds=self._kinds):
+                prefix = [bean.get(attr, '') for _, attr in kind.bean_labels]
+                # a bean polled less often than its target is only added when it was polled again.
+                polled = snapshot.polled_at(bean)
+                for metric in (bean if kind.dynamic else kind.table):
+                    if not metric.endswith('NumOps'):
+                        continue
+                    avg_time = bean.get(metric[:-len('NumOps')] + 'AvgTime')
+                    rule = kind.resolve(metric) if kind.dynamic else kind.table[metric]
+                    if avg_time is None or rule is None:
+                        continue
+                    if kind.name not in self._labels:
+                        self._labels[kind.name] = self._spec.families[rule.family][1]
+                    series = (kind.name, tuple(prefix + rule.label_values))
+                    ring = self._rings.get(series)
+                    if ring is None:
+                        ring = _Ring(self._window)
+                    if polled > ring.newest:
+                        ring.add(polled, float(bean.get(metric) or 0), float(avg_time or 0))
+                    rings[series] = ring
+            # series gone from the bean, e.g. a rpc method no longer called, are forgotten.
+            self._rings = rings
+            self._timestamp = snapshot.timestamp
+        if self._key is not None:
+            selfmetrics.stats.observe(self._key, 'derive', time.time() - started)
+
+    def collect(self, labels):
+        '''
+        @param labels: Leading label values, e.g. [cluster].
+        @return a list of the derived metric families.
+        '''
+        prefix = self._spec.prefix
+        families = []
+        with self._lock:
+            by_kind = {}
+            for (kind, label_values), ring in self._rings.items():
+                by_kind.setdefault(kind, []).append((label_values, ring))
+            for kind in self._kinds:
+                if kind not in by_kind:
+                    continue
+                name = prefix + RATE_KINDS[kind]
+                label_names = self._labels[kind]
+                rate = GaugeMetricFamily(name + '_ops_per_second', 'Operations per second over the last polls.', labels=label_names)
+                avg = GaugeMetricFamily(name + '_weighted_avg_time_milliseconds',
+                                        'Average time in milliseconds over the last polls, weighted by the operations of each poll.',
+                                        labels=label_names)
+                total = CounterMetricFamily(name + '_time_milliseconds_total',
+                                            'Total time spent in milliseconds since the exporter started, the sum of NumOps deltas times AvgTime.',
+                                            labels=label_names)
+                for label_values, ring in sorted(by_kind[kind], key=lambda item: item[0]):
+                    values = list(labels) + list(label_values)
+                    if ring.count > 1:
+                        rate.add_metric(values, ring.rate)
+                        avg.add_metric(values, ring.avg)
+                    total.add_metric(values, ring.total)
+                families.extend([rate, avg, total])
+        return families
@@ -0,0 +1,537 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from collections import OrderedDict
+
+import projection
+import selfmetrics
+from fetcher import Fetcher
+from config import Config
+from utils import get_module_logger
+
+logger = get_module_logger(__name__)
+
+
+class BeanMemo(object):
+    '''
+    Values computed from one bean, shared by the snapshots of a target as long as the bean is not polled again,
+    e.g. the decoded LiveNodeManagers of a RMNMInfo polled less often than the rest of the ResourceManager.
+    '''
+    def __init__(self):
+        # key -> (bean, value), the bean is held so its id can not be reused by another one.
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, bean, factory):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None or entry[0] is not bean:
+                entry = self._values[key] = (bean, factory(bean))
+            return entry[1]
+
+
+class Snapshot(object):
+    '''
+    An immutable view of one poll of a jmx url.
+    The poller always replaces a snapshot as a whole, collectors only read it, so a scrape never sees half-updated beans.
+    The beans of a target polled in groups on different intervals are merged, each group keeps its own timestamp.
+    '''
+    __slots__ = ('_url', '_beans', '_timestamp', '_rows', '_timestamps', '_polled', '_memo', '_derived', '_lock')
+
+    def __init__(self, url, beans, timestamp, rows=None, timestamps=None, polled=None, memo=None):
+        '''
+        @param url: The jmx url the beans were scraped from.
+        @param beans: The beans list returned by the jmx url.
+        @param timestamp: Unix time when the poll finished, 0 if the target was never polled.
+        @param rows: A list of workers.ClassifiedRows if the beans were classified in a worker process, beans then
+                     only holds the beans kept raw.
+        @param timestamps: A dict of query -> unix time the beans of the query were polled, see PollGroup.
+        @param polled: A dict of bean name -> unix time the bean was polled, timestamp for the beans not in it.
+        @param memo: The BeanMemo of the target.
+        '''
+        object.__setattr__(self, '_url', url)
+        object.__setattr__(self, '_beans', tuple(beans))
+        object.__setattr__(self, '_timestamp', timestamp)
+        object.__setattr__(self, '_rows', tuple(rows) if rows is not None else None)
+        object.__setattr__(self, '_timestamps', dict(timestamps or {}))
+        object.__setattr__(self, '_polled', polled or {})
+        object.__setattr__(self, '_memo', memo if memo is not None else BeanMemo())
+        object.__setattr__(self, '_derived', {})
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Snapshot is immutable.")
+
+    @property
+    def url(self):
+        return self._url
+
+    @property
+    def beans(self):
+        return self._beans
+
+    @property
+    def timestamp(self):
+        return self._timestamp
+
+    @property
+    def rows(self):
+        '''
+        The workers.ClassifiedRows of the poll, None if the collectors classify the beans themselves.
+        '''
+        return self._rows
+
+    @property
+    def timestamps(self):
+        '''
+        A dict of query -> unix time the beans of the query were polled, empty for a target without queries.
+        '''
+        return self._timestamps
+
+    def polled_at(self, bean):
+        '''
+        @return unix time the bean was polled, older than timestamp if its group is polled less often.
+        '''
+        return self._polled.get(bean.get('name'), self._timestamp)
+
+    def derived_bean(self, key, bean, factory):
+        '''
+        Compute a value from one bean, later snapshots of the target return the same value until the bean is polled again.
+        @param key: Name of the derived value, e.g. "RMNMInfo".
+        @param factory: A function of the bean.
+        '''
+        return self._memo.get(key, bean, factory)
+
+    def derived(self, key, factory):
+        '''
+        Compute a value from the beans once per snapshot, later calls of any collector return the same value.
+        @param key: Name of the derived value, e.g. "RMNMInfo".
+        @param factory: A function of the beans tuple, called at most once for each key.
+        '''
+        with self._lock:
+            if key not in self._derived:
+                self._derived[key] = factory(self._beans)
+            return self._derived[key]
+
+
+EMPTY_SNAPSHOT = Snapshot(None, (), 0)
+
+
+class SnapshotStore(object):
+    '''
+    Hold the latest snapshot of every polled target, keyed by the target name, e.g. "namenode", "resourcemanager".
+    The generation grows by one on every publish, a consumer holding data derived from all snapshots
+    (e.g. the rendered exposition) only needs to compare generations.
+    A target may have a max age, its snapshot is then served until it is older than that and dropped afterwards.
+    '''
+    def __init__(self):
+        self._snapshots = {}
+        self._max_ages = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def publish(self, key, snapshot):
+        with self._lock:
+            self._snapshots[key] = snapshot
+            self._generation += 1
+
+    def remove(self, key):
+        with self._lock:
+            self._max_ages.pop(key, None)
+            if self._snapshots.pop(key, None) is not None:
+                self._generation += 1
+
+    def set_max_age(self, key, max_age):
+        '''
+        @param max_age: Seconds the snapshot of the target is served for, None for ever.
+        '''
+        with self._lock:
+            self._max_ages[key] = max_age
+
+    def latest(self, key):
+        '''
+        @return the latest snapshot of the target, or an empty snapshot if it was never polled or is older than its
+                max age.
+        '''
+        snapshot = self._snapshots.get(key, EMPTY_SNAPSHOT)
+        max_age = self._max_ages.get(key)
+        if max_age is not None and snapshot.timestamp and time.time() - snapshot.timestamp > max_age:
+            return EMPTY_SNAPSHOT
+        return snapshot
+
+
+class PollGroup(object):
+    '''
+    The queries of a target polled on one interval, and the beans of their last good poll.
+    '''
+    def __init__(self, queries, interval):
+        self.queries = queries
+        self.interval = interval
+        self.urls = []
+        self.next_poll = 0
+        self.beans = []
+        self.rows = []
+        # unix time of the last good poll, 0 if none.
+        self.timestamp = 0
+
+    def clear(self):
+        self.next_poll = 0
+        self.beans = []
+        self.rows = []
+        self.timestamp = 0
+
+
+class PollTarget(object):
+
+    def __init__(self, key, url, interval, queries=None, router=None, classifier=None, intervals=None, max_age=None):
+        '''
+        @param key: Target name, collectors look the snapshot up by it.
+        @param url: The jmx url to poll.
+        @param interval: Poll interval in seconds.
+        @param queries: ObjectName queries of the beans to fetch, see projection.get_queries. None fetches the full jmx.
+        @param router: An ha.HARouter, the target then follows its active url instead of url.
+        @param classifier: A workers.Classifier, the responses are then decoded and classified in the process pool
+                           of the fetcher, if it has one.
+        @param intervals: A dict of query -> poll interval in seconds of the queries not polled every interval,
+                          see projection.get_query_intervals.
+        @param max_age: Seconds the beans of a group are kept after its poll was due, while its polls fail.
+        '''
+        self.key = key
+        self.interval = interval
+        self.queries = queries
+        self.router = router
+        self.classifier = classifier
+        self.max_age = max_age if max_age is not None else Config.SNAPSHOT_MAX_AGE
+        # a full jmx response is streamed and only the beans matched by the queries are decoded.
+        self.matcher = projection.BeanMatcher(queries) if queries and Config.STREAM_PARSE else None
+        self.memo = BeanMemo()
+        # one group per interval, the group of the target interval first.
+        groups = OrderedDict([(interval, [])])
+        for query in queries or [None]:
+            groups.setdefault((intervals or {}).get(query, interval), []).append(query)
+        self.groups = [PollGroup(q if queries else None, i) for i, q in groups.items() if q]
+        self.next_poll = 0
+        self.url = None
+        self.set_url(router.active if router is not None else url)
+
+    def set_url(self, url):
+        url = url.rstrip('/')
+        if url != self.url and self.url is not None:
+            # a failover, the beans of the groups polled less often are the ones of the other daemon.
+            for group in self.groups:
+                group.clear()
+        self.url = url
+        self.query_urls = projection.get_query_urls(self.url, self.queries) if self.queries else []
+        for group in self.groups:
+            group.urls = projection.get_query_urls(self.url, group.queries) if group.queries else [self.url]
+
+    @property
+    def urls(self):
+        return self.query_urls or [self.url]
+
+    def due_groups(self, now):
+        '''
+        Take the groups due now, and schedule their next polls. Groups due within a tenth of the target interval are
+        taken too, so groups whose intervals are multiples of each other stay in one poll instead of drifting apart.
+        @return the due groups, all groups if none is due.
+        '''
+        due = [g for g in self.groups if g.next_poll <= now + self.interval * 0.1] or self.groups
+        for group in due:
+            group.next_poll = now + group.interval
+        self.next_poll = min(g.next_poll for g in self.groups)
+        return due
+
+    def merge(self, now):
+        '''
+        Merge the last good beans of every group, the beans of a group whose polls failed for max_age after it was due
+        are dropped.
+        @return a tuple of (beans, rows, dict of query -> group timestamp, dict of bean name -> group timestamp).
+        '''
+        beans, rows, timestamps, polled = [], [], {}, {}
+        names = set()
+        for group in self.groups:
+            if not group.timestamp or now - group.timestamp > group.interval + self.max_age:
+                continue
+            for bean in group.beans:
+                if bean.get('name') not in names:
+                    names.add(bean.get('name'))
+                    beans.append(bean)
+                    polled[bean.get('name')] = group.timestamp
+            rows.extend(group.rows)
+            for query in group.queries or ():
+                timestamps[query] = group.timestamp
+        return beans, rows, timestamps, polled
+
+
+class Scheduler(object):
+    '''
+    Poll every registered jmx url on its own interval in background, and publish the result into a SnapshotStore.
+    A dispatcher thread hands the due targets to a Fetcher, so all of them are fetched in parallel and one dead host
+    only costs its own deadline.
+    A prometheus scrape then costs a dict lookup instead of a http round trip to the hadoop daemon.
+    A failed poll keeps the last good snapshot of the target, served until it is older than the max age of the target,
+    so a NameNode in a long GC pause still shows its last values instead of nothing.
+    The queries of a target may be polled in groups on their own intervals, e.g. the large NameNodeInfo once a minute
+    and the rest of the NameNode every poll, the snapshot merges the last good beans of every group.
+    '''
+    def __init__(self, store=None, fetcher=None, max_age=Config.SNAPSHOT_MAX_AGE):
+        '''
+        @param store: The SnapshotStore to publish into.
+        @param fetcher: The Fetcher of the jmx urls.
+        @param max_age: Default max age in seconds of the snapshots of the targets, see SnapshotStore.set_max_age.
+        '''
+        self.store = store if store is not None else SnapshotStore()
+        self._fetcher = fetcher if fetcher is not None else Fetcher()
+        self._max_age = max_age
+        self._targets = {}
+        self._listeners = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+        self._wakeup = threading.Event()
+
+    def add_target(self, key, url, interval, queries=None, router=None, classifier=None, max_age=None, intervals=None):
+        '''
+        @param max_age: Max age in seconds of the snapshots of the target, the one of the scheduler by default.
+        @param intervals: A dict of query -> poll interval of the queries polled on their own interval, see PollTarget.
+        '''
+        max_age = max_age if max_age is not None else self._max_age
+        self.store.set_max_age(key, max_age)
+        with self._lock:
+            self._targets[key] = PollTarget(key, url, interval, queries, router, classifier, intervals, max_age)
+        # a new target is due at once, do not let it wait for the earliest next poll of the others.
+        self._wakeup.set()
+
+    def remove_target(self, key):
+        '''
+        Stop polling the target and drop its snapshot.
+        '''
+        with self._lock:
+            target = self._targets.pop(key, None)
+        if target is not None:
+            for url in target.urls:
+                self._fetcher.forget(url)
+        self.store.remove(key)
+        selfmetrics.stats.forget(key)
+
+    def add_listener(self, key, callback):
+        '''
+        @param key: Target name.
+        @param callback: A function of the snapshot, called in the scheduler thread after every publish of the target.
+        '''
+        self._listeners.setdefault(key, []).append(callback)
+
+    def poll(self, keys=None):
+        '''
+        Fetch the due groups of the targets once in parallel and publish new snapshots, merged with the last good beans
+        of the groups not due. A target whose polled groups all failed keeps its last good snapshot.
+        A target with queries falls back to the full jmx when its queries were all answered but matched no bean, not
+        when the host is down or slow.
+        @param keys: Target names to poll, all targets by default.
+        '''
+        with self._lock:
+            targets = [self._targets[k] for k in (self._targets.keys() if keys is None else keys) if k in self._targets]
+        self._route(targets)
+        now = time.time()
+        groups = dict((t.key, t.due_groups(now)) for t in targets)
+        urls = []
+        keeps = {}
+        classifiers = {}
+        for t in targets:
+            polled = [url for group in groups[t.key] for url in group.urls]
+            urls.extend(polled)
+            if t.matcher is not None:
+                keeps.update((url, t.matcher) for url in polled)
+            if t.classifier is not None:
+                classifiers.update((url, t.classifier) for url in polled)
+        results = self._fetcher.fetch_all(urls, keeps=keeps, classifiers=classifiers)
+
+        now = time.time()
+        ok = {}
+        fallback = []
+        # key -> arguments of _record, recorded only for the targets still registered when their snapshot is published.
+        records = {}
+        for t in targets:
+            ok[t.key] = False
+            # the beans and rows of this poll only, a failed group keeps the ones of its last good poll.
+            fresh_beans, fresh_rows = [], []
+            for group in groups[t.key]:
+                beans = self._merge_beans([results.get(url) for url in group.urls])
+                rows = self._merge_rows([results.get(url) for url in group.urls])
+                if beans or rows:
+                    group.beans, group.rows, group.timestamp = beans, rows, now
+                    fresh_beans.extend(beans)
+                    fresh_rows.extend(rows)
+                    ok[t.key] = True
+            polled = [results.get(url) for group in groups[t.key] for url in group.urls]
+            if not ok[t.key] and t.query_urls and len(groups[t.key]) == len(t.groups) and all(map(self._answered, polled)):
+                fallback.append(t)
+            else:
+                records[t.key] = (polled, fresh_beans, fresh_rows)
+        if fallback:
+            keeps = dict((t.url, t.matcher) for t in fallback if t.matcher is not None)
+            classifiers = dict((t.url, t.classifier) for t in fallback if t.classifier is not None)
+            logger.error("No beans matched the queries of %s, fetch the full jmx.", [t.url for t in fallback])
+            results = self._fetcher.fetch_all([t.url for t in fallback], keeps=keeps, classifiers=classifiers)
+            for t in fallback:
+                beans = self._merge_beans([results.get(t.url)])
+                rows = self._merge_rows([results.get(t.url)])
+                if beans or rows:
+                    # the full jmx holds the beans of every group, it stands in for all of them.
+                    for group in t.groups:
+                        group.beans, group.rows, group.timestamp = [], [], now
+                    t.groups[0].beans, t.groups[0].rows = beans, rows
+                    ok[t.key] = True
+                records[t.key] = ([results.get(t.url)], beans, rows)
+
+        for t in targets:
+            with self._lock:
+                # a target removed while its poll was in flight, e.g. a decommissioned DataNode, stays removed.
+                if self._targets.get(t.key) is not t:
+                    continue
+                if t.key in records:
+                    self._record(t.key, *records[t.key])
+                if not ok[t.key]:
+                    if t.router is not None:
+                        # the active daemon may have failed over, probe the HA states again on the next poll.
+                        t.router.expire()
+                    previous = self.store.latest(t.key)
+                    if previous.beans or previous.rows:
+                        # stale while revalidate: publish the last good snapshot again, so the exposition is rendered
+                        # again with its age, until it is too old and latest returns it no more.
+                        self.store.publish(t.key, previous)
+                        continue
+                    snapshot = Snapshot(t.url, (), now, memo=t.memo)
+                else:
+                    beans, rows, timestamps, polled = t.merge(now)
+                    snapshot = Snapshot(t.url, beans, now, rows or None, timestamps, polled, t.memo)
+                self.store.publish(t.key, snapshot)
+            for callback in self._listeners.get(t.key, ()):
+                try:
+                    callback(snapshot)
+                except Exception as e:
+                    logger.error("Listener of {0} failed, error msg is: {1}".format(t.key, e))
+
+    def _route(self, targets):
+        '''
+        Probe the HA states of the targets whose router cache expired, all in one fan-out, and follow the active urls.
+        '''
+        routed = [t for t in targets if t.router is not None and t.router.expired()]
+        if not routed:
+            return
+        started = time.time()
+        results = self._fetcher.fetch_all([url for t in routed for url in t.router.probe_urls])
+        for t in routed:
+            url = t.router.update(results, started)
+            if url != t.url:
+                t.set_url(url)
+
+    @staticmethod
+    def _record(key, results, beans, rows=None):
+        '''
+        Record the fetch and decode cost of one poll of a target, summed over its urls, into selfmetrics.stats.
+        The responses classified in a worker process also record the worker classify and the ipc cost.
+        '''
+        fetch, decode, response_bytes = 0.0, 0.0, 0
+        worker, wait, ipc, ipc_bytes = 0.0, 0.0, 0.0, 0
+        state = None
+        pooled = False
+        for result in results:
+            if result is None:
+                continue
+            stats = result.stats
+            fetch += stats.get('fetch', result.elapsed)
+            decode += stats.get('decode', 0.0)
+            response_bytes += stats.get('bytes', 0)
+            if 'breaker' in stats:
+                # the most open breaker of the urls of the target, they usually share one host.
+                state = max(state, stats['breaker']) if state is not None else stats['breaker']
+            if 'ipc' in stats:
+                pooled = True
+                worker += stats['classify']
+                wait += stats['wait']
+                ipc += stats['ipc']
+                ipc_bytes += stats['ipc_bytes']
+            if stats.get('error'):
+                selfmetrics.stats.error(key, stats['error'])
+        selfmetrics.stats.observe(key, 'fetch', fetch)
+        selfmetrics.stats.observe(key, 'decode', decode)
+        if state is not None:
+            selfmetrics.stats.set('breaker_state', key, state)
+        if pooled:
+            selfmetrics.stats.observe(key, 'worker', worker)
+            selfmetrics.stats.observe(key, 'worker_wait', wait)
+            selfmetrics.stats.observe(key, 'ipc', ipc)
+            selfmetrics.stats.set('ipc_bytes', key, ipc_bytes)
+        count = len(beans) + sum(len(r.bean_names) for r in rows or ())
+        if count:
+            selfmetrics.stats.success(key, count, response_bytes)
+
+    @staticmethod
+    def _answered(result):
+        '''
+        @return True if the daemon answered the query, even with no bean.
+        '''
+        return result is not None and result.stats.get('error') in (None, 'no_beans')
+
+    @staticmethod
+    def _merge_beans(results):
+        '''
+        Merge the beans of several FetchResults, a bean matched by more than one query is kept once.
+        '''
+        beans = []
+        names = set()
+        for result in results:
+            if result is None or not result.ok:
+                continue
+            for bean in result.metrics['beans']:
+                if bean.get('name') not in names:
+                    names.add(bean.get('name'))
+                    beans.append(bean)
+        return beans
+
+    @staticmethod
+    def _merge_rows(results):
+        '''
+        @return a list of the workers.ClassifiedRows of the FetchResults, the collectors skip duplicated beans.
+        '''
+        return [result.metrics['rows'] for result in results
+                if result is not None and result.ok and 'rows' in result.metrics]
+
+    def start(self, name="scheduler"):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._fetcher.shutdown()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.clear()
+            now = time.time()
+            with self._lock:
+                due = [t for t in self._targets.values() if t.next_poll <= now]
+            for t in due:
+                t.next_poll = now + t.interval
+            if due:
+                try:
+                    self.poll([t.key for t in due])
+                except Exception as e:
+                    logger.error("Poll {0} failed, error msg is: {1}".format([t.key for t in due], e))
+            with self._lock:
+                next_polls = [t.next_poll for t in self._targets.values()]
+            wait = min(next_polls) - time.time() if next_polls else 1
+            self._wakeup.wait(max(wait, 0.01))
@@ -0,0 +1,165 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import bisect
+import threading
+import time
+
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily, HistogramMetricFamily
+
+# upper bounds in seconds of the stage duration histograms.
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Histogram(object):
+
+    __slots__ = ('counts', 'total')
+
+    def __init__(self):
+        self.counts = [0] * (len(DURATION_BUCKETS) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(DURATION_BUCKETS, value)] += 1
+        self.total += value
+
+    def buckets(self):
+        rlt = []
+        cumulative = 0
+        for bound, count in zip([str(b) for b in DURATION_BUCKETS] + ['+Inf'], self.counts):
+            cumulative += count
+            rlt.append((bound, cumulative))
+        return rlt
+
+
+class ExporterStats(object):
+    '''
+    The cost of the exporter itself, per target and per stage.
+    Stages are "fetch" (http round trip and body transfer), "decode" (json parsing), "classify" (turning beans into
+    series in a collector), "derive" (rates from the NumOps / AvgTime pairs of a poll) and "render" (text exposition).
+    With the process pool, "worker" is the classify done in a worker process, "worker_wait" the wait for a free
+    worker and "ipc" the cost of getting the body there and the rows back. "request" of the "http" target is the latency of
+    a request to the exporter, from the request read in full to the response written. Recording is a dict update under a lock, cheap enough to
+    stay on in production.
+    The durations of the targets of a fleet, e.g. the DataNodes, may be aggregated into one target, see aggregate.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = {}
+        # target name prefix -> target the durations of the matching targets are recorded as.
+        self._aggregates = {}
+        self._gauges = {'response_bytes': {}, 'beans': {}, 'series': {}, 'last_success': {}, 'ipc_bytes': {}, 'in_flight': {}, 'queue_depth': {}, 'breaker_state': {}}
+        self._errors = {}
+        # (target, family group) -> (kept, folded, dropped) of the last scrape.
+        self._cardinality = {}
+
+    def aggregate(self, prefix, target):
+        '''
+        Record the stage durations of every target whose name starts with prefix as the ones of target, e.g. all the
+        DataNodes of a cluster as "cluster1/datanode", one histogram per stage instead of one per node and stage.
+        '''
+        with self._lock:
+            self._aggregates[prefix] = target
+
+    def observe(self, target, stage, seconds):
+        with self._lock:
+            for prefix, aggregate in self._aggregates.items():
+                if target.startswith(prefix):
+                    target = aggregate
+                    break
+            histogram = self._durations.get((target, stage))
+            if histogram is None:
+                histogram = self._durations[(target, stage)] = _Histogram()
+            histogram.observe(seconds)
+
+    def set(self, name, target, value):
+        '''
+        @param name: One of "response_bytes", "beans", "series", "last_success", "ipc_bytes", "in_flight", "queue_depth",
+                     "breaker_state".
+        '''
+        with self._lock:
+            self._gauges[name][target] = value
+
+    def success(self, target, beans, response_bytes):
+        with self._lock:
+            self._gauges['beans'][target] = beans
+            self._gauges['response_bytes'][target] = response_bytes
+            self._gauges['last_success'][target] = time.time()
+
+    def error(self, target, error_type):
+        with self._lock:
+            self._errors[(target, error_type)] = self._errors.get((target, error_type), 0) + 1
+
+    def cardinality(self, target, group, kept, folded, dropped):
+        '''
+        @param group: Family group limited by a cardinality.CardinalityLimiter, e.g. "hadoop_namenode_rpc_detailed_method".
+        @param kept: Number of label values which kept their own series.
+        @param folded: Number of series folded into "other".
+        @param dropped: Number of series dropped because their values can not be added up.
+        '''
+        with self._lock:
+            self._cardinality[(target, group)] = (kept, folded, dropped)
+
+    def forget(self, target):
+        '''
+        Drop everything recorded for a target which is not polled any more, e.g. a decommissioned DataNode.
+        '''
+        with self._lock:
+            for key in [k for k in self._durations if k[0] == target]:
+                del self._durations[key]
+            for values in self._gauges.values():
+                values.pop(target, None)
+            for key in [k for k in self._errors if k[0] == target]:
+                del self._errors[key]
+            for key in [k for k in self._cardinality if k[0] == target]:
+                del self._cardinality[key]
+
+    def collect(self, prefix):
+        '''
+        @param prefix: Metric name prefix, e.g. "hadoop_exporter_".
+        @return a list of metric families.
+        '''
+        with self._lock:
+            durations = HistogramMetricFamily(prefix + 'stage_duration_seconds', 'Seconds each stage of a target took.',
+                                              labels=["target", "stage"])
+            for (target, stage), histogram in sorted(self._durations.items()):
+                durations.add_metric([target, stage], histogram.buckets(), histogram.total)
+            families = [durations]
+            now = time.time()
+            age = GaugeMetricFamily(prefix + 'snapshot_age_seconds', 'Seconds since the last successful poll of the target, the age of the beans served.',
+                                    labels=["target"])
+            for target, timestamp in sorted(self._gauges['last_success'].items()):
+                age.add_metric([target], max(0.0, now - timestamp))
+            families.append(age)
+            for name, family_type, metric, descriptions in [
+                ('response_bytes', GaugeMetricFamily, 'response_bytes', 'Decoded bytes of the last successful response of the target.'),
+                ('beans', GaugeMetricFamily, 'beans', 'Number of beans in the last successful poll of the target.'),
+                ('series', GaugeMetricFamily, 'series', 'Number of series emitted for the target by the last scrape.'),
+                ('last_success', GaugeMetricFamily, 'last_success_timestamp_seconds', 'Unix time of the last successful poll of the target.'),
+                ('ipc_bytes', GaugeMetricFamily, 'ipc_bytes', 'Bytes passed to and from the worker processes by the last poll of the target.'),
+                ('breaker_state', GaugeMetricFamily, 'breaker_state', 'Circuit breaker of the target after its last poll, 0 closed, 1 half open, 2 open.'),
+                ('in_flight', GaugeMetricFamily, 'in_flight_requests', 'Number of requests being served by the http server.'),
+                ('queue_depth', GaugeMetricFamily, 'queue_depth', 'Number of requests waiting for a free slot of the http server.'),
+            ]:
+                family = family_type(prefix + metric, descriptions, labels=["target"])
+                for target, value in sorted(self._gauges[name].items()):
+                    family.add_metric([target], value)
+                families.append(family)
+            errors = CounterMetricFamily(prefix + 'errors_total', 'Total number of failed polls of the target by error type.',
+                                         labels=["target", "type"])
+            for (target, error_type), count in sorted(self._errors.items()):
+                errors.add_metric([target, error_type], count)
+            families.append(errors)
+            for i, metric, descriptions in [
+                (0, 'cardinality_kept_label_values', 'Number of label values of the family group which kept their own series.'),
+                (1, 'cardinality_folded_series', 'Number of series of the family group folded into "other" by the last scrape.'),
+                (2, 'cardinality_dropped_series', 'Number of series of the family group dropped by the last scrape.'),
+            ]:
+                family = GaugeMetricFamily(prefix + metric, descriptions, labels=["target", "family"])
+                for (target, group), values in sorted(self._cardinality.items()):
+                    family.add_metric([target, group], values[i])
+                families.append(family)
+        return families
+
+
+stats = ExporterStats()
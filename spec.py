@@ -0,0 +1,660 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import re
+import threading
+from collections import OrderedDict
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, GaugeHistogramMetricFamily
+from prometheus_client.samples import Sample
+
+import utils
+
+
+def snake_case(metric):
+    return re.sub('([a-z0-9])([A-Z])', r'\1_\2', metric).lower()
+
+
+def attr_value(bean, metric):
+    '''
+    Default value transform, a missing or null attribute is exported as 0.
+    '''
+    value = bean.get(metric)
+    return value if value else 0
+
+
+def ha_state_value(bean, metric):
+    return {'initializing': 0.0, 'active': 1.0, 'standby': 2.0, 'stopping': 3.0}.get(bean.get('tag.HAState'), 9999)
+
+
+def fs_state_value(bean, metric):
+    return {'Safemode': 0.0, 'Operational': 1.0}.get(bean.get('FSState'), 9999)
+
+
+def sync_times_value(bean, metric):
+    value = bean.get(metric)
+    return float(re.sub(r'\s', '', value)) if value else 0
+
+
+def bool_value(bean, metric):
+    return 1.0 if str(bean.get(metric)).lower() == 'true' else 0.0
+
+
+class RangeHistogramMetricFamily(GaugeHistogramMetricFamily):
+    '''
+    A histogram of the last metrics period without a sum, e.g. of the HBase range counts, which are reset every period.
+    Its buckets go down as well as up, so it is a gauge histogram: quantiles come from the buckets as they are, not
+    from their rate.
+    '''
+    def add_metric(self, labels, buckets, timestamp=None):
+        '''
+        @param buckets: A list of (le, cumulative count), the last one is "+Inf" and gives the count.
+        '''
+        for le, value in buckets:
+            self.samples.append(Sample(self.name + '_bucket', dict(list(zip(self._labelnames, labels)) + [('le', le)]),
+                                       value, timestamp))
+        self.samples.append(Sample(self.name + '_gcount', dict(zip(self._labelnames, labels)), buckets[-1][1], timestamp))
+
+
+class MetricSpec(object):
+    '''
+    Precomputed export rule of one bean attribute: the family it goes to, its own label values and the value transform.
+    '''
+    __slots__ = ('family', 'label_values', 'transform')
+
+    def __init__(self, family, label_values, transform):
+        self.family = family
+        self.label_values = list(label_values)
+        self.transform = transform
+
+
+class BeanKind(object):
+    '''
+    Compiled rules of one kind of bean, e.g. JvmMetrics, RpcActivity.
+    '''
+    def __init__(self, name, bean_labels=(), resolver=None, expand=None):
+        '''
+        @param name: Bean kind, same as the spec file name.
+        @param bean_labels: Tuple of (label name, bean attribute), label values read from the bean itself, e.g. ("tag", "tag.port").
+        @param resolver: For beans whose attributes are not known in advance (RpcDetailedActivity), a function of the
+                         attribute returning a MetricSpec or None. Its answers are memoized.
+        @param expand: For values built from many attributes of a bean, e.g. the tables rolled up from the HBase
+                       Regions, a function of the bean returning a list of (family name, label values, value).
+        '''
+        self.name = name
+        self.bean_labels = tuple(bean_labels)
+        self.table = OrderedDict()
+        self.expand = expand
+        self._resolver = resolver
+        self._resolved = {}
+
+    @property
+    def dynamic(self):
+        return self._resolver is not None
+
+    def resolve(self, metric):
+        try:
+            return self._resolved[metric]
+        except KeyError:
+            rule = self._resolver(metric)
+            self._resolved[metric] = rule
+            return rule
+
+
+class CompiledSpec(object):
+    '''
+    The metric spec files of one collector service compiled into a classification table.
+    It maps each (bean kind, attribute) pair to a family name, help, label names, label values and value transform,
+    so a scrape only does one dict lookup per attribute.
+    '''
+    def __init__(self, service, spec_dirs, labels=("cluster",)):
+        '''
+        @param service: Service name, e.g. "namenode", "resourcemanager".
+        @param spec_dirs: Spec directories of the collector, e.g. ["namenode", "common"].
+        @param labels: Leading label names of every family, e.g. ("cluster", "host") for a fleet of daemons.
+        '''
+        self.service = service
+        self.labels = list(labels)
+        self.prefix = 'hadoop_{0}_'.format(service)
+        self.families = OrderedDict()
+        self.kinds = OrderedDict()
+        for spec_dir in spec_dirs:
+            for spec_name in utils.get_file_list(spec_dir):
+                compiler = _COMPILERS.get(spec_name)
+                if compiler is None:
+                    continue
+                kind = compiler(self, utils.read_json_file(spec_dir, spec_name))
+                self.kinds[kind.name] = kind
+
+    def _family(self, kind, name, descriptions, labels, family_type=GaugeMetricFamily, leading=None):
+        '''
+        Register a family, label names start with the leading labels and the bean labels of the kind.
+        @param family_type: Class of the family, its add_metric takes the label values and the value.
+        @param leading: Leading label names of the family, e.g. ["cluster"] for a value summed over the daemons of a
+                        cluster, the leading labels of the spec by default.
+        '''
+        name = self.prefix + name
+        leading = self.labels if leading is None else list(leading)
+        if name not in self.families:
+            self.families[name] = (descriptions, leading + [l for l, _ in kind.bean_labels] + list(labels), family_type)
+        return name
+
+    def _rule(self, kind, metric, name, descriptions, labels=(), label_values=(), transform=attr_value):
+        kind.table[metric] = MetricSpec(self._family(kind, name, descriptions, labels), label_values, transform)
+
+    def new_families(self):
+        '''
+        @return a fresh OrderedDict of family name -> GaugeMetricFamily (or the type of the family), one set per scrape.
+        '''
+        families = OrderedDict()
+        for name, (descriptions, labels, family_type) in self.families.items():
+            families[name] = family_type(name, descriptions, labels=labels)
+        return families
+
+    def select(self, index, service=None, kinds=None):
+        '''
+        @param index: The projection.BeanIndex of a snapshot.
+        @param service: ObjectName service of the beans, e.g. "NameNode". Any service by default.
+        @param kinds: Names of the kinds to select, all kinds by default.
+        @return a generator of (kind, bean) of all beans described by the spec files.
+        '''
+        for kind in self.kinds.values():
+            if kinds is not None and kind.name not in kinds:
+                continue
+            for name in _BEAN_NAMES.get(kind.name, (kind.name,)):
+                for bean in index.find(name, service=service, **_SELECTORS.get(kind.name, {})):
+                    yield kind, bean
+
+    def add_bean(self, families, bean, labels, kind):
+        '''
+        Add all values of a bean into the families returned by new_families.
+        @param labels: Leading label values, e.g. [cluster], in the order of the leading label names.
+        @param kind: The compiled kind of the bean, see select.
+        '''
+        if kind.name in _SPECIAL_KINDS:
+            return
+        prefix = list(labels) + [bean.get(attr, '') for _, attr in kind.bean_labels]
+        if kind.dynamic:
+            for metric in bean:
+                rule = kind.resolve(metric)
+                if rule is not None:
+                    families[rule.family].add_metric(prefix + rule.label_values, rule.transform(bean, metric))
+        else:
+            for metric, rule in kind.table.items():
+                families[rule.family].add_metric(prefix + rule.label_values, rule.transform(bean, metric))
+        if kind.expand is not None:
+            for family, label_values, value in kind.expand(bean):
+                families[family].add_metric(prefix + list(label_values), value)
+
+    def bean_rows(self, bean, kind):
+        '''
+        Classify a bean without building any family, e.g. in a worker process, see add_rows.
+        @return a generator of (family name, label values without the leading labels, value) of the bean.
+        '''
+        if kind.name in _SPECIAL_KINDS:
+            return
+        prefix = [bean.get(attr, '') for _, attr in kind.bean_labels]
+        if kind.dynamic:
+            for metric in bean:
+                rule = kind.resolve(metric)
+                if rule is not None:
+                    yield rule.family, prefix + rule.label_values, rule.transform(bean, metric)
+        else:
+            for metric, rule in kind.table.items():
+                yield rule.family, prefix + rule.label_values, rule.transform(bean, metric)
+        if kind.expand is not None:
+            for family, label_values, value in kind.expand(bean):
+                yield family, prefix + list(label_values), value
+
+    def add_rows(self, families, rows, labels):
+        '''
+        Add rows classified by bean_rows into the families returned by new_families.
+        @param rows: An iterable of (family name, label values without the leading labels, value).
+        @param labels: Leading label values, e.g. [cluster].
+        '''
+        labels = list(labels)
+        for family, label_values, value in rows:
+            families[family].add_metric(labels + list(label_values), value)
+
+
+def _compile_name_node_activity(c, spec):
+    kind = BeanKind('NameNodeActivity')
+    for metric in spec:
+        if "NumOps" in metric:
+            c._rule(kind, metric, "nnactivity_method_ops_total", "Total number of the times the method is called.",
+                    ["method"], [metric.split('NumOps')[0]])
+        elif "AvgTime" in metric:
+            c._rule(kind, metric, "nnactivity_method_avg_time_milliseconds", "Average turn around time of the method in milliseconds.",
+                    ["method"], [metric.split('AvgTime')[0]])
+        else:
+            c._rule(kind, metric, "nnactivity_operations_total", "Total number of each operation.",
+                    ["method"], [metric.split('Ops')[0] if "Ops" in metric else metric])
+    return kind
+
+
+def _compile_startup_progress(c, spec):
+    kind = BeanKind('StartupProgress')
+    for metric in spec:
+        if "ElapsedTime" == metric:
+            c._rule(kind, metric, "startup_process_total_elapsed_time_milliseconds", "Total elapsed time in milliseconds.")
+        elif "PercentComplete" == metric:
+            c._rule(kind, metric, "startup_process_complete_rate",
+                    "Current rate completed in NameNode startup progress  (The max value is not 100 but 1.0).")
+        elif "Count" in metric:
+            c._rule(kind, metric, "startup_process_phase_count", "Total number of steps completed in the phase.",
+                    ["phase"], [metric.split("Count")[0]])
+        elif "ElapsedTime" in metric:
+            c._rule(kind, metric, "startup_process_phase_elapsed_time_milliseconds", "Total elapsed time in the phase in milliseconds.",
+                    ["phase"], [metric.split("ElapsedTime")[0]])
+        elif "Total" in metric:
+            c._rule(kind, metric, "startup_process_phase_total", "Total number of steps in the phase.",
+                    ["phase"], [metric.split("Total")[0]])
+        elif "PercentComplete" in metric:
+            c._rule(kind, metric, "startup_process_phase_complete_rate",
+                    "Current rate completed in the phase  (The max value is not 100 but 1.0).",
+                    ["phase"], [metric.split("PercentComplete")[0]])
+        else:
+            c._rule(kind, metric, "startup_process_" + snake_case(metric), spec[metric])
+    return kind
+
+
+def _compile_fs_namesystem(c, spec):
+    kind = BeanKind('FSNamesystem')
+    for metric in spec:
+        if metric.startswith('Capacity'):
+            c._rule(kind, metric, "fsname_system_capacity_bytes", "Current DataNodes capacity in each mode in bytes",
+                    ["mode"], [metric.split("Capacity")[1]])
+        elif 'HAState' in metric:
+            c._rule(kind, metric, "fsname_system_" + snake_case(metric), spec[metric], transform=ha_state_value)
+        else:
+            c._rule(kind, metric, "fsname_system_" + snake_case(metric), spec[metric])
+    return kind
+
+
+def _compile_fs_namesystem_state(c, spec):
+    kind = BeanKind('FSNamesystemState')
+    for metric in spec:
+        if 'DataNodes' in metric:
+            c._rule(kind, metric, "fsname_system_datanodes_count", "Number of datanodes in each state",
+                    ["state"], [metric.split("DataNodes")[0].split("Num")[1]])
+        elif 'FSState' in metric:
+            c._rule(kind, metric, "fsname_system_" + snake_case(metric), spec[metric], transform=fs_state_value)
+        elif 'TotalSyncTimes' in metric:
+            c._rule(kind, metric, "fsname_system_" + snake_case(metric), spec[metric], transform=sync_times_value)
+        else:
+            c._rule(kind, metric, "fsname_system_" + snake_case(metric), spec[metric])
+    return kind
+
+
+def _compile_retry_cache(c, spec):
+    kind = BeanKind('RetryCache')
+    for metric in spec:
+        c._rule(kind, metric, "cache_total", "Total number of RetryCache in each mode", ["mode"], [metric.split('Cache')[1]])
+    return kind
+
+
+def _compile_jvm_metrics(c, spec):
+    kind = BeanKind('JvmMetrics')
+    for metric in spec:
+        name = "jvm_" + snake_case(metric)
+        if 'Mem' in metric:
+            if "NonHeap" in metric:
+                mode = "nonheap"
+            elif "MemHeap" in metric:
+                mode = "heap"
+            else:
+                mode = "max"
+            if "Used" in metric:
+                c._rule(kind, metric, "jvm_mem_used_mebibytes", "Current memory used in mebibytes.", ["mode"], [mode])
+            elif "Committed" in metric:
+                c._rule(kind, metric, "jvm_mem_committed_mebibytes", "Current memory used in mebibytes.", ["mode"], [mode])
+            elif "Max" in metric:
+                c._rule(kind, metric, "jvm_mem_max_size_mebibytes", "Current memory used in mebibytes.", ["mode"], [mode])
+            else:
+                c._rule(kind, metric, name + 'ebibytes', spec[metric], ["mode"], [mode])
+        elif 'Gc' in metric:
+            if metric.startswith("GcCount"):
+                c._rule(kind, metric, "jvm_gc_count", "GC count of each type GC.", ["type"], [metric[len("GcCount"):]])
+            elif metric.startswith("GcTimeMillis"):
+                c._rule(kind, metric, "jvm_gc_time_milliseconds", "Each type GC time in msec.", ["type"], [metric[len("GcTimeMillis"):]])
+            elif "ThresholdExceeded" in metric:
+                c._rule(kind, metric, "jvm_gc_exceeded_threshold_total", "Number of times that the GC threshold is exceeded.",
+                        ["type"], [metric.split("GcNum")[-1].split("ThresholdExceeded")[0]])
+            else:
+                c._rule(kind, metric, name, spec[metric])
+        elif 'Threads' in metric:
+            c._rule(kind, metric, "jvm_threads_state_total", "Current number of different threads.", ["state"], [metric.split("Threads")[1]])
+        elif 'Log' in metric:
+            c._rule(kind, metric, "jvm_log_level_total", "Total number of each level logs.", ["level"], [metric.split("Log")[1]])
+        else:
+            c._rule(kind, metric, name, spec[metric])
+    return kind
+
+
+def _compile_rpc_activity(c, spec):
+    # one url may have several RpcActivity beans, they are told apart by tag.port.
+    kind = BeanKind('RpcActivity', bean_labels=[("tag", "tag.port")])
+    for metric in spec:
+        if "NumOps" in metric:
+            c._rule(kind, metric, "rpc_method_called_total", "Total number of the times the method is called.",
+                    ["method"], [metric.split('NumOps')[0]])
+        elif "AvgTime" in metric:
+            c._rule(kind, metric, "rpc_method_avg_time_milliseconds", "Average turn around time of the method in milliseconds.",
+                    ["method"], [metric.split('AvgTime')[0]])
+        else:
+            c._rule(kind, metric, "rpc_" + snake_case(metric), spec[metric])
+    return kind
+
+
+def _compile_rpc_detailed_activity(c, spec):
+    # attributes are the rpc method names, only known when the bean is read.
+    def resolve(metric):
+        if not metric[0].isupper():
+            return None
+        if "NumOps" in metric:
+            return MetricSpec(num_ops, [metric.split('NumOps')[0]], attr_value)
+        if "AvgTime" in metric:
+            return MetricSpec(avg_time, [metric.split('AvgTime')[0]], attr_value)
+        return None
+
+    kind = BeanKind('RpcDetailedActivity', bean_labels=[("tag", "tag.port")], resolver=resolve)
+    num_ops = c._family(kind, 'rpc_detailed_method_called_total', spec.get('methodNumOps', ''), ["method"])
+    avg_time = c._family(kind, 'rpc_detailed_method_avg_time_milliseconds', spec.get('methodAvgTime', ''), ["method"])
+    return kind
+
+
+def _compile_ugi_metrics(c, spec):
+    kind = BeanKind('UgiMetrics')
+    for metric in spec:
+        for suffix, name, descriptions in (("NumOps", "ugi_method_called_total", "Total number of the times the method is called."),
+                                           ("AvgTime", "ugi_method_avg_time_milliseconds", "Average turn around time of the method in milliseconds.")):
+            if suffix in metric:
+                method = metric.split(suffix)[0]
+                # LoginSuccess / LoginFailure are exported as method "Login" with a state.
+                state = ''
+                if method.startswith('Login'):
+                    method, state = 'Login', method[len('Login'):]
+                c._rule(kind, metric, name, descriptions, ["method", "state"], [method, state])
+                break
+        else:
+            c._rule(kind, metric, 'ugi_' + snake_case(metric), spec[metric])
+    return kind
+
+
+def _compile_metrics_system(c, spec):
+    kind = BeanKind('MetricsSystem')
+    for metric in spec:
+        if 'NumOps' in metric:
+            c._rule(kind, metric, 'metrics_operations_total', "Total number of operations", ["oper"], [metric.split('NumOps')[0]])
+        elif 'AvgTime' in metric:
+            c._rule(kind, metric, 'metrics_method_avg_time_milliseconds', "Average turn around time of the operations in milliseconds.",
+                    ["oper"], [metric.split('AvgTime')[0]])
+        else:
+            c._rule(kind, metric, 'metrics_' + snake_case(metric), spec[metric])
+    return kind
+
+
+def _compile_rmnm_info(c, spec):
+    # values come from the LiveNodeManagers list, one series per node, the collector expands it.
+    kind = BeanKind('RMNMInfo')
+    names = {'NumContainers': 'node_containers_total', 'State': 'node_state',
+             'UsedMemoryMB': 'node_memory_used', 'AvailableMemoryMB': 'node_memory_available'}
+    for metric in spec:
+        if metric in names:
+            c._rule(kind, metric, names[metric], spec[metric], ["host", "version", "rack"])
+    return kind
+
+
+def _compile_queue_metrics(c, spec):
+    kind = BeanKind('QueueMetrics')
+    elapsed = {'running_0': '0to60', 'running_60': '60to300', 'running_300': '300to1440', 'running_1440': '1440up'}
+    for metric in spec:
+        if metric in elapsed:
+            c._rule(kind, metric, "running_app_total",
+                    "Current number of running applications in each elapsed time ( < 60min, 60min < x < 300min, 300min < x < 1440min and x > 1440min )",
+                    ["elapsed_time"], [elapsed[metric]])
+        else:
+            c._rule(kind, metric, snake_case(metric), spec[metric])
+    return kind
+
+
+def _compile_cluster_metrics(c, spec):
+    kind = BeanKind('ClusterMetrics')
+    for metric in spec:
+        if "NMs" in metric:
+            c._rule(kind, metric, "nodemanager_total", "Current number of NodeManagers in each status",
+                    ["status"], [metric.split('NMs')[0].split('Num')[1]])
+        elif "NumOps" in metric:
+            c._rule(kind, metric, "ams_total", "Total number of Applications Masters in each operation",
+                    ["oper"], [metric.split("DelayNumOps")[0].split('AM')[1]])
+        elif "AvgTime" in metric:
+            c._rule(kind, metric, "average_time_milliseconds", "Average time in milliseconds AM spends in each operation",
+                    ["oper"], [metric.split("DelayAvgTime")[0].split('AM')[1]])
+    return kind
+
+
+# "Get_99.9th_percentile" -> ("Get", "99.9th_percentile"), the statistics of a HBase histogram over the last period.
+_HBASE_STAT_RE = re.compile(r'^(\w+?)_(num_ops|min|max|mean|median|[\d.]+th_percentile)$')
+
+
+# "TotalCallTime_TimeRangeCount_1-3" -> ("TotalCallTime", "Time", "1", "3"), the ops which took 1 to 3 ms.
+_HBASE_RANGE_RE = re.compile(r'^(\w+?)_(Time|Size)RangeCount_([\d.]+)-([\d.]+|inf)$')
+
+# upper bounds of the ranges of the HBase MutableTimeHistogram (milliseconds) and MutableSizeHistogram (bytes).
+_HBASE_BUCKETS = {
+    'Time': (1, 3, 10, 30, 100, 300, 1000, 3000, 10000, 30000, 60000, 120000, 300000, 600000),
+    'Size': (10, 100, 1000, 10000, 100000, 1000000, 10000000, 100000000),
+}
+
+
+def _hbase_quantile(stat):
+    # "median" -> "0.5", "99.9th_percentile" -> "0.999".
+    if stat == 'median':
+        return '0.5'
+    return '{0:g}'.format(float(stat.split('th_')[0]) / 100)
+
+
+def _compile_hbase(name, prefix):
+    '''
+    @return the compiler of a HBase bean kind, e.g. IPC. A histogram with range counts in the spec file is exported as
+            a histogram of the last period, see _hbase_histograms, its percentiles are not. The other statistics are
+            exported as one family each: the percentiles with a quantile label, min / max / mean, and the running
+            number of ops.
+    '''
+    def compile_kind(c, spec):
+        ranged = {}
+        for metric in spec:
+            m = _HBASE_RANGE_RE.match(metric)
+            if m:
+                ranged[m.group(1)] = m.group(2)
+        histograms = OrderedDict()
+        kind = BeanKind(name, expand=lambda bean: _hbase_histograms(bean, histograms))
+        for metric in spec:
+            m = _HBASE_STAT_RE.match(metric)
+            if "RangeCount_" in metric:
+                continue
+            elif m:
+                base, stat = m.groups()
+                family = prefix + snake_case(base) + ('_bytes' if base.endswith('Size') else '_milliseconds')
+                if base in ranged and base not in histograms:
+                    histograms[base] = (c._family(kind, family, "Histogram of {0} over the last period.".format(base),
+                                                  [], RangeHistogramMetricFamily), _HBASE_BUCKETS[ranged[base]])
+                if base in ranged and stat not in ('min', 'max', 'mean', 'num_ops'):
+                    # the quantiles come from the histogram, aggregatable across daemons.
+                    continue
+                elif stat == 'num_ops':
+                    c._rule(kind, metric, prefix + snake_case(base) + '_num_ops', spec[metric] or "Total number of {0}.".format(base))
+                elif stat in ('min', 'max', 'mean'):
+                    c._rule(kind, metric, family + '_' + stat, "The {0} of {1} over the last period.".format(stat, base))
+                else:
+                    c._rule(kind, metric, family, "Quantiles of {0} over the last period.".format(base),
+                            ["quantile"], [_hbase_quantile(stat)])
+            elif metric.startswith('exceptions.'):
+                c._rule(kind, metric, prefix + "exceptions_by_type", "Total number of exceptions of each type.",
+                        ["type"], [metric[len('exceptions.'):]])
+            elif metric.startswith('tag.is'):
+                c._rule(kind, metric, prefix + snake_case(metric[len('tag.'):]), spec[metric], transform=bool_value)
+            else:
+                c._rule(kind, metric, prefix + snake_case(metric), spec[metric])
+        return kind
+    return compile_kind
+
+
+def _hbase_histograms(bean, histograms):
+    '''
+    Build the cumulative buckets of the HBase histograms from their range counts. Only the ranges seen are reported,
+    the buckets are always the bounds of _HBASE_BUCKETS, so the histograms of all daemons can be summed up.
+    The range counts are those of the last metrics period, the count is their sum, not the running number of ops.
+    @param histograms: An OrderedDict of histogram base name, e.g. "TotalCallTime" -> (family name, bucket bounds).
+    @return a list of (family name, [], buckets), see RangeHistogramMetricFamily.add_metric.
+    '''
+    if not histograms:
+        return []
+    ranges = dict((base, []) for base in histograms)
+    for attr in bean:
+        if 'RangeCount_' not in attr:
+            continue
+        m = _HBASE_RANGE_RE.match(attr)
+        if m and m.group(1) in ranges:
+            ranges[m.group(1)].append((float(m.group(4)), bean[attr] or 0))
+    rows = []
+    for base, (family, bounds) in histograms.items():
+        counts = ranges[base]
+        buckets = [(str(le), sum(count for upper, count in counts if upper <= le)) for le in bounds]
+        # the ops above the largest range are only in +Inf.
+        buckets.append(('+Inf', sum(count for _, count in counts)))
+        rows.append((family, [], buckets))
+    return rows
+
+
+class RegionRollup(object):
+    '''
+    Fold the HBase Regions bean, one attribute per region and metric "Namespace_<ns>_table_<table>_region_<id>_metric_<m>",
+    into one attribute per table and metric "Namespace_<ns>_table_<table>_metric_<m>", attribute by attribute. It is
+    the reducer of the bean while it is streamed, see jmx_stream.BeanStreamParser, so no dict entry is ever kept per
+    region. Every region reports its store count, which counts the regions of a table as metric "regions".
+    '''
+    def __init__(self):
+        self._bean = {}
+
+    def add(self, attr, value):
+        bean = self._bean
+        head, sep, metric = attr.rpartition('_metric_')
+        if not sep:
+            bean[attr] = value
+            return
+        table, sep, _ = head.rpartition('_region_')
+        if not sep:
+            # folded already, e.g. a bean decoded by the stream parser is folded again by the collector.
+            table = head
+        elif metric == 'storeCount':
+            key = table + '_metric_regions'
+            bean[key] = bean.get(key, 0) + 1
+        key = table + '_metric_' + metric
+        bean[key] = bean.get(key, 0) + (value or 0)
+
+    def bean(self):
+        return self._bean
+
+
+def _hbase_region_counter(metric):
+    # the request and op counts of a region grow while it is open, the store counts and sizes are current values.
+    return metric.endswith('_num_ops') or (metric.endswith('Count') and not metric.startswith('store'))
+
+
+def _compile_hbase_regions(c, spec):
+    # the tables are summed over the RegionServers of the cluster by the collector, a region moving between servers
+    # moves no table series. The request and op counts are counters, the collector adds up their increases.
+    def expand(bean):
+        rollup = RegionRollup()
+        for attr, value in bean.items():
+            rollup.add(attr, value)
+        namespaces = {}
+        rows = []
+        for attr, value in sorted(rollup.bean().items()):
+            head, sep, metric = attr.rpartition('_metric_')
+            if not sep or metric not in index:
+                continue
+            namespace, _, name = head[len('Namespace_'):].partition('_table_')
+            i = index[metric]
+            rows.append((table_families[i], [namespace, name], value))
+            total = namespaces.setdefault(namespace, [0] * len(metrics))
+            total[i] += value
+        for namespace in sorted(namespaces):
+            for i, value in enumerate(namespaces[namespace]):
+                rows.append((namespace_families[i], [namespace], value))
+        return rows
+
+    kind = BeanKind('Regions', expand=expand)
+    metrics = list(spec) + ['regions']
+    index = dict((metric, i) for i, metric in enumerate(metrics))
+    table_families, namespace_families = [], []
+    leading = c.labels[:1]
+    for metric in metrics:
+        descriptions = spec.get(metric, "Current number of regions.")
+        family_type = CounterMetricFamily if _hbase_region_counter(metric) else GaugeMetricFamily
+        table_families.append(c._family(kind, "table_" + snake_case(metric), descriptions, ["namespace", "table"],
+                                        family_type, leading))
+        namespace_families.append(c._family(kind, "namespace_" + snake_case(metric), descriptions, ["namespace"],
+                                            family_type, leading))
+    return kind
+
+
+_COMPILERS = {
+    'NameNodeActivity': _compile_name_node_activity,
+    'StartupProgress': _compile_startup_progress,
+    'FSNamesystem': _compile_fs_namesystem,
+    'FSNamesystemState': _compile_fs_namesystem_state,
+    'RetryCache': _compile_retry_cache,
+    'JvmMetrics': _compile_jvm_metrics,
+    'RpcActivity': _compile_rpc_activity,
+    'RpcDetailedActivity': _compile_rpc_detailed_activity,
+    'UgiMetrics': _compile_ugi_metrics,
+    'MetricsSystem': _compile_metrics_system,
+    'RMNMInfo': _compile_rmnm_info,
+    'QueueMetrics': _compile_queue_metrics,
+    'ClusterMetrics': _compile_cluster_metrics,
+    'Master': _compile_hbase('Master', 'master_'),
+    'RegionServer': _compile_hbase('RegionServer', 'server_'),
+    'IPC': _compile_hbase('IPC', 'ipc_'),
+    'WAL': _compile_hbase('WAL', 'wal_'),
+    'Regions': _compile_hbase_regions,
+}
+
+# kinds whose values are not plain bean attributes, they are added by the collector itself.
+_SPECIAL_KINDS = ('RMNMInfo',)
+
+# ObjectName properties, besides the base name, of the beans of a kind. None means the property must be absent.
+_SELECTORS = {
+    'MetricsSystem': {'sub': 'Stats'},
+    'QueueMetrics': {'q0': 'root', 'q1': None},
+    'Master': {'sub': 'Server'},
+    'RegionServer': {'sub': 'Server'},
+    'IPC': {'sub': 'IPC'},
+    'WAL': {'sub': 'WAL'},
+    'Regions': {'sub': 'Regions'},
+}
+
+# base names of the beans of a kind, when they differ from the kind, e.g. HBase beans are told apart by their sub.
+_BEAN_NAMES = {
+    'IPC': ('Master', 'RegionServer'),
+    'WAL': ('RegionServer',),
+    'Regions': ('RegionServer',),
+}
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def get_compiled_spec(service, spec_dirs, labels=("cluster",)):
+    '''
+    Compile the spec files of a collector once, later calls return the same CompiledSpec.
+    @param service: Service name, e.g. "namenode".
+    @param spec_dirs: Spec directories, e.g. ["namenode", "common"].
+    @param labels: Leading label names of every family.
+    '''
+    key = (service, tuple(spec_dirs), tuple(labels))
+    with _compiled_lock:
+        if key not in _compiled:
+            _compiled[key] = CompiledSpec(service, spec_dirs, labels)
+        return _compiled[key]
@@ -0,0 +1,14 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import atexit
+import os
+import shutil
+import tempfile
+
+from config import Config
+
+# write the log of the tests to a temporary directory, not into the hadoop_exporter.log of the working directory.
+_log_dir = tempfile.mkdtemp(prefix='hadoop_exporter_tests')
+atexit.register(shutil.rmtree, _log_dir, True)
+Config.LOG_FILE = os.path.join(_log_dir, 'hadoop_exporter.log')
@@ -0,0 +1,44 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from fetcher import FetchResult
+
+
+class FakeFetcher(object):
+    '''
+    Answer fetch_all from a function of the url instead of http, and record the urls of every call.
+    '''
+    def __init__(self, answer):
+        '''
+        @param answer: A function of the url returning the beans list, or None for a host which is down.
+        '''
+        self.answer = answer
+        self.fetched = []
+
+    def fetch_all(self, urls, deadline=None, keeps=None, classifiers=None):
+        self.fetched.append(sorted(urls))
+        results = {}
+        for url in urls:
+            beans = self.answer(url)
+            if beans is None:
+                results[url] = FetchResult(url, error="fetch failed", stats={'error': 'connection'})
+            else:
+                results[url] = FetchResult(url, {'beans': beans}, stats={'error': None if beans else 'no_beans'})
+        return results
+
+    def forget(self, url):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+class FakeClock(object):
+    '''
+    Stand in for the time module of the module under test, e.g. scheduler.time = FakeClock().
+    '''
+    def __init__(self, now=1500000000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
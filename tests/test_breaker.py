@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import breaker
+from breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+
+NOW = 1500000000.0
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.uniform = breaker.random.uniform
+        # no jitter, the breaker stays open for its whole backoff.
+        breaker.random.uniform = lambda low, high: high
+        self.breaker = CircuitBreaker(failures=3, backoff=10, max_backoff=60)
+
+    def tearDown(self):
+        breaker.random.uniform = self.uniform
+
+    def open(self, now=NOW):
+        for _ in range(3):
+            self.breaker.failure(now)
+
+    def test_threshold(self):
+        self.breaker.failure(NOW)
+        self.breaker.failure(NOW)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.allow(NOW))
+        # a success in between starts the count again.
+        self.breaker.success()
+        self.breaker.failure(NOW)
+        self.breaker.failure(NOW)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.failure(NOW)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow(NOW + 9.9))
+        self.assertTrue(self.breaker.allow(NOW + 10))
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+
+    def test_open_does_not_escalate(self):
+        self.open()
+        # the other urls of the host failing while it is open are one outage, the backoff stays the first one.
+        for i in range(20):
+            self.breaker.failure(NOW + i * 0.1)
+        self.assertEqual(self.breaker._opens, 1)
+        self.assertFalse(self.breaker.allow(NOW + 9.9))
+        self.assertTrue(self.breaker.allow(NOW + 10))
+
+    def test_probe(self):
+        self.open()
+        self.assertTrue(self.breaker.allow(NOW + 10))
+        # a failed probe opens the breaker again for twice as long.
+        self.assertFalse(self.breaker.probe(lambda: False))
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertEqual(self.breaker._opens, 2)
+        # the probe only runs on a half-open breaker.
+        self.assertFalse(self.breaker.probe(self.unexpected_probe))
+        now = self.breaker._retry_at
+        self.assertTrue(self.breaker.allow(now))
+        self.assertTrue(self.breaker.probe(lambda: True))
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.probe(self.unexpected_probe))
+
+    def unexpected_probe(self):
+        self.fail("probe of a breaker which is not half open")
+
+    def test_success_resets(self):
+        self.open()
+        self.breaker.allow(NOW + 10)
+        self.breaker.failure(NOW + 10)
+        self.assertEqual(self.breaker._opens, 2)
+        self.breaker.allow(NOW + 30)
+        self.breaker.success()
+        self.assertEqual(self.breaker._opens, 0)
+        # the next outage starts with the first backoff again.
+        self.open(NOW + 40)
+        self.assertFalse(self.breaker.allow(NOW + 49.9))
+        self.assertTrue(self.breaker.allow(NOW + 50))
+
+    def test_max_backoff(self):
+        self.open()
+        now = NOW
+        backoffs = []
+        for _ in range(6):
+            now = self.breaker._retry_at
+            self.assertTrue(self.breaker.allow(now))
+            self.breaker.failure(now)
+            backoffs.append(self.breaker._retry_at - now)
+        self.assertEqual(backoffs, [20, 40, 60, 60, 60, 60])
+
+    def test_jitter(self):
+        breaker.random.uniform = self.uniform
+        self.open()
+        self.assertTrue(NOW + 5 <= self.breaker._retry_at <= NOW + 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+from collections import OrderedDict
+
+from prometheus_client.core import GaugeMetricFamily
+
+import cardinality
+
+BUDGETS = {'rpc_detailed_method_': (('method',), 'called_total', 2, True)}
+
+
+def rpc_families(called, avg_time):
+    '''
+    @param called: A dict of method -> NumOps.
+    @param avg_time: A dict of method -> AvgTime.
+    '''
+    families = OrderedDict()
+    for name, values in (('called_total', called), ('avg_time_milliseconds', avg_time)):
+        family = GaugeMetricFamily('hadoop_namenode_rpc_detailed_method_' + name, '', labels=['cluster', 'method'])
+        for method, value in sorted(values.items()):
+            family.add_metric(['test', method], value)
+        families[family.name] = family
+    return families
+
+
+class CardinalityLimiterTest(unittest.TestCase):
+
+    def _apply(self, limiter, called):
+        families = rpc_families(called, dict((method, 1.0) for method in called))
+        limiter.apply(families)
+        return [dict((s.labels['method'], s.value) for s in family.samples) for family in families.values()]
+
+    def test_fold(self):
+        limiter = cardinality.CardinalityLimiter('hadoop_namenode_', 'test', BUDGETS)
+        called, avg_time = self._apply(limiter, {'a': 10, 'b': 20, 'c': 30, 'd': 40})
+        self.assertEqual(len(called), 3)
+        self.assertEqual(sum(called.values()), 100)
+        self.assertIn('other', called)
+        # an average can not be added up, the ones over budget are dropped.
+        self.assertEqual(len(avg_time), 2)
+        self.assertNotIn('other', avg_time)
+
+    def test_rank_by_increase(self):
+        limiter = cardinality.CardinalityLimiter('hadoop_namenode_', 'test', BUDGETS)
+        # "old" was busy before the exporter started and is idle now, "new1" and "new2" are busy now.
+        called = {'old': 1000000, 'new1': 10, 'new2': 10, 'idle': 10}
+        self._apply(limiter, called)
+        for _ in range(3):
+            called['new1'] += 100
+            called['new2'] += 50
+            kept, _ = self._apply(limiter, called)
+        self.assertEqual(sorted(kept), ['new1', 'new2', 'other'])
+        self.assertEqual(kept['other'], called['old'] + called['idle'])
+
+    def test_same_poll_again(self):
+        limiter = cardinality.CardinalityLimiter('hadoop_namenode_', 'test', BUDGETS)
+        called = {'a': 0, 'b': 0, 'c': 0}
+        self._apply(limiter, called)
+        called['c'] += 1000
+        self._apply(limiter, called)
+        # scraping the same poll again is not a round without activity.
+        for _ in range(50):
+            kept, _ = self._apply(limiter, called)
+        self.assertIn('c', kept)
+
+
+if __name__ == '__main__':
+    unittest.main()
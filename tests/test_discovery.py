@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+
+import discovery
+import scheduler
+from scheduler import EMPTY_SNAPSHOT, Scheduler
+from tests.fakes import FakeClock, FakeFetcher
+
+NN = 'http://nn:50070/jmx'
+
+
+def name_node_info(hosts):
+    '''
+    @return the NameNodeInfo bean of a NameNode whose live DataNodes are hosts, LiveNodes as the json string it is.
+    '''
+    live_nodes = dict(('{0}:50010'.format(host), {'infoAddr': '{0}.dc:50075'.format(host), 'lastContact': 1})
+                      for host in hosts)
+    return {'name': 'Hadoop:service=NameNode,name=NameNodeInfo', 'LiveNodes': json.dumps(live_nodes)}
+
+
+class GetDataNodeUrlsTest(unittest.TestCase):
+
+    def test_live_nodes(self):
+        bean = name_node_info(['dn1', 'dn2'])
+        self.assertEqual(discovery.get_datanode_urls(bean),
+                         {'dn1': 'http://dn1.dc:50075/jmx', 'dn2': 'http://dn2.dc:50075/jmx'})
+        # a node without its http address, e.g. still registering, is skipped, a decoded LiveNodes is read as it is.
+        bean = {'LiveNodes': {'dn1:50010': {'infoAddr': 'dn1.dc:50075'}, 'dn3:50010': {}}}
+        self.assertEqual(discovery.get_datanode_urls(bean), {'dn1': 'http://dn1.dc:50075/jmx'})
+        self.assertEqual(discovery.get_datanode_urls({}), {})
+
+
+class DataNodeDiscoveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.time = scheduler.time
+        scheduler.time = self.clock = FakeClock()
+        self.live = ['dn1', 'dn2']
+        # url -> function called while the url is fetched.
+        self.during = {}
+        self.fetcher = FakeFetcher(self.answer)
+        self.scheduler = Scheduler(fetcher=self.fetcher)
+        self.scheduler.add_target('namenode', NN, 10)
+        self.discovery = discovery.DataNodeDiscovery(self.scheduler, 10, key_prefix='c/datanode/')
+        self.scheduler.add_listener('namenode', self.discovery.on_snapshot)
+
+    def tearDown(self):
+        scheduler.time = self.time
+
+    def answer(self, url):
+        if url in self.during:
+            self.during.pop(url)()
+        if url == NN:
+            return [name_node_info(self.live)]
+        return [{'name': 'Hadoop:service=DataNode,name=DataNodeInfo', 'url': url}]
+
+    def poll_namenode(self):
+        self.clock.now += 10
+        self.scheduler.poll(['namenode'])
+
+    def test_add_remove(self):
+        self.poll_namenode()
+        self.assertEqual(self.discovery.targets(), {'c/datanode/dn1': 'dn1', 'c/datanode/dn2': 'dn2'})
+        self.scheduler.poll(['c/datanode/dn1', 'c/datanode/dn2'])
+        self.assertEqual(self.scheduler.store.latest('c/datanode/dn2').url, 'http://dn2.dc:50075/jmx')
+
+        self.live = ['dn1', 'dn3']
+        self.poll_namenode()
+        self.assertEqual(self.discovery.targets(), {'c/datanode/dn1': 'dn1', 'c/datanode/dn3': 'dn3'})
+        self.assertEqual((self.discovery.added, self.discovery.removed), (3, 1))
+        # the removed node is neither polled nor served any more.
+        self.assertEqual(sorted(self.scheduler._targets), ['c/datanode/dn1', 'c/datanode/dn3', 'namenode'])
+        self.assertIs(self.scheduler.store.latest('c/datanode/dn2'), EMPTY_SNAPSHOT)
+
+        # the same fleet polled again changes nothing.
+        self.poll_namenode()
+        self.assertEqual((self.discovery.added, self.discovery.removed), (3, 1))
+
+    def test_master_without_nodes(self):
+        self.poll_namenode()
+        # a snapshot without NameNodeInfo, e.g. a failed query, keeps the known nodes.
+        self.discovery.on_snapshot(scheduler.Snapshot(NN, [{'name': 'Hadoop:service=NameNode,name=FSNamesystem'}],
+                                                      self.clock.now))
+        self.assertEqual(sorted(self.discovery.targets().values()), ['dn1', 'dn2'])
+
+    def test_removed_while_polled(self):
+        self.poll_namenode()
+        published = []
+        self.scheduler.add_listener('c/datanode/dn1', published.append)
+        # dn1 is decommissioned while its poll is in flight.
+        self.live = ['dn2']
+        self.during['http://dn1.dc:50075/jmx'] = self.poll_namenode
+        self.scheduler.poll(['c/datanode/dn1', 'c/datanode/dn2'])
+        self.assertEqual(self.discovery.targets(), {'c/datanode/dn2': 'dn2'})
+        self.assertIs(self.scheduler.store.latest('c/datanode/dn1'), EMPTY_SNAPSHOT)
+        self.assertEqual(published, [])
+        self.assertEqual(self.scheduler.store.latest('c/datanode/dn2').url, 'http://dn2.dc:50075/jmx')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import gzip
+import io
+import socket
+import threading
+import unittest
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+
+from prometheus_client.core import CollectorRegistry, GaugeMetricFamily
+
+import exposition
+
+
+class BuildResponseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.exposition = exposition.Exposition(1, b'hadoop_namenode_up{cluster="test"} 1.0\n')
+
+    def test_encodings(self):
+        for accept_encoding, gzipped in (('', False), ('gzip', True), ('deflate, gzip;q=0.5', True),
+                                         ('gzip;q=0', False), ('gzip;q=0.0, identity', False), ('*', True),
+                                         ('*;q=0', False), ('gzip;q=0, *', False), ('identity, *;q=0.1', True)):
+            status, headers, body = exposition.build_response(self.exposition, '', accept_encoding)
+            headers = dict(headers)
+            self.assertEqual(status, 200)
+            self.assertEqual('Content-Encoding' in headers, gzipped, accept_encoding)
+            if gzipped:
+                self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(body)).read(), self.exposition.plain)
+            else:
+                self.assertEqual(body, self.exposition.plain)
+
+    def test_etag_per_encoding(self):
+        _, plain, _ = exposition.build_response(self.exposition, '', '')
+        _, gzipped, _ = exposition.build_response(self.exposition, '', 'gzip')
+        plain, gzipped = dict(plain)['ETag'], dict(gzipped)['ETag']
+        self.assertNotEqual(plain, gzipped)
+        self.assertEqual(exposition.build_response(self.exposition, plain, '')[0], 304)
+        self.assertEqual(exposition.build_response(self.exposition, gzipped, 'gzip')[0], 304)
+        # the etag of one encoding does not validate the other one.
+        self.assertEqual(exposition.build_response(self.exposition, plain, 'gzip')[0], 200)
+        self.assertEqual(exposition.build_response(self.exposition, gzipped, '')[0], 200)
+
+
+class _Store(object):
+
+    generation = 1
+
+
+class _Collector(object):
+
+    def collect(self):
+        yield GaugeMetricFamily('hadoop_namenode_up', 'up', value=1)
+
+
+class AsyncMetricsServerTest(unittest.TestCase):
+
+    def setUp(self):
+        # take the low file descriptors first, so the server sockets are beyond what select can watch.
+        self.held = [socket.socketpair() for _ in range(520)]
+        registry = CollectorRegistry()
+        registry.register(_Collector())
+        self.server = exposition.AsyncMetricsServer(('127.0.0.1', 0), exposition.ExpositionCache(_Store(), registry))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown(wait=True)
+        self.thread.join()
+        for a, b in self.held:
+            a.close()
+            b.close()
+
+    def scrape(self):
+        conn = httplib.HTTPConnection(*self.server.server_address, timeout=5)
+        try:
+            conn.request('GET', '/metrics')
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def test_high_file_descriptors(self):
+        self.assertGreater(self.server._sock.fileno(), 1024)
+        status, body = self.scrape()
+        self.assertEqual(status, 200)
+        self.assertIn(b'hadoop_namenode_up 1.0', body)
+
+    def test_connection_error(self):
+        parse = self.server._parse
+
+        def fail(conn):
+            self.server._parse = parse
+            raise ValueError('broken request')
+        self.server._parse = fail
+        self.assertRaises((httplib.HTTPException, socket.error), self.scrape)
+        # only that connection is closed, the server goes on.
+        self.assertEqual(self.scrape()[0], 200)
+        self.assertTrue(self.thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+import fetcher
+import utils
+
+
+class _Breaker(object):
+
+    state = 'closed'
+
+    def __init__(self):
+        self.outcomes = []
+
+    def allow(self, now=None):
+        return True
+
+    def success(self):
+        self.outcomes.append('success')
+
+    def failure(self, now=None):
+        self.outcomes.append('failure')
+
+
+class FetchAllTest(unittest.TestCase):
+
+    def setUp(self):
+        self.get_metrics = utils.get_metrics
+        self.breaker = _Breaker()
+        self.fetcher = fetcher.Fetcher(max_workers=1, timeout=0.1, deadline=1)
+        self.fetcher._breaker = lambda url: self.breaker
+
+    def tearDown(self):
+        utils.get_metrics = self.get_metrics
+
+    def fetch(self, error):
+        def get_metrics(url, timeout=None, keep=None, stats=None, raw=False):
+            # outlives the deadline of the job.
+            time.sleep(0.3)
+            stats['error'] = error
+            return [] if error else {'beans': []}
+        utils.get_metrics = get_metrics
+        results = self.fetcher.fetch_all(['http://nn:50070/jmx'])
+        self.assertEqual(results['http://nn:50070/jmx'].stats['error'], 'deadline')
+        # let the given up request finish.
+        self.fetcher._executor.shutdown(wait=True)
+
+    def test_expired_failure_once(self):
+        self.fetch('timeout')
+        self.assertEqual(self.breaker.outcomes, ['failure'])
+
+    def test_expired_not_undone(self):
+        # the late answer of a job given up does not close the breaker again.
+        self.fetch(None)
+        self.assertEqual(self.breaker.outcomes, ['failure'])
+
+
+if __name__ == '__main__':
+    unittest.main()
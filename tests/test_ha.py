@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import ha
+import scheduler
+from fetcher import FetchResult
+from scheduler import Scheduler
+from tests.fakes import FakeClock, FakeFetcher
+
+NN1 = 'http://nn1:50070/jmx'
+NN2 = 'http://nn2:50070/jmx'
+
+
+class HARouterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.time = scheduler.time, ha.time
+        scheduler.time = ha.time = self.clock = FakeClock()
+        # url -> HA state, None for a host which is down.
+        self.states = {NN1: 'standby', NN2: 'active'}
+        self.fetcher = FakeFetcher(self.answer)
+        self.scheduler = Scheduler(fetcher=self.fetcher)
+        self.router = ha.HARouter('namenode', [NN1, NN2], 30)
+        self.scheduler.add_target('namenode', NN1, 10, router=self.router)
+
+    def tearDown(self):
+        scheduler.time, ha.time = self.time
+
+    def answer(self, url):
+        base, _, query = url.partition('?qry=')
+        if self.states[base] is None:
+            return None
+        if query:
+            return [{'name': query, 'tag.HAState': self.states[base]}]
+        return [{'name': 'Hadoop:service=NameNode,name=FSNamesystem', 'tag.HAState': self.states[base]}]
+
+    def poll(self, seconds=10):
+        '''
+        @return the urls fetched by the poll, the probes first if any.
+        '''
+        self.clock.now += seconds
+        self.fetcher.fetched = []
+        self.scheduler.poll()
+        return self.fetcher.fetched
+
+    def test_failover(self):
+        probes = sorted(self.router.probe_urls)
+        self.assertEqual(probes, [NN1 + '?qry=Hadoop:service=NameNode,name=FSNamesystem',
+                                  NN2 + '?qry=Hadoop:service=NameNode,name=FSNamesystem'])
+        # the first poll probes both hosts and follows the active one.
+        self.assertEqual(self.poll(), [probes, [NN2]])
+        self.assertEqual(self.router.states, {NN1: 'standby', NN2: 'active'})
+        self.assertEqual(self.router.failovers, 1)
+
+        # the states are trusted for the ttl, even when they changed meanwhile.
+        self.states = {NN1: 'active', NN2: 'standby'}
+        self.assertEqual(self.poll(), [[NN2]])
+        self.assertEqual(self.poll(), [[NN2]])
+        # the ttl is over, probe again.
+        self.assertEqual(self.poll(), [probes, [NN1]])
+        self.assertEqual(self.router.failovers, 2)
+
+        # the active host dies: the failed poll expires the cache, the next poll probes and fails over.
+        self.states = {NN1: None, NN2: 'active'}
+        self.assertEqual(self.poll(), [[NN1]])
+        self.assertEqual(self.poll(), [probes, [NN2]])
+        self.assertEqual(self.router.states, {NN1: None, NN2: 'active'})
+        self.assertEqual(self.router.failovers, 3)
+        self.assertEqual(self.scheduler.store.latest('namenode').url, NN2)
+
+    def test_no_active(self):
+        self.poll()
+        # both standby, e.g. in the middle of a failover: keep the current url instead of flapping.
+        self.states = {NN1: 'standby', NN2: 'standby'}
+        self.poll(30)
+        self.assertEqual(self.router.active, NN2)
+        self.assertEqual(self.router.failovers, 1)
+
+    def test_resourcemanager(self):
+        router = ha.HARouter('resourcemanager', ['http://rm1:8088/jmx', 'http://rm2:8088/jmx'], 30)
+        rm1, rm2 = sorted(router.probe_urls)
+        self.assertEqual(rm2, 'http://rm2:8088/jmx?qry=Hadoop:service=ResourceManager,name=RMInfo')
+        results = {rm1: FetchResult(rm1, {'beans': [{'name': 'RMInfo', 'State': 'STANDBY'}]}),
+                   rm2: FetchResult(rm2, {'beans': [{'name': 'RMInfo', 'State': 'active'}]})}
+        self.assertEqual(router.update(results), 'http://rm2:8088/jmx')
+        self.assertFalse(router.expired())
+        router.expire()
+        self.assertTrue(router.expired())
+
+
+if __name__ == '__main__':
+    unittest.main()
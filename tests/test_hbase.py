@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+import jmx_fixtures
+import jmx_stream
+import projection
+import spec
+from hadoop_exporter import HBaseMetricsCollector
+from scheduler import Snapshot, SnapshotStore
+
+REGIONS = "Hadoop:service=HBase,name=RegionServer,sub=Regions"
+
+
+def regions_bean(regions):
+    '''
+    @param regions: A list of (table, region id, read request count) in namespace "default".
+    '''
+    bean = {"name": REGIONS, "modelerType": "RegionServer,sub=Regions"}
+    for table, region, reads in regions:
+        prefix = "Namespace_default_table_{0}_region_{1}_metric_".format(table, region)
+        bean[prefix + "storeCount"] = 1
+        bean[prefix + "readRequestCount"] = reads
+    return bean
+
+
+class _Discovery(object):
+
+    def __init__(self, hosts):
+        self.hosts = hosts
+
+    def targets(self):
+        return dict(('c/hbase/regionserver/' + host, host) for host in self.hosts)
+
+
+class RegionRollupTest(unittest.TestCase):
+
+    def test_stream(self):
+        beans = jmx_fixtures.hbase_regionserver_beans('rs1')
+        body = jmx_fixtures.jmx_document(beans).encode('utf-8')
+        keep = projection.BeanMatcher(projection.get_queries("hbase", ["hbase", "common"],
+                                                             projection.HBASE_SKIPPED['regionserver']))
+        # pieces cutting names and values in the middle.
+        streamed = list(jmx_stream.iter_beans([body[i:i + 61] for i in range(0, len(body), 61)], keep))
+        folded = [bean for bean in streamed if bean['name'] == REGIONS][0]
+        rollup = spec.RegionRollup()
+        for attr, value in [bean for bean in beans if bean['name'] == REGIONS][0].items():
+            rollup.add(attr, value)
+        self.assertEqual(folded, rollup.bean())
+        self.assertFalse([attr for attr in folded if '_region_' in attr])
+        self.assertEqual(folded['Namespace_default_table_t0_metric_regions'], 8)
+        self.assertEqual(folded['Namespace_default_table_t0_metric_readRequestCount'], sum(5 * (r + 1) for r in range(8)))
+        self.assertEqual([bean for bean in streamed if bean['name'] != REGIONS],
+                         [bean for bean in beans if bean['name'] != REGIONS and keep(bean['name'])])
+
+
+class HBaseRegionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = SnapshotStore()
+        self.collector = HBaseMetricsCollector('c', self.store, {}, _Discovery(['rs1', 'rs2']))
+
+    def collect(self, rs1, rs2):
+        for host, regions in (('rs1', rs1), ('rs2', rs2)):
+            beans = [bean for bean in jmx_fixtures.hbase_regionserver_beans(host) if bean['name'] != REGIONS]
+            self.store.publish('c/hbase/regionserver/' + host, Snapshot('http://test/jmx', beans + [regions_bean(regions)],
+                                                                        time.time()))
+        values = {}
+        for family in self.collector.collect():
+            for sample in family.samples:
+                if sample[1].get('table') == 't0':
+                    self.assertEqual(sorted(sample[1]), ['cluster', 'namespace', 'table'])
+                    values[sample[0]] = sample[2]
+        return values['hadoop_hbase_table_read_request_count_total'], values['hadoop_hbase_table_regions']
+
+    def test_region_moves(self):
+        self.assertEqual(self.collect([('t0', 'a', 100), ('t0', 'b', 100)], [('t0', 'c', 50)]), (0, 3))
+        # region b moves to rs2 and counts from 0 there, the counter does not drop.
+        self.assertEqual(self.collect([('t0', 'a', 110)], [('t0', 'c', 55), ('t0', 'b', 3)]), (8, 3))
+        self.assertEqual(self.collect([('t0', 'a', 130)], [('t0', 'c', 57), ('t0', 'b', 3)]), (30, 3))
+        # the same polls scraped again.
+        self.assertEqual(self.collect([('t0', 'a', 130)], [('t0', 'c', 57), ('t0', 'b', 3)]), (30, 3))
+
+    def test_histograms(self):
+        # the ranges count the ops of the last 10s period only, the number of ops runs since the start of the server.
+        server = [bean for bean in jmx_fixtures.hbase_regionserver_beans('rs1') if bean['name'].endswith('sub=Server')][0]
+        server.update({"Get_num_ops": 123456789, "Get_TimeRangeCount_0-1": 50, "Get_TimeRangeCount_1-3": 30,
+                       "Get_TimeRangeCount_3-10": 15, "Get_TimeRangeCount_300-1000": 4, "Get_TimeRangeCount_60000-inf": 1})
+        self.store.publish('c/hbase/regionserver/rs1', Snapshot('http://test/jmx', [server], time.time()))
+        families = dict((family.name, family) for family in self.collector.collect())
+        get = families['hadoop_hbase_server_get_milliseconds']
+        self.assertEqual(get.type, 'gaugehistogram')
+        buckets = dict((sample[1]['le'], sample[2]) for sample in get.samples if sample[0].endswith('_bucket'))
+        self.assertEqual((buckets['1'], buckets['3'], buckets['10'], buckets['300'], buckets['1000']), (50, 80, 95, 95, 99))
+        self.assertEqual(buckets['600000'], 99)
+        self.assertEqual(buckets['+Inf'], 100)
+        self.assertEqual([sample[2] for sample in get.samples if sample[0].endswith('_gcount')], [100])
+        self.assertEqual(families['hadoop_hbase_server_get_num_ops'].samples[0][2], 123456789)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+import unittest
+
+import utils
+import workers
+
+
+class _Capture(logging.Handler):
+
+    def __init__(self, gate=None):
+        logging.Handler.__init__(self)
+        self.messages = []
+        self.gate = gate
+        self.entered = threading.Event()
+
+    def emit(self, record):
+        self.entered.set()
+        if self.gate is not None:
+            self.gate.wait()
+        self.messages.append(record.getMessage())
+
+
+class _Expensive(object):
+
+    formatted = 0
+
+    def __str__(self):
+        _Expensive.formatted += 1
+        return 'expensive'
+
+
+def _worker_handlers():
+    workers.logger.error("logged by a worker")
+    return [type(h).__name__ for h in workers.logger.handlers]
+
+
+class AsyncLoggingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loggers = []
+
+    def tearDown(self):
+        for logger in self.loggers:
+            logger.handlers = []
+
+    def start(self, capture, queue_size=100, rate_limit=0, rate_interval=60):
+        async_logging = utils.AsyncLogging([capture], queue_size, rate_limit, rate_interval)
+        logger = logging.getLogger('tests.logging.{0}'.format(len(self.loggers)))
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(async_logging.handler)
+        self.loggers.append(logger)
+        return async_logging, logger
+
+    def test_full_queue(self):
+        gate = threading.Event()
+        capture = _Capture(gate)
+        async_logging, logger = self.start(capture, queue_size=2)
+        logger.error("record 0")
+        capture.entered.wait(5)
+        started = time.time()
+        for i in range(1, 20):
+            logger.error("record %s", i)
+        # the thread is stuck in the handler, the caller is not.
+        self.assertLess(time.time() - started, 1)
+        self.assertEqual(async_logging.handler.dropped, 17)
+        gate.set()
+        async_logging.stop()
+        self.assertEqual(capture.messages, ["record 0", "17 log records dropped, the log queue was full.",
+                                            "record 1", "record 2"])
+
+    def test_rate_limit_call_site(self):
+        capture = _Capture()
+        async_logging, logger = self.start(capture, rate_limit=2)
+        for i in range(5):
+            logger.error("site a %s", i)
+        for i in range(5):
+            logger.error("site b %s", i)
+        async_logging.stop()
+        self.assertEqual(capture.messages, ["site a 0", "site a 1", "site b 0", "site b 1"])
+
+    def test_rate_limit_key(self):
+        capture = _Capture()
+        async_logging, logger = self.start(capture, rate_limit=2)
+        logger.error("first", extra={'key': 'rpc'})
+        logger.error("second", extra={'key': 'rpc'})
+        logger.error("third", extra={'key': 'rpc'})
+        logger.error("other", extra={'key': 'http'})
+        async_logging.stop()
+        self.assertEqual(capture.messages, ["first", "second", "other"])
+
+    def test_rate_limit_per_host(self):
+        capture = _Capture()
+        async_logging, logger = self.start(capture, rate_limit=1)
+        handlers, utils.logger.handlers = utils.logger.handlers, logger.handlers
+        try:
+            # nothing listens on port 1, every get fails at once.
+            for url in ['http://127.0.0.1:1/jmx', 'http://127.0.0.1:1/jmx?qry=Hadoop:*', 'http://127.0.0.2:1/jmx']:
+                stats = {}
+                utils.get_metrics(url, timeout=1, stats=stats)
+                self.assertEqual(stats['error'], 'connection')
+        finally:
+            utils.logger.handlers = handlers
+        async_logging.stop()
+        # one call site, but a budget per host.
+        self.assertEqual([m.split(',')[0] for m in capture.messages],
+                         ["Get http://127.0.0.1:1/jmx failed", "Get http://127.0.0.2:1/jmx failed"])
+
+    def test_suppressed_count(self):
+        rate_limit = utils._RateLimitFilter(1, 60)
+        records = [logging.makeLogRecord({'msg': 'failed', 'key': 'k', 'created': created})
+                   for created in (0, 1, 2, 3, 61)]
+        self.assertEqual([rate_limit.filter(r) for r in records], [True, False, False, False, True])
+        self.assertEqual(records[-1].getMessage(), "failed [3 similar messages suppressed]")
+
+    def test_module_logger_handlers(self):
+        logger = utils.get_module_logger('tests.logging.module')
+        self.loggers.append(logger)
+        self.assertIs(utils.get_module_logger('tests.logging.module'), logger)
+        self.assertEqual(len(logger.handlers), 1)
+
+    def test_debug_not_built(self):
+        logger = utils.get_module_logger('tests.logging.debug')
+        self.loggers.append(logger)
+        self.assertFalse(logger.isEnabledFor(logging.DEBUG))
+        make_record = logger.makeRecord
+        built = []
+        logger.makeRecord = lambda *args, **kwargs: built.append(args) or make_record(*args, **kwargs)
+        try:
+            logger.debug("payload %s", _Expensive())
+        finally:
+            del logger.makeRecord
+        self.assertEqual(built, [])
+        self.assertEqual(_Expensive.formatted, 0)
+
+    def test_worker_handlers(self):
+        pool = workers.ClassifyPool(workers=1)
+        try:
+            self.assertEqual(pool._executor.submit(_worker_handlers).result(timeout=10), ['StreamHandler'])
+        finally:
+            pool.shutdown()
+        self.assertEqual([type(h).__name__ for h in workers.logger.handlers], ['_QueueHandler'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import rates
+import spec
+from scheduler import Snapshot
+
+NN1 = 'http://nn1:50070/jmx'
+NN2 = 'http://nn2:50070/jmx'
+
+
+def rpc_activity(num_ops, avg_time):
+    return {'name': 'Hadoop:service=NameNode,name=RpcActivityForPort8020', 'tag.port': '8020',
+            'RpcQueueTimeNumOps': num_ops, 'RpcQueueTimeAvgTime': avg_time}
+
+
+class RateDeriverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.deriver = rates.RateDeriver(spec.get_compiled_spec('namenode', ['namenode', 'common']), window=3)
+
+    def poll(self, timestamp, num_ops, avg_time, url=NN1):
+        self.deriver.on_snapshot(Snapshot(url, [rpc_activity(num_ops, avg_time)], timestamp))
+        values = {}
+        for family in self.deriver.collect(['c']):
+            for sample in family.samples:
+                if sample[1] == {'cluster': 'c', 'tag': '8020', 'method': 'RpcQueueTime'}:
+                    values[sample[0][len('hadoop_namenode_rpc_method_'):]] = sample[2]
+        return (values.get('ops_per_second'), values.get('weighted_avg_time_milliseconds'),
+                values['time_milliseconds_total'])
+
+    def test_window(self):
+        # one poll gives no rate yet.
+        self.assertEqual(self.poll(1000, 0, 1), (None, None, 0))
+        self.assertEqual(self.poll(1010, 100, 2), (10, 2, 200))
+        # the average time is weighted by the ops of each poll: (100 * 2 + 200 * 3) / 300.
+        self.assertEqual(self.poll(1020, 300, 3), (15, 800.0 / 300, 800))
+        # the window holds 3 polls, the deltas of 1020 and 1030 remain: (200 + 300) ops in 20s.
+        self.assertEqual(self.poll(1030, 600, 4), (25, 3.6, 2000))
+
+    def test_restart(self):
+        for timestamp, num_ops in ((1000, 0), (1010, 100), (1020, 300)):
+            self.poll(timestamp, num_ops, 2)
+        # NumOps went down, the daemon restarted: its new count is the delta, the total time keeps going up.
+        self.assertEqual(self.poll(1030, 50, 2), (250.0 / 20, 2, 700))
+
+    def test_new_url(self):
+        for timestamp, num_ops in ((1000, 0), (1010, 100)):
+            self.poll(timestamp, num_ops, 2)
+        # a failover: the counter of the other daemon does not continue the old one.
+        self.assertEqual(self.poll(1020, 100000, 5, NN2), (None, None, 200))
+        self.assertEqual(self.poll(1030, 100100, 1, NN2), (10, 1, 300))
+
+    def test_skipped(self):
+        self.poll(1000, 0, 1)
+        self.poll(1010, 100, 2)
+        # a failed poll, and the same poll published again, change nothing.
+        self.deriver.on_snapshot(Snapshot(NN1, [], 1020))
+        self.assertEqual(self.poll(1010, 500, 9), (10, 2, 200))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import projection
+import scheduler
+import selfmetrics
+from scheduler import EMPTY_SNAPSHOT, Scheduler
+from tests.fakes import FakeClock, FakeFetcher
+
+NN = 'http://nn:50070/jmx'
+BEAN = {'name': 'Hadoop:service=NameNode,name=FSNamesystem', 'CapacityTotal': 100}
+NAME_NODE_INFO = 'Hadoop:service=NameNode,name=NameNodeInfo'
+STARTUP_PROGRESS = 'Hadoop:service=NameNode,name=StartupProgress'
+
+
+class StaleWhileRevalidateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.time = scheduler.time, selfmetrics.time, selfmetrics.stats
+        scheduler.time = selfmetrics.time = self.clock = FakeClock()
+        selfmetrics.stats = selfmetrics.ExporterStats()
+        self.up = True
+        self.fetcher = FakeFetcher(lambda url: [BEAN] if self.up else None)
+        self.scheduler = Scheduler(fetcher=self.fetcher, max_age=120)
+        self.scheduler.add_target('namenode', NN, 10)
+        self.published = []
+        self.scheduler.add_listener('namenode', self.published.append)
+
+    def tearDown(self):
+        scheduler.time, selfmetrics.time, selfmetrics.stats = self.time
+
+    def tick(self, seconds):
+        self.clock.now += seconds
+        self.scheduler.poll()
+        return self.scheduler.store.latest('namenode')
+
+    def age(self):
+        for family in selfmetrics.stats.collect('hadoop_exporter_'):
+            if family.name == 'hadoop_exporter_snapshot_age_seconds':
+                return dict((s.labels['target'], s.value) for s in family.samples)
+
+    def test_failure_recovery_and_max_age(self):
+        good = self.tick(0)
+        self.assertEqual(good.beans, (BEAN,))
+        self.assertEqual(good.timestamp, self.clock.now)
+        self.assertEqual(len(self.published), 1)
+        self.assertEqual(self.age(), {'namenode': 0.0})
+
+        # a failed poll publishes the last good snapshot again, the exposition is rendered again with its age, the
+        # listeners only see new beans.
+        self.up = False
+        generation = self.scheduler.store.generation
+        self.assertIs(self.tick(10), good)
+        self.assertEqual(self.scheduler.store.generation, generation + 1)
+        self.assertEqual(len(self.published), 1)
+        self.assertEqual(self.age(), {'namenode': 10.0})
+
+        # recovered, a new snapshot.
+        self.up = True
+        recovered = self.tick(10)
+        self.assertIsNot(recovered, good)
+        self.assertEqual(recovered.timestamp, self.clock.now)
+        self.assertEqual(len(self.published), 2)
+        self.assertEqual(self.age(), {'namenode': 0.0})
+
+        # down again, the last good snapshot is served up to the max age and dropped afterwards.
+        self.up = False
+        self.assertIs(self.tick(120), recovered)
+        self.clock.now += 1
+        self.assertIs(self.scheduler.store.latest('namenode'), EMPTY_SNAPSHOT)
+        self.assertEqual(self.age(), {'namenode': 121.0})
+        # the next failed poll has nothing left to serve, it publishes an empty snapshot.
+        expired = self.tick(0)
+        self.assertEqual(expired.beans, ())
+        self.assertEqual(expired.timestamp, self.clock.now)
+        self.assertEqual(len(self.published), 3)
+        self.assertEqual(self.age(), {'namenode': 121.0})
+
+    def test_never_polled(self):
+        # a host down from the start publishes an empty snapshot, there is nothing older to serve.
+        self.up = False
+        snapshot = self.tick(0)
+        self.assertEqual(snapshot.beans, ())
+        self.assertEqual(snapshot.timestamp, self.clock.now)
+        self.assertEqual(len(self.published), 1)
+        self.assertEqual(self.age(), {})
+
+    def test_target_max_age(self):
+        self.scheduler.add_target('namenode', NN, 10, max_age=30)
+        good = self.tick(0)
+        self.up = False
+        self.assertIs(self.tick(30), good)
+        self.clock.now += 1
+        self.assertIs(self.scheduler.store.latest('namenode'), EMPTY_SNAPSHOT)
+
+
+
+class TieredGroupsTest(unittest.TestCase):
+    '''
+    A NameNode polled every 10 seconds, its NameNodeInfo every minute and its StartupProgress every 5 minutes.
+    '''
+    def setUp(self):
+        self.time = scheduler.time, selfmetrics.time, selfmetrics.stats
+        scheduler.time = selfmetrics.time = self.clock = FakeClock()
+        selfmetrics.stats = selfmetrics.ExporterStats()
+        self.start = self.clock.now
+        # queries whose host does not answer.
+        self.down = set()
+        self.fetcher = FakeFetcher(self.answer)
+        self.scheduler = Scheduler(fetcher=self.fetcher, max_age=120)
+        self.queries = projection.get_queries('namenode', ['namenode', 'common']) + [NAME_NODE_INFO]
+        self.intervals = projection.get_query_intervals('namenode', ['namenode', 'common'])
+        self.scheduler.add_target('namenode', NN, 10, self.queries, intervals=self.intervals)
+        self.every = set(self.queries) - set([NAME_NODE_INFO, STARTUP_PROGRESS])
+
+    def tearDown(self):
+        scheduler.time, selfmetrics.time, selfmetrics.stats = self.time
+
+    def answer(self, url):
+        query = url.split('?qry=')[1]
+        if query in self.down:
+            return None
+        return [{'name': query, 'polled': self.clock.now}]
+
+    def tick(self, at):
+        '''
+        Poll at seconds after the start.
+        @return the set of queries fetched by the poll.
+        '''
+        self.clock.now = self.start + at
+        self.scheduler.poll()
+        return set(url.split('?qry=')[1] for url in self.fetcher.fetched[-1])
+
+    def test_intervals(self):
+        self.assertEqual(self.intervals, {NAME_NODE_INFO: 60, STARTUP_PROGRESS: 300})
+        self.assertEqual(len(self.every), len(self.queries) - 2)
+
+    def test_due_groups(self):
+        self.assertEqual(self.tick(0), set(self.queries))
+        for at in (10, 20, 30, 40):
+            self.assertEqual(self.tick(at), self.every)
+        # the polls drift, NameNodeInfo due at 60 is polled with the rest of the NameNode at 59 instead of alone.
+        self.assertEqual(self.tick(49), self.every)
+        for at in range(59, 300, 10):
+            expected = set(self.every)
+            if (at - 59) % 60 == 0:
+                expected.add(NAME_NODE_INFO)
+            if at == 299:
+                expected.add(STARTUP_PROGRESS)
+            self.assertEqual(self.tick(at), expected, at)
+        self.assertEqual(len(self.fetcher.fetched), 31)
+
+    def test_merge(self):
+        self.tick(0)
+        self.tick(10)
+        snapshot = self.scheduler.store.latest('namenode')
+        # the groups not due are carried over from their last poll, with its timestamp.
+        self.assertEqual(set(bean['name'] for bean in snapshot.beans), set(self.queries))
+        polled = dict((bean['name'], bean['polled']) for bean in snapshot.beans)
+        for bean in snapshot.beans:
+            self.assertEqual(snapshot.polled_at(bean), polled[bean['name']])
+        self.assertEqual(polled[NAME_NODE_INFO], self.start)
+        self.assertEqual(polled[STARTUP_PROGRESS], self.start)
+        self.assertEqual(polled[BEAN['name']], self.start + 10)
+        self.assertEqual(snapshot.timestamps[NAME_NODE_INFO], self.start)
+        self.assertEqual(snapshot.timestamps[BEAN['name']], self.start + 10)
+        self.assertEqual(snapshot.timestamp, self.start + 10)
+
+        # the NameNodeInfo polls fail from 60 on, its beans of 0 are kept for its interval and the max age.
+        self.down.add(NAME_NODE_INFO)
+        for at in range(20, 190, 10):
+            self.tick(at)
+            snapshot = self.scheduler.store.latest('namenode')
+            self.assertEqual(NAME_NODE_INFO in [bean['name'] for bean in snapshot.beans], at <= 180, at)
+            self.assertEqual(snapshot.timestamp, self.start + at)
+
+
+if __name__ == '__main__':
+    unittest.main()
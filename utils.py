@@ -3,62 +3,392 @@
 
 import sys
 import os
+import atexit
+import threading
+import time
 import requests
+import urllib3
 import argparse
 import logging
-import yaml
+import json
+import resource
+from collections import OrderedDict
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+try:
+    from Queue import Queue, Full
+except ImportError:
+    from queue import Queue, Full
 from config import Config
+import jmx_stream
 
 c = Config
 
+class _RateLimitFilter(logging.Filter):
+    '''
+    Let at most limit records of one key through per interval. The key is the call site of the record, or the "key"
+    given in extra, so a line logged in a loop over thousands of rpc methods is written limit times, not thousands.
+    The next record let through tells how many were suppressed.
+    '''
+    def __init__(self, limit, interval):
+        logging.Filter.__init__(self)
+        self._limit = limit
+        self._interval = interval
+        # key -> [window start, records let through, records suppressed].
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, 'key', None) or (record.name, record.pathname, record.lineno)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None and record.created - window[0] < self._interval:
+                if window[1] >= self._limit:
+                    window[2] += 1
+                    return False
+                window[1] += 1
+                return True
+            if len(self._windows) > 10000:
+                self._windows = dict((k, w) for k, w in self._windows.items() if record.created - w[0] < self._interval)
+            self._windows[key] = [record.created, 1, 0]
+        if window is not None and window[2]:
+            record.msg = "{0} [{1} similar messages suppressed]".format(record.msg, window[2])
+        return True
+
+
+class _QueueHandler(logging.Handler):
+    '''
+    Put the records into a bounded queue as they are, not formatted, a full queue drops them instead of blocking.
+    '''
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+
+class AsyncLogging(object):
+    '''
+    Write log records from one background thread: a logger thread only checks the level and the rate limit of a
+    record and queues it, the message is formatted and written by the thread, so logging never holds a poll or a
+    scrape on a disk write or on formatting a huge argument.
+    '''
+    def __init__(self, handlers, queue_size=Config.LOG_QUEUE_SIZE, rate_limit=Config.LOG_RATE_LIMIT,
+                 rate_interval=Config.LOG_RATE_INTERVAL):
+        '''
+        @param handlers: The handlers writing the records, e.g. a FileHandler.
+        @param queue_size: Max records waiting for the thread, the records beyond are dropped.
+        @param rate_limit: Max records of one call site per rate_interval seconds, 0 for no limit.
+        '''
+        self._handlers = handlers
+        self.handler = _QueueHandler(Queue(maxsize=queue_size))
+        self.handler.setLevel(min(h.level for h in handlers))
+        if rate_limit:
+            self.handler.addFilter(_RateLimitFilter(rate_limit, rate_interval))
+        self._thread = threading.Thread(target=self._run, name="logging")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        dropped = 0
+        while True:
+            record = self.handler.queue.get()
+            if record is None:
+                return
+            if self.handler.dropped != dropped:
+                self._handle(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.ERROR, 'levelname': 'ERROR', 'pathname': __file__,
+                    'msg': "{0} log records dropped, the log queue was full.".format(self.handler.dropped - dropped)}))
+                dropped = self.handler.dropped
+            self._handle(record)
+
+    def _handle(self, record):
+        for handler in self._handlers:
+            if record.levelno >= handler.level:
+                try:
+                    handler.handle(record)
+                except Exception:
+                    handler.handleError(record)
+
+    def stop(self, timeout=1.0):
+        '''
+        Write the records queued so far and stop the thread.
+        '''
+        try:
+            self.handler.queue.put(None, timeout=timeout)
+        except Full:
+            return
+        self._thread.join(timeout)
+        for handler in self._handlers:
+            handler.flush()
+
+
+_logging = None
+_logging_lock = threading.Lock()
+_LOG_FORMAT = '%(asctime)s %(filename)s[line:%(lineno)d]-[%(levelname)s]: %(message)s'
+
+
 def get_module_logger(mod_name):
     '''
     define a common logger template to record log.
+    All module loggers share one AsyncLogging, set up by the first call, later calls do not add handlers again.
     @param mod_name log module name.
     @return logger.
     '''
-    logger = logging.getLogger(mod_name)
-    logger.setLevel(logging.DEBUG)
-    # 设置日志文件handler，并设置记录级别
-    fh = logging.FileHandler("hadoop_exporter.log")
-    fh.setLevel(logging.ERROR)
+    global _logging
+    with _logging_lock:
+        if _logging is None:
+            # 设置日志文件handler，并设置记录级别
+            fh = logging.FileHandler(c.LOG_FILE)
+            fh.setLevel(logging.ERROR)
+
+            # 设置终端输出handler，并设置记录级别
+            sh = logging.StreamHandler()
+            sh.setLevel(logging.INFO)
 
-    # 设置终端输出handler，并设置记录级别
-    sh = logging.StreamHandler()
-    sh.setLevel(logging.INFO)
+            # 设置日志格式
+            fmt = logging.Formatter(fmt=_LOG_FORMAT)
+            fh.setFormatter(fmt)
+            sh.setFormatter(fmt)
 
-    # 设置日志格式
-    fmt = logging.Formatter(fmt='%(asctime)s %(filename)s[line:%(lineno)d]-[%(levelname)s]: %(message)s')
-    fh.setFormatter(fmt)
-    sh.setFormatter(fmt)
+            _logging = AsyncLogging([fh, sh])
+            atexit.register(_logging.stop)
 
+    logger = logging.getLogger(mod_name)
+    # nothing below the handlers level is written, so such a call returns before building a record.
+    logger.setLevel(_logging.handler.level)
     # 添加handler到logger对象
-    logger.addHandler(fh)
-    logger.addHandler(sh)
+    if _logging.handler not in logger.handlers:
+        logger.addHandler(_logging.handler)
     return logger
 
+
+def reset_logging_after_fork():
+    '''
+    Write the records of a forked process, e.g. a ClassifyPool worker, with a plain stderr handler. The process got
+    the log queue and its locks as the threads of the parent held them at the fork, but not the logging thread.
+    '''
+    global _logging_lock
+    _logging_lock = threading.Lock()
+    if _logging is None:
+        return
+    handler = logging.StreamHandler()
+    handler.setLevel(_logging.handler.level)
+    handler.setFormatter(logging.Formatter(fmt=_LOG_FORMAT))
+    queued, _logging.handler = _logging.handler, handler
+    for logger in list(logging.Logger.manager.loggerDict.values()):
+        if isinstance(logger, logging.Logger) and queued in logger.handlers:
+            logger.handlers = [handler if h is queued else h for h in logger.handlers]
+
 logger = get_module_logger(__name__)
 
-def get_metrics(url):
+
+class _CountingConnectionMixin(object):
+    '''
+    Count every real tcp connect, including the transparent reconnect of a dropped keep-alive connection.
+    '''
+    counts = {}
+    lock = threading.Lock()
+
+    def connect(self):
+        key = "{0}:{1}".format(self.host, self.port)
+        with _CountingConnectionMixin.lock:
+            _CountingConnectionMixin.counts[key] = _CountingConnectionMixin.counts.get(key, 0) + 1
+        return super(_CountingConnectionMixin, self).connect()
+
+
+class _CountingHTTPConnection(_CountingConnectionMixin, urllib3.connection.HTTPConnection):
+    pass
+
+
+class _CountingHTTPSConnection(_CountingConnectionMixin, urllib3.connection.HTTPSConnection):
+    pass
+
+
+class _CountingHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+
+class _CountingHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+
+def _host_port(url):
+    '''
+    @return "host:port" of the url with the default port of its scheme, as urllib3 names the connections it counts.
+    '''
+    parsed = urlparse(url)
+    port = parsed.port or {'http': 80, 'https': 443}.get(parsed.scheme)
+    return "{0}:{1}".format(parsed.hostname, port)
+
+
+class SessionPool(object):
+    '''
+    Keep one keep-alive requests.Session per host, so polls reuse tcp connections instead of paying a new handshake,
+    and ask Jetty for a gzip/deflate compressed body.
+    It also counts requests, tcp connects, and bytes on the wire versus decoded bytes of every host.
+    '''
+    HEADERS = {'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'}
+
+    def __init__(self, maxsize=c.FETCH_WORKERS):
+        '''
+        @param maxsize: Max number of idle connections kept for each host.
+        '''
+        self._maxsize = maxsize
+        self._sessions = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _get_session(self, host):
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                session.headers.update(self.HEADERS)
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self._maxsize)
+                adapter.poolmanager.pool_classes_by_scheme = {'http': _CountingHTTPConnectionPool,
+                                                              'https': _CountingHTTPSConnectionPool}
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+                self._stats[host] = {'requests': 0, 'wire_bytes': 0, 'decoded_bytes': 0}
+            return session
+
+    def get(self, url, **kwargs):
+        '''
+        Send a GET through the session of the url host and read the whole body.
+        '''
+        host = _host_port(url)
+        session = self._get_session(host)
+        response = session.get(url, **kwargs)
+        decoded = len(response.content)
+        self._account(host, response.raw.tell() or decoded, decoded)
+        return response
+
+    def stream(self, url, chunk_size=65536, **kwargs):
+        '''
+        Send a GET through the session of the url host without reading the body.
+        @return a tuple of (response, chunks), chunks yields the decompressed body piece by piece.
+        '''
+        host = _host_port(url)
+        session = self._get_session(host)
+        response = session.get(url, stream=True, **kwargs)
+        return response, self._iter_body(host, response, chunk_size)
+
+    def _iter_body(self, host, response, chunk_size):
+        decoded = 0
+        finished = False
+        try:
+            for chunk in response.iter_content(chunk_size):
+                decoded += len(chunk)
+                yield chunk
+            finished = True
+        finally:
+            if not finished:
+                # a half read connection can not go back to the pool.
+                response.close()
+            self._account(host, response.raw.tell() or decoded, decoded)
+
+    def _account(self, host, wire_bytes, decoded_bytes):
+        with self._lock:
+            stats = self._stats[host]
+            stats['requests'] += 1
+            stats['wire_bytes'] += wire_bytes
+            stats['decoded_bytes'] += decoded_bytes
+
+    def stats(self):
+        '''
+        @return a dict of "host:port" -> {requests, connections, reuse_ratio, wire_bytes, decoded_bytes}.
+        '''
+        rlt = {}
+        with self._lock:
+            for host, stats in self._stats.items():
+                connections = _CountingConnectionMixin.counts.get(host, 0)
+                requests_num = stats['requests']
+                rlt[host] = {
+                    'requests': requests_num,
+                    'connections': connections,
+                    'reuse_ratio': max(1.0 - float(connections) / requests_num, 0.0) if requests_num else 0.0,
+                    'wire_bytes': stats['wire_bytes'],
+                    'decoded_bytes': stats['decoded_bytes'],
+                }
+        return rlt
+
+
+session_pool = SessionPool()
+
+
+def get_pool_stats():
+    '''
+    @return connection pool stats of every polled host, see SessionPool.stats.
+    '''
+    return session_pool.stats()
+
+
+def get_metrics(url, timeout=5, keep=None, stats=None, raw=False):
     '''
     :param url: The jmx url, e.g. http://host1:50070/jmx,http://host1:8088/jmx, http://host2:19888/jmx...
-    :return a dict of all metrics scraped in the jmx url.
+    :param timeout: http connect and read timeout in seconds.
+    :param keep: A function of the bean name. If given, the response is parsed as a stream and only the beans
+                 it accepts are decoded, see jmx_stream.iter_beans.
+    :param stats: A dict filled with the cost of the request: "fetch" and "decode" seconds, decoded "bytes",
+                  and the "error" type if it failed.
+    :param raw: Do not decode the response, e.g. it is decoded by a workers.ClassifyPool, keep is then ignored.
+    :return a dict of all metrics scraped in the jmx url, or with raw a dict of the "body" bytes and its "encoding".
     '''
+    stats = stats if stats is not None else {}
+    stats.update(fetch=0.0, decode=0.0, bytes=0, error=None)
+    # the failures are rate limited per host and error type, a dead DataNode does not silence the others.
+    host = _host_port(url)
+    start = time.time()
     try:
-        response = requests.get(url, auth=("admin", "admin"), timeout=5)  # , params=params, auth=(self._user, self._password))
+        if keep is None or raw:
+            response = session_pool.get(url, auth=("admin", "admin"), timeout=timeout)  # , params=params, auth=(self._user, self._password))
+        else:
+            response, chunks = session_pool.stream(url, auth=("admin", "admin"), timeout=timeout)
     except Exception as e:
-        logger.error(e)
+        stats['error'] = 'timeout' if isinstance(e, requests.exceptions.Timeout) else 'connection'
+        logger.error("Get %s failed, error msg is: %s", url, e, extra={'key': (__name__, stats['error'], host)})
     else:    
         if response.status_code != requests.codes.ok:
-            logger.error("Get {0} failed, response code is: {1}.".format(url, response.status_code))
+            stats['error'] = 'http_status'
+            logger.error("Get %s failed, response code is: %s.", url, response.status_code,
+                         extra={'key': (__name__, stats['error'], host)})
+            # the body of a streamed response is not read, its connection can not go back to the pool.
+            response.close()
+            return []
+        if raw:
+            stats['bytes'] = len(response.content)
+            return {"body": response.content, "encoding": response.encoding or 'utf-8'}
+        try:
+            if keep is None:
+                stats['bytes'] = len(response.content)
+                stats['fetch'] = time.time() - start
+                result = response.json()
+                stats['decode'] = time.time() - start - stats['fetch']
+            else:
+                result = {"beans": list(jmx_stream.iter_beans(chunks, keep, response.encoding or 'utf-8', stats))}
+                stats['fetch'] = time.time() - start - stats['decode']
+        except Exception as e:
+            stats['error'] = 'parse'
+            logger.error("Parse %s failed, error msg is: %s", url, e, extra={'key': (__name__, stats['error'], host)})
             return []
-        result = response.json()
-        logger.debug(result)
         if result and "beans" in result:
             return result
         else:
-            logger.error("No metrics get in the {0}.".format(url))
+            stats['error'] = 'no_beans'
+            logger.error("No metrics get in the %s.", url, extra={'key': (__name__, stats['error'], host)})
             return []
+    finally:
+        if not stats['fetch']:
+            stats['fetch'] = time.time() - start
 
 def read_json_file(path_name, file_name):
     '''
@@ -69,13 +399,62 @@ def read_json_file(path_name, file_name):
     metric_name = "{0}.json".format(file_name)
     try:
         with open(os.path.join(metric_path, metric_name), 'r') as f:
-            metrics = yaml.safe_load(f)
+            # keep the attribute order of the spec file.
+            metrics = json.load(f, object_pairs_hook=OrderedDict)
             return metrics
     except Exception as e:
         logger.error("read metrics json file failed, error msg is: %s" %e)
         sys.exit(1)
 
 
+def read_targets_file(file_path):
+    '''
+    Read the clusters polled by one exporter process, e.g.
+    {
+        "cluster1": {"namenode": ["http://nn1:50070/jmx", "http://nn2:50070/jmx"], "resourcemanager": "http://rm1:8088/jmx", "interval": 15},
+        "cluster2": {"namenode": "http://host3:50070/jmx", "datanode_discovery": false},
+        "cluster3": {"hbase_master": ["http://hm1:16010/jmx", "http://hm2:16010/jmx"]}
+    }
+    A component with a list of urls is HA, the active one is polled. Every HBase Master of "hbase_master" is polled,
+    the RegionServers are the urls of "hbase_regionservers", or found from the active Master without it.
+    "interval" defaults to Config.POLL_INTERVAL, "max_age" to Config.SNAPSHOT_MAX_AGE and "datanode_discovery" to
+    Config.DATANODE_DISCOVERY.
+    @param file_path: Path of the targets json file.
+    @return an OrderedDict of cluster name -> dict of targets.
+    '''
+    options = ('namenode', 'resourcemanager', 'hbase_master', 'hbase_regionservers', 'interval', 'max_age', 'datanode_discovery')
+    try:
+        with open(file_path, 'r') as f:
+            clusters = json.load(f, object_pairs_hook=OrderedDict)
+        if not isinstance(clusters, dict) or not clusters:
+            raise ValueError("no cluster is described")
+        for cluster, targets in clusters.items():
+            if not isinstance(targets, dict):
+                raise ValueError("targets of {0} is not an object".format(cluster))
+            unknown = [k for k in targets if k not in options]
+            if unknown:
+                raise ValueError("unknown options {0} of {1}, expected {2}".format(unknown, cluster, list(options)))
+        return clusters
+    except Exception as e:
+        logger.error("read targets file failed, error msg is: %s" %e)
+        sys.exit(1)
+
+
+def get_process_memory():
+    '''
+    @return a tuple of (resident, peak resident) memory of this process in bytes.
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on mac os, in kilobytes elsewhere.
+    peak *= 1 if sys.platform == 'darwin' else 1024
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident = int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError, ValueError, IndexError):
+        resident = peak
+    return resident, max(resident, peak)
+
+
 def get_url_list():
 
     url_list = []
@@ -116,6 +495,7 @@ def get_active_host(cluster, component):
 def get_file_list(file_path_name):
     '''
     This function is to get all .json file name in the specified file_path_name.
+    Files starting with "_" are settings of the directory, e.g. _intervals.json, not metric specs.
     @param file_path: The file path name, e.g. namenode, ugi, resourcemanager ...
     @return a list of file name.
     '''
@@ -124,7 +504,8 @@ def get_file_list(file_path_name):
     files = os.listdir(json_path)
     rlt = []
     for i in range(len(files)):
-        rlt.append(files[i].split(".")[0])
+        if not files[i].startswith('_'):
+            rlt.append(files[i].split(".")[0])
     return rlt
 
 
@@ -143,53 +524,73 @@ def parse_args():
     )
     parser.add_argument(
         '-hdfs', '--namenode-url',
-        choices = get_url_list(),
         required=False,
         help='Hadoop hdfs metrics URL. (default "http://ip:port/jmx")',
         default=c.HDFS_ACTIVE_URL
     )
     parser.add_argument(
         '-resourcemanager', '--resourcemanager-url',
-        choices = get_url_list(),
         required=False,
         help='Hadoop resourcemanager metrics URL. (default "127.0.0.1:8088/jmx")',
         default=c.YARN_ACTIVE_URL
     )
+    parser.add_argument(
+        '-hdfs-standby', '--namenode-standby-url',
+        required=False,
+        help='Url of the other HA NameNode, the active one of the two is polled. (default None)',
+        default=None
+    )
+    parser.add_argument(
+        '-resourcemanager-standby', '--resourcemanager-standby-url',
+        required=False,
+        help='Url of the other HA ResourceManager, the active one of the two is polled. (default None)',
+        default=None
+    )
     parser.add_argument(
         '-dn', '--datanode-url',
-        choices = get_url_list(),
         required=False,
         help='Hadoop datanode metrics URL. (default "http://ip:port/jmx")',
         default=c.DATA_NODE1_URL
     )
     parser.add_argument(
         '-jn', '--journalnode-url',
-        choices = get_url_list(),
         required=False,
         help='Hadoop datanode metrics URL. (default "http://ip:port/jmx")',
         default=c.JOURNAL_NODE1_URL
     )
     parser.add_argument(
         '-mr', '--mapreduce2-url',
-        choices = get_url_list(),
         required=False,
         help='Hadoop datanode metrics URL. (default "http://ip:port/jmx")',
         default=c.MAPREDUCE2_URL
     )
     parser.add_argument(
         '-hbase', '--hbase-url',
-        choices = get_url_list(),
         required=False,
         help='Hadoop datanode metrics URL. (default "http://ip:port/jmx")',
         default=c.HBASE_ACTIVE_URL
     )
     parser.add_argument(
         '-hive', '--hive-url',
-        choices = get_url_list(),
         required=False,
         help='Hadoop datanode metrics URL. (default "http://ip:port/jmx")',
         default=c.HIVE_URL
     )
+    parser.add_argument(
+        '-t', '--targets-file',
+        metavar='file',
+        required=False,
+        help='A json file of the clusters to poll in this process, overrides --cluster and the url flags. (default None)',
+        default=None
+    )
+    parser.add_argument(
+        '-i', '--interval',
+        metavar='seconds',
+        required=False,
+        type=int,
+        help='Poll every jmx url in background with this interval. (default "{0}")'.format(c.POLL_INTERVAL),
+        default=c.POLL_INTERVAL
+    )
     parser.add_argument(
         '-p','--path',
         metavar='metrics_path',
@@ -0,0 +1,181 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import multiprocessing
+import os
+import threading
+import time
+from array import array
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import jmx_stream
+import projection
+import spec
+import utils
+from config import Config
+from utils import get_module_logger
+
+logger = get_module_logger(__name__)
+
+# the pid of the process importing this module, a worker forked from it has another one.
+_parent = os.getpid()
+_forked = False
+
+
+class Classifier(object):
+    '''
+    What a worker process needs to classify the beans of one target: the spec of its collector, and the base names of
+    the beans the main process still reads as beans, e.g. NameNodeInfo for the DataNode discovery, RMNMInfo, and the
+    NumOps / AvgTime pairs of the rates.
+    '''
+    def __init__(self, service, spec_dirs, labels=("cluster",), raw=()):
+        '''
+        @param service: Service name, e.g. "namenode".
+        @param spec_dirs: Spec directories, e.g. ["namenode", "common"].
+        @param labels: Leading label names of every family, as given to spec.get_compiled_spec.
+        @param raw: Base names of the beans passed back as they are, e.g. ["NameNodeInfo"].
+        '''
+        self.service = service
+        self.spec_dirs = list(spec_dirs)
+        self.labels = tuple(labels)
+        self.raw = list(raw)
+
+
+class ClassifiedRows(object):
+    '''
+    The classified beans of one jmx response in compact columns, cheap to pickle: row n is
+    (families[ids[n]], labels[n], values[n]), and the rows of the i-th bean are offsets[i]..offsets[i + 1].
+    '''
+    def __init__(self):
+        self.families = []
+        self.ids = array('I')
+        self.labels = []
+        self.values = array('d')
+        self.bean_names = []
+        self.offsets = array('I', [0])
+        # the beans of the Classifier.raw kinds, as they are.
+        self.beans = []
+
+    def __len__(self):
+        return len(self.values)
+
+
+def iter_rows(classified):
+    '''
+    Merge the rows of several responses of one target, a bean matched by more than one query is kept once.
+    @param classified: A list of ClassifiedRows.
+    @return a generator of (family name, label values without the leading labels, value), see spec.CompiledSpec.add_rows.
+    '''
+    names = set()
+    for rows in classified:
+        families, ids, labels, values = rows.families, rows.ids, rows.labels, rows.values
+        for i, name in enumerate(rows.bean_names):
+            if name in names:
+                continue
+            names.add(name)
+            for n in range(rows.offsets[i], rows.offsets[i + 1]):
+                yield families[ids[n]], labels[n], values[n]
+
+
+def _after_fork():
+    '''
+    Set up the worker process once, before it runs its first job.
+    '''
+    global _forked
+    if not _forked and os.getpid() != _parent:
+        _forked = True
+        utils.reset_logging_after_fork()
+
+
+def classify(classifier, body, encoding='utf-8', keep=None):
+    '''
+    Decode a jmx response body and classify its beans, runs in a worker process.
+    @param keep: A function of the bean name, only the beans it accepts are decoded, see jmx_stream.iter_beans.
+    @return the pickled tuple of (ClassifiedRows, dict of "decode" and "classify" seconds, and the "started" and
+            "finished" unix times of the worker).
+    '''
+    _after_fork()
+    stats = {'started': time.time(), 'decode': 0.0}
+    if keep is None:
+        beans = json.loads(body.decode(encoding))['beans']
+        stats['decode'] = time.time() - stats['started']
+    else:
+        beans = list(jmx_stream.iter_beans([body], keep, encoding, stats))
+    started = time.time()
+    compiled = spec.get_compiled_spec(classifier.service, classifier.spec_dirs, classifier.labels)
+    index = projection.BeanIndex(beans)
+    rows = ClassifiedRows()
+    ids = {}
+    for kind, bean in compiled.select(index):
+        for family, label_values, value in compiled.bean_rows(bean, kind):
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                continue
+            if family not in ids:
+                ids[family] = len(rows.families)
+                rows.families.append(family)
+            rows.ids.append(ids[family])
+            rows.labels.append(tuple(label_values))
+            rows.values.append(value)
+        rows.bean_names.append(bean.get('name'))
+        rows.offsets.append(len(rows.values))
+    for name in classifier.raw:
+        rows.beans.extend(index.find(name))
+    stats['classify'] = time.time() - started
+    stats['finished'] = time.time()
+    return pickle.dumps((rows, stats), pickle.HIGHEST_PROTOCOL)
+
+
+def _ping():
+    _after_fork()
+    return os.getpid()
+
+
+class ClassifyPool(object):
+    '''
+    Decode and classify jmx responses in worker processes, so one huge NameNode payload burns its own core instead of
+    holding the GIL every other target and scrape of the exporter needs. Only the compact ClassifiedRows come back.
+    '''
+    def __init__(self, workers=Config.PROCESS_WORKERS):
+        '''
+        @param workers: Number of worker processes, 0 for one per cpu.
+        '''
+        self.workers = workers or multiprocessing.cpu_count()
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        # at most one job per worker is submitted, so the time a job waits for a free worker is not taken for ipc.
+        self._slots = threading.Semaphore(self.workers)
+        # fork every worker now, before the schedulers start threads whose locks a later fork would copy held. The
+        # logging thread runs since utils is imported, a worker drops the logging state it copied, see _after_fork.
+        wait([self._executor.submit(_ping) for _ in range(self.workers)])
+
+    def classify(self, classifier, body, encoding='utf-8', keep=None, stats=None):
+        '''
+        @param classifier: The Classifier of the target.
+        @param body: The jmx response body bytes.
+        @param stats: A dict, "decode" and "classify" are increased by the seconds spent in the worker, "wait" by the
+                      seconds spent waiting for a free worker, "ipc" by the seconds spent passing the body to the
+                      worker and the rows back, and "ipc_bytes" by the size of both.
+        @return a dict with the raw "beans" and the classified "rows".
+        '''
+        stats = stats if stats is not None else {}
+        started = time.time()
+        with self._slots:
+            submitted = time.time()
+            payload = self._executor.submit(classify, classifier, body, encoding, keep).result()
+        rows, worker = pickle.loads(payload)
+        received = time.time()
+        stats['wait'] = stats.get('wait', 0.0) + submitted - started
+        for name in ('decode', 'classify'):
+            stats[name] = stats.get(name, 0.0) + worker[name]
+        stats['ipc'] = stats.get('ipc', 0.0) + max(0.0, worker['started'] - submitted) + max(0.0, received - worker['finished'])
+        stats['ipc_bytes'] = stats.get('ipc_bytes', 0) + len(body) + len(payload)
+        return {'beans': rows.beans, 'rows': rows}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)